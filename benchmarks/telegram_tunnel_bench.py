@@ -0,0 +1,110 @@
+"""
+Микробенчмарк горячего пути /mytelegram: разбор полей (_normalize_payload),
+подготовка текста (_prepare_text) и деление длинных сообщений на части.
+
+Запуск из корня репозитория:
+
+    python benchmarks/telegram_tunnel_bench.py
+    python benchmarks/telegram_tunnel_bench.py --number 20000 --repeat 7
+
+Печатает лучшее время одного вызова в микросекундах для каждого сценария и
+для смеси, близкой к реальному трафику (в основном короткие HTML-уведомления).
+"""
+
+from __future__ import annotations
+
+import argparse
+import random
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from services.telegram_split import split_message  # noqa: E402
+from services.telegram_tunnel import MAX_SAFE_MESSAGE_LENGTH, _normalize_payload, _prepare_text  # noqa: E402
+
+_REPORT_LINE = "Сборка <b>#{n}</b> завершена: <code>report_{n}.zip</code> (<i>{size} КБ</i>)"
+
+SCENARIOS: dict[str, dict] = {
+    "html_short": {
+        "text": _REPORT_LINE.format(n=1842, size=317),
+        "format": "html",
+        "kind": "single",
+        "disable_web_page_preview": True,
+    },
+    "plain_temporary": {
+        "text": "Проверка связи: сервер отвечает, задержка 42 мс.",
+        "format": "plain",
+        "kind": "temporary",
+        "delete_after_seconds": "30",
+    },
+    "markdown_escaped": {
+        "text": "Погода: -3.5°C (ощущается как -7), ветер 4.2 м/с [обновлено 12:00] #ufa _test_",
+        "format": "markdown",
+        "kind": "replace",
+        "message_id": "12345",
+    },
+    "markdownv2_progress": {
+        "text": "*Загрузка* файла `backup.tar`: 73% \\(146/200 МБ\\)",
+        "format": "markdownv2",
+        "kind": "replace",
+        "message_id": 777,
+        "wait": "false",
+    },
+    "html_long": {
+        "text": "\n".join(_REPORT_LINE.format(n=n, size=n % 900) for n in range(160)),
+        "format": "html",
+        "kind": "single",
+    },
+}
+
+# Доля сценариев в смеси: длинные сообщения редки, но дороги.
+MIX_WEIGHTS = {
+    "html_short": 55,
+    "plain_temporary": 15,
+    "markdown_escaped": 15,
+    "markdownv2_progress": 13,
+    "html_long": 2,
+}
+
+
+def handle(raw_payload: dict) -> list[str]:
+    payload = _normalize_payload(raw_payload)
+    text = _prepare_text(payload)
+    return split_message(text, payload["parse_mode"], MAX_SAFE_MESSAGE_LENGTH)
+
+
+def _best_microseconds(function, number: int, repeat: int) -> float:
+    return min(timeit.repeat(function, number=number, repeat=repeat)) / number * 1_000_000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Микробенчмарк подготовки сообщений /mytelegram")
+    parser.add_argument("--number", type=int, default=5000, help="вызовов в одном замере")
+    parser.add_argument("--repeat", type=int, default=5, help="замеров, берётся лучший")
+    args = parser.parse_args()
+
+    print(f"{'сценарий':<22}{'normalize':>12}{'prepare':>12}{'всего':>12}  (мкс/вызов)")
+    for name, raw_payload in SCENARIOS.items():
+        payload = _normalize_payload(raw_payload)
+        number = max(args.number // 20, 1) if name == "html_long" else args.number
+        normalize = _best_microseconds(lambda: _normalize_payload(raw_payload), number, args.repeat)
+        prepare = _best_microseconds(lambda: _prepare_text(payload), number, args.repeat)
+        total = _best_microseconds(lambda: handle(raw_payload), number, args.repeat)
+        print(f"{name:<22}{normalize:>12.2f}{prepare:>12.2f}{total:>12.2f}")
+
+    rng = random.Random(29)
+    mix = rng.choices(list(MIX_WEIGHTS), weights=list(MIX_WEIGHTS.values()), k=1000)
+    payloads = [SCENARIOS[name] for name in mix]
+
+    def run_mix() -> None:
+        for raw_payload in payloads:
+            handle(raw_payload)
+
+    mix_total = _best_microseconds(run_mix, max(args.number // 1000, 1), args.repeat) / len(payloads)
+    print(f"{'смесь':<22}{'':>12}{'':>12}{mix_total:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
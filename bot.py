@@ -1,5 +1,6 @@
 import os
 import asyncio
+import logging
 import uvicorn
 from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
@@ -10,6 +11,15 @@ from routers.filevault_api import router as filevault_router, public_router as f
 from routers.web import router as web_router
 from routers.telegram_tunnel_api import router as telegram_tunnel_router
 from routers.agents_api import router as agents_router
+from services.agents.jobs import agent_jobs
+from services.agents.retention import agent_retention
+from services.agents.writer import agent_writer
+from services.filevault.blobs import blob_store
+from services.filevault.catalog import get_catalog
+from services.filevault.resumable import upload_sessions
+from services.filevault.search import search_index
+from services.http_clients import http_clients
+from services.telegram_tunnel import telegram_deletions, telegram_edits, telegram_sender
 from services.keep_alive import start_keep_alive_task
 from utils.logger import log
 
@@ -32,7 +42,28 @@ app.include_router(agents_router)
 
 async def main():
     log("APP_LIFECYCLE", "Запуск изолированного сервиса автоподдержки (Keep-Alive)...")
+    # Общие HTTP-клиенты (Telegram, погода, проверка сети) живут столько же, сколько приложение.
+    http_clients.start()
+    # Расписание удаления временных сообщений Telegram восстанавливается из журнала.
+    telegram_deletions.start()
 
+    # Пока сервер держит хранилище, gc/compact из CLI не запустятся и не удалят принятые blob-ы.
+    if not blob_store.acquire_owner_lock():
+        log("APP_LIFECYCLE", "Хранилищем FileVault уже владеет другой процесс (обслуживание из CLI?)", level=logging.WARNING)
+    # Каталог FileVault поднимаем заранее, чтобы первый запрос не платил за обход диска.
+    await asyncio.to_thread(lambda: get_catalog().refresh())
+    # Счётчики ссылок на blob-ы — сразу после каталога, до первого удаления.
+    await asyncio.to_thread(blob_store.load_refs)
+    await upload_sessions.collect_garbage(force=True)
+    # Поисковый индекс читает содержимое текстовых файлов — строим его в фоне, не задерживая старт.
+    search_build_task = asyncio.create_task(asyncio.to_thread(search_index.build))
+
+    agent_writer.start()
+    agent_jobs.start()
+    # Задания, прерванные прошлым перезапуском, доигрываем в фоне — сервер стартует сразу.
+    agent_replay_task = asyncio.create_task(agent_jobs.replay_pending())
+    # Уборка data/agents: политики хранения и сжатие архива, раз в AGENTS_RETENTION_INTERVAL_SECONDS.
+    agent_retention.start()
     keep_alive_task = asyncio.create_task(start_keep_alive_task())
 
     port = int(os.environ.get("PORT", 8000))
@@ -42,6 +73,18 @@ async def main():
     server_task = asyncio.create_task(server.serve())
 
     await asyncio.gather(server_task, keep_alive_task)
+    search_build_task.cancel()
+    agent_replay_task.cancel()
+    await agent_retention.stop()
+    await agent_jobs.stop()
+    # Дописываем всё, что осталось в очереди группового писателя.
+    await agent_writer.stop()
+    # Досылаем отложенные правки и очередь Telegram, пока HTTP-клиенты ещё открыты.
+    await telegram_deletions.stop()
+    await telegram_edits.stop()
+    await telegram_sender.stop()
+    await http_clients.stop()
+    blob_store.release_owner_lock()
 
 
 if __name__ == "__main__":
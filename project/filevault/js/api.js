@@ -1,5 +1,5 @@
 // project/filevault/js/api.js
-import { API_BASE, OPEN_BASE, buildPublicUrl } from './config.js';
+import { API_BASE, OPEN_BASE, buildPublicUrl, RESUMABLE_CHUNK_BYTES, RESUMABLE_PARALLEL_PARTS, FILES_PAGE_SIZE, FILE_LIST_FIELDS, SEARCH_PAGE_SIZE } from './config.js';
 
 async function requestJson(url, options = {}) {
   const response = await fetch(url, {
@@ -19,9 +19,41 @@ export async function fetchDashboard() {
   const payload = await requestJson(`${API_BASE}/dashboard`);
   return payload.dashboard || null;
 }
-export async function fetchFiles() {
-  const payload = await requestJson(`${API_BASE}/files`);
-  return Array.isArray(payload.files) ? payload.files.map(normalizeFile) : [];
+export async function fetchFilesPage(cursor = null) {
+  const params = new URLSearchParams({ limit: String(FILES_PAGE_SIZE), fields: FILE_LIST_FIELDS });
+  if (cursor) params.set('cursor', cursor);
+  const payload = await requestJson(`${API_BASE}/files?${params}`);
+  return {
+    files: Array.isArray(payload.files) ? payload.files.map(normalizeFile) : [],
+    nextCursor: payload.next_cursor || null,
+  };
+}
+// Первая страница отдаётся в onPage сразу, остальные догружаются следом.
+export async function fetchFiles(onPage) {
+  const files = [];
+  let cursor = null;
+  do {
+    const page = await fetchFilesPage(cursor);
+    files.push(...page.files);
+    cursor = page.nextCursor;
+    if (onPage) onPage(files, Boolean(cursor));
+  } while (cursor);
+  return files;
+}
+// Результат поиска заменяет фильтр по имени целиком, поэтому забираем все страницы.
+export async function searchFiles(query, folderId = null) {
+  const params = new URLSearchParams({ q: query, limit: String(SEARCH_PAGE_SIZE), fields: 'file_id' });
+  if (folderId) params.set('folder_id', folderId);
+  else params.set('folder_id', 'null');
+  const fileIds = [];
+  let offset = 0;
+  do {
+    params.set('offset', String(offset));
+    const payload = await requestJson(`${API_BASE}/search?${params}`);
+    if (Array.isArray(payload.files)) fileIds.push(...payload.files.map(file => file.file_id));
+    offset = payload.has_more ? payload.next_offset : null;
+  } while (offset !== null);
+  return fileIds;
 }
 export async function fetchFolders() {
   const payload = await requestJson(`${API_BASE}/folders`);
@@ -55,6 +87,87 @@ export async function uploadFiles(fileList, folderId = null, onProgress) {
   const payload = await promise;
   return Array.isArray(payload.files) ? payload.files.map(normalizeFile) : [];
 }
+function resumableKey(file, folderId) {
+  return `filevault:upload:${folderId || 'root'}:${file.name}:${file.size}:${file.lastModified}`;
+}
+
+function putPart(uploadId, partNumber, blob, onPartProgress) {
+  return new Promise((resolve, reject) => {
+    const xhr = new XMLHttpRequest();
+    xhr.upload.addEventListener('progress', (e) => { if (e.lengthComputable) onPartProgress(e.loaded); });
+    xhr.addEventListener('load', () => {
+      if (xhr.status >= 200 && xhr.status < 300) resolve();
+      else reject(Object.assign(new Error(`HTTP ${xhr.status}`), { status: xhr.status }));
+    });
+    xhr.addEventListener('error', () => reject(new Error('Network error')));
+    xhr.open('PUT', `${API_BASE}/uploads/${encodeURIComponent(uploadId)}/parts/${partNumber}`);
+    xhr.setRequestHeader('Content-Type', 'application/octet-stream');
+    xhr.send(blob);
+  });
+}
+
+async function openUploadSession(file, folderId) {
+  const key = resumableKey(file, folderId);
+  const savedId = localStorage.getItem(key);
+  if (savedId) {
+    try {
+      const payload = await requestJson(`${API_BASE}/uploads/${encodeURIComponent(savedId)}`);
+      if (payload.upload) return payload.upload;
+    } catch (_) { /* сессия истекла — начинаем заново */ }
+    localStorage.removeItem(key);
+  }
+  const payload = await requestJson(`${API_BASE}/uploads`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ filename: file.name, size_bytes: file.size, content_type: file.type || null, folder_id: folderId, chunk_size: RESUMABLE_CHUNK_BYTES })
+  });
+  localStorage.setItem(key, payload.upload.upload_id);
+  return payload.upload;
+}
+
+// Возобновляемая загрузка: части уходят параллельно, каждая с повторами;
+// при обрыве и повторном вызове докачиваются только недостающие части.
+export async function uploadFileResumable(file, folderId = null, onProgress, { retries = 4, onRetry } = {}) {
+  const session = await openUploadSession(file, folderId);
+  const { upload_id: uploadId, chunk_size: chunkSize } = session;
+  const queue = [...session.missing_parts];
+  const inFlight = new Map();
+  let doneBytes = session.received_parts.reduce((sum, part) => sum + Math.min(chunkSize, file.size - part * chunkSize), 0);
+  const report = () => {
+    if (!onProgress) return;
+    let loaded = doneBytes;
+    inFlight.forEach(value => { loaded += value; });
+    onProgress(Math.min(100, (loaded / file.size) * 100));
+  };
+  report();
+
+  async function worker() {
+    while (queue.length) {
+      const part = queue.shift();
+      const blob = file.slice(part * chunkSize, Math.min(file.size, (part + 1) * chunkSize));
+      for (let attempt = 0; ; attempt++) {
+        try {
+          inFlight.set(part, 0);
+          await putPart(uploadId, part, blob, (loaded) => { inFlight.set(part, loaded); report(); });
+          inFlight.delete(part);
+          doneBytes += blob.size;
+          report();
+          break;
+        } catch (error) {
+          inFlight.delete(part);
+          if (attempt >= retries || error.status === 404) throw error;
+          if (onRetry) onRetry(part, attempt + 1);
+          await new Promise(r => setTimeout(r, Math.min(8000, 500 * 2 ** attempt)));
+        }
+      }
+    }
+  }
+
+  await Promise.all(Array.from({ length: Math.min(RESUMABLE_PARALLEL_PARTS, queue.length || 1) }, worker));
+  const payload = await requestJson(`${API_BASE}/uploads/${encodeURIComponent(uploadId)}/complete`, { method: 'POST' });
+  localStorage.removeItem(resumableKey(file, folderId));
+  return [normalizeFile(payload.file)];
+}
 export async function deleteFiles(fileIds) {
   return requestJson(`${API_BASE}/files/batch/delete`, { method: 'POST', body: JSON.stringify({ file_ids: fileIds }), headers: { 'Content-Type': 'application/json' } });
 }
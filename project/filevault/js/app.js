@@ -1,6 +1,6 @@
 // project/filevault/js/app.js (facade)
 
-import { createFolder, renameFolder, deleteFolder } from './api.js';
+import { createFolder, renameFolder, deleteFolder, searchFiles } from './api.js';
 import { state, elements, cacheElements } from './modules/state.js';
 import { selectFolder, toggleFileSelection, clearFileSelection, getSelectedFile } from './modules/navigation.js';
 import { setMessage, hideMessage, setBusy, renderFiles, renderAll } from './modules/ui.js';
@@ -20,9 +20,24 @@ function wireEvents() {
   elements.refreshButton.addEventListener('click', () => syncData());
   elements.folderRefreshButton.addEventListener('click', () => syncData());
 
+  let searchTimer = null;
   elements.searchInput.addEventListener('input', (e) => {
     state.query = e.target.value;
+    state.searchHits = null;
     renderFiles();
+    clearTimeout(searchTimer);
+    const query = state.query.trim();
+    if (query.length < 2 || state.currentFolderId === '__crpt__') return;
+    searchTimer = setTimeout(async () => {
+      try {
+        const hits = await searchFiles(query, state.currentFolderId);
+        if (state.query.trim() !== query) return;
+        state.searchHits = hits;
+        renderFiles();
+      } catch (error) {
+        setMessage(`Ошибка поиска: ${error.message}`, 'error');
+      }
+    }, 250);
   });
 
   elements.sortSelect.addEventListener('change', (e) => {
@@ -70,6 +85,7 @@ function wireEvents() {
     if (btn) {
       selectFolder(btn.dataset.folderId || null);
       renderAll();
+      if (state.query.trim()) elements.searchInput.dispatchEvent(new Event('input'));
     }
   });
 
@@ -1,5 +1,12 @@
 export const API_BASE = '/api/filevault';
 export const OPEN_BASE = '/files/open';
+export const RESUMABLE_THRESHOLD_BYTES = 8 * 1024 * 1024;
+export const RESUMABLE_CHUNK_BYTES = 8 * 1024 * 1024;
+export const RESUMABLE_PARALLEL_PARTS = 3;
+export const FILES_PAGE_SIZE = 200;
+// Больше 100 за запрос сервер поиска не отдаёт.
+export const SEARCH_PAGE_SIZE = 100;
+export const FILE_LIST_FIELDS = 'file_id,original_name,content_type,size_bytes,uploaded_at,folder_id,public_url';
 
 export function buildPublicUrl(value) {
     if (!value) return window.location.origin;
@@ -3,7 +3,8 @@
 import { state, elements } from './state.js';
 import { clearFileSelection } from './navigation.js';
 import { setMessage, hideMessage, setBusy, renderAll } from './ui.js';
-import { uploadFiles, updateFile, moveFiles, deleteFiles, deleteCrptFile } from '../api.js';
+import { uploadFiles, uploadFileResumable, updateFile, moveFiles, deleteFiles, deleteCrptFile } from '../api.js';
+import { RESUMABLE_THRESHOLD_BYTES } from '../config.js';
 import { uploadProgress } from '../upload-progress.js';
 import { syncData } from './sync.js';
 
@@ -17,7 +18,15 @@ export async function handleUpload(event) {
   try {
     for (const file of files) {
       uploadProgress.addFile(file.name);
-      await uploadFiles([file], state.currentFolderId === '__crpt__' ? null : state.currentFolderId, (progress) => uploadProgress.update(file.name, progress));
+      const targetFolderId = state.currentFolderId === '__crpt__' ? null : state.currentFolderId;
+      const onProgress = (progress) => uploadProgress.update(file.name, progress);
+      if (file.size > RESUMABLE_THRESHOLD_BYTES) {
+        await uploadFileResumable(file, targetFolderId, onProgress, {
+          onRetry: (part, attempt) => uploadProgress.setStatus(file.name, `Повтор части ${part + 1} (${attempt})`)
+        });
+      } else {
+        await uploadFiles([file], targetFolderId, onProgress);
+      }
       uploadProgress.complete(file.name);
     }
     uploadProgress.hideAfterDelay(2000);
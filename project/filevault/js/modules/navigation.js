@@ -12,7 +12,11 @@ export function getVisibleFiles() {
     filtered = state.crptFiles.map(f => ({ ...f, isCrpt: true, file_id: `crpt_${f.id}`, original_name: f.id + '.crpt', size_bytes: f.size || 0, uploaded_at: f.uploaded_at, public_url: `/api/filevault/crpt/open/${f.id}` }));
   }
 
-  if (query) {
+  if (query && state.searchHits && folderId !== '__crpt__') {
+    // Серверный поиск учитывает и содержимое файлов; пока ответа нет — фильтруем по имени.
+    const hits = new Set(state.searchHits);
+    filtered = filtered.filter(file => hits.has(file.file_id));
+  } else if (query) {
     filtered = filtered.filter(file => (file.original_name || '').toLowerCase().includes(query));
   }
   return sortFiles(filtered);
@@ -65,4 +69,5 @@ export function selectFolder(folderId) {
   state.currentFolderId = folderId === '__crpt__' ? '__crpt__' : (folderId || null);
   state.activeFileId = null;
   state.selectedFileIds.clear();
+  state.searchHits = null;
 }
@@ -8,6 +8,7 @@ export const state = {
   activeFileId: null,
   selectedFileIds: new Set(),
   query: '',
+  searchHits: null,
   sort: 'date-desc',
   viewMode: 'grid',
   pond: null,
@@ -7,16 +7,24 @@ import { renderAll, setMessage } from './ui.js';
 
 export async function syncData({ quiet = false } = {}) {
   try {
-    const [dashboard, folders, files, crpt] = await Promise.all([
+    let baseReady = false;
+    const filesPromise = fetchFiles((files) => {
+      // Следующие страницы дорисовываются по мере загрузки, не дожидаясь всего списка.
+      state.files = files;
+      if (baseReady) renderAll();
+    });
+    const [dashboard, folders, crpt] = await Promise.all([
       fetchDashboard(),
       fetchFolders(),
-      fetchFiles(),
       fetchCrptFiles()
     ]);
     state.dashboard = dashboard;
     state.folders = Array.isArray(folders) ? folders : [];
-    state.files = Array.isArray(files) ? files : [];
     state.crptFiles = Array.isArray(crpt) ? crpt : [];
+    baseReady = true;
+    renderAll();
+    const files = await filesPromise;
+    state.files = Array.isArray(files) ? files : [];
     syncSelectionWithFiles();
     renderAll();
     if (!quiet) setMessage('Данные обновлены', 'success');
@@ -29,6 +29,10 @@ class UploadProgress {
       div.querySelector('.progress-percent').textContent = `${Math.round(percent)}%`;
     }
   }
+  setStatus(filename, text) {
+    const div = this.items.get(filename);
+    if (div) div.querySelector('.progress-percent').textContent = text;
+  }
   complete(filename) {
     const div = this.items.get(filename);
     if (div) {
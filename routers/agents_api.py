@@ -1,10 +1,21 @@
 from __future__ import annotations
 
+import json
 from typing import Any, Dict
 
-from fastapi import APIRouter, Request, Response
+from fastapi import APIRouter, Body, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
 
-from services.agents.tunnel import get_agent_tunnel_status, handle_agent_request, read_agent_payload
+from services.agents.tunnel import (
+    get_agent_job_status,
+    get_agent_tunnel_status,
+    handle_agent_request,
+    prepare_agent_batch,
+    prepare_agent_stream,
+    read_agent_payload,
+    submit_agent_request,
+    wants_async,
+)
 
 router = APIRouter(prefix="/api/agents", tags=["agents"])
 
@@ -16,12 +27,79 @@ def _no_store(response: Response) -> None:
 
 @router.api_route("/inbox", methods=["GET", "POST"])
 async def agent_inbox(request: Request, response: Response) -> Dict[str, Any]:
-    """Приёмник команд для будущих серверных агентов."""
+    """Приёмник команд для будущих серверных агентов.
+
+    С mode=async (в теле или query) либо заголовком `Prefer: respond-async`
+    задание ставится в очередь и сразу возвращается 202 с request_id;
+    результат забирается через /api/agents/jobs/{request_id}.
+    """
     _no_store(response)
     payload = await read_agent_payload(request)
+    if wants_async(request, payload):
+        body = await submit_agent_request(request, payload)
+        accepted = JSONResponse(body, status_code=202, headers={"Location": body["status_url"]})
+        _no_store(accepted)
+        return accepted
     return await handle_agent_request(request, payload)
 
 
+@router.post("/batch")
+async def agent_batch(request: Request, response: Response, body: Any = Body(...)):
+    """Пакет команд: массив или {"commands": [...], "concurrency": N, "stream": true}.
+
+    Команды выполняются параллельно; по умолчанию ответ — все результаты
+    в исходном порядке. С stream=true (или Accept: application/x-ndjson)
+    результаты идут NDJSON-строками по мере готовности, последняя — сводка.
+    """
+    _no_store(response)
+    batch, stream = prepare_agent_batch(request, body)
+    if stream:
+        async def lines():
+            async for event in batch.stream():
+                yield json.dumps(event, ensure_ascii=False) + "\n"
+
+        streamed = StreamingResponse(lines(), media_type="application/x-ndjson")
+        _no_store(streamed)
+        return streamed
+
+    summary = await batch.wait()
+    return {"ok": True, "batch_id": batch.batch_id, "results": batch.results, "summary": summary}
+
+
+@router.api_route("/stream", methods=["GET", "POST"])
+async def agent_stream(request: Request):
+    """Выполнение команды с потоком событий (Server-Sent Events).
+
+    Первым сразу приходит `accepted`, затем промежуточные события агента
+    (`progress`/`partial`, если агент умеет stream), последним — `result`
+    в том же виде, что и ответ /inbox, либо `error`. Итоговый ответ, как
+    обычно, сохраняется в outbox, даже если клиент отключился раньше.
+    """
+    payload = await read_agent_payload(request)
+    events = prepare_agent_stream(request, payload)
+
+    async def lines():
+        event_id = 0
+        async for name, data in events:
+            if name == "ping":
+                # Комментарий SSE: держит соединение живым через прокси, клиенту не виден.
+                yield ": ping\n\n"
+                continue
+            event_id += 1
+            yield f"id: {event_id}\nevent: {name}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+    streamed = StreamingResponse(lines(), media_type="text/event-stream", headers={"X-Accel-Buffering": "no"})
+    _no_store(streamed)
+    return streamed
+
+
+@router.get("/jobs/{request_id}")
+async def agent_job_status(request_id: str, request: Request, response: Response) -> Dict[str, Any]:
+    """Статус асинхронного задания; после выполнения — ответ агента из outbox."""
+    _no_store(response)
+    return await get_agent_job_status(request, request_id)
+
+
 @router.get("/health")
 async def agent_health(response: Response) -> Dict[str, Any]:
     _no_store(response)
@@ -1,11 +1,9 @@
-import json
+import asyncio
 import mimetypes
 import os
 import re
-from collections import defaultdict
 from datetime import datetime, timezone
 from pathlib import Path
-from typing import Any
 from urllib.parse import quote
 from uuid import uuid4
 from pathlib import Path
@@ -13,7 +11,26 @@ from fastapi import APIRouter, HTTPException, Request
 from fastapi.responses import FileResponse, JSONResponse
 
 from fastapi import APIRouter, Body, File, Form, HTTPException, Request, UploadFile
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+
+from services.filevault.archive import ArchiveEntry, UniqueNames, iter_zip, safe_component
+from services.filevault.blobs import blob_store
+from services.filevault.catalog import get_catalog
+from services.filevault.delivery import build_blob_response
+from services.filevault.listing import (
+    DEFAULT_PAGE_SIZE,
+    MAX_PAGE_SIZE,
+    FileQuery,
+    ListingQueryError,
+    decode_cursor,
+    encode_cursor,
+    normalize_content_types,
+    normalize_timestamp,
+)
+from services.filevault.resumable import UploadSessionError, upload_sessions
+from services.filevault.search import search_index
+from services.filevault.topology import FOLDER_ID_RE, FolderTopology, folder_topology, sanitize_folder_name
+from services.filevault.uploads import UploadTooLargeError, sha256_file, stream_to_temp
 
 router = APIRouter(prefix="/api/filevault", tags=["filevault"])
 public_router = APIRouter(tags=["filevault-public"])
@@ -21,36 +38,29 @@ public_router = APIRouter(tags=["filevault-public"])
 UPLOAD_DIR = Path("data/filevault_uploads")
 UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
 
-FILES_META_GLOB = "*.json"
 FOLDERS_META_PATH = UPLOAD_DIR / "_folders.json"
 MAX_FILE_SIZE_BYTES = 50 * 1024 * 1024
-FOLDER_ID_RE = re.compile(r"^fld_[a-f0-9]{32}$")
 FILE_ID_RE = re.compile(r"^[a-f0-9]{32}$")
+CLIENT_RECORD_FIELDS = (
+    "file_id",
+    "original_name",
+    "storage_name",
+    "content_type",
+    "size_bytes",
+    "uploaded_at",
+    "folder_id",
+    "folder_name",
+    "folder_path",
+    "public_url",
+)
 
 
 def _now_iso() -> str:
     return datetime.now(timezone.utc).isoformat()
 
 
-def _json_read(path: Path, fallback: Any):
-    if not path.exists():
-        return fallback
-    try:
-        return json.loads(path.read_text(encoding="utf-8"))
-    except Exception:
-        return fallback
-
-
-def _json_write(path: Path, payload: Any) -> None:
-    path.write_text(json.dumps(payload, ensure_ascii=False, indent=2), encoding="utf-8")
-
-
-def _meta_path(file_id: str) -> Path:
-    return UPLOAD_DIR / f"{file_id}.json"
-
-
-def _blob_path(file_id: str) -> Path:
-    return UPLOAD_DIR / f"{file_id}.bin"
+def _blob_path(meta: dict) -> Path:
+    return blob_store.path_for_meta(meta)
 
 
 def _sanitize_filename(filename: str) -> str:
@@ -60,92 +70,32 @@ def _sanitize_filename(filename: str) -> str:
     return cleaned or "file"
 
 
-def _sanitize_folder_name(name: str) -> str:
-    cleaned = re.sub(r"[\r\n\t\x00]", " ", str(name or "")).strip()
-    cleaned = re.sub(r"\s+", " ", cleaned)
-    return cleaned[:96]
-
-
 def _guess_content_type(filename: str, fallback: str = "application/octet-stream") -> str:
     mime, _ = mimetypes.guess_type(filename)
     return mime or fallback
 
 
 def _load_meta(file_id: str) -> dict:
-    meta_path = _meta_path(file_id)
-    if not meta_path.exists():
+    meta = get_catalog().get(file_id)
+    if meta is None:
         raise HTTPException(status_code=404, detail="Файл не найден")
-
-    try:
-        payload = json.loads(meta_path.read_text(encoding="utf-8"))
-        if not isinstance(payload, dict):
-            raise ValueError("invalid meta payload")
-        return payload
-    except json.JSONDecodeError:
-        raise HTTPException(status_code=500, detail="Ошибка чтения метаданных файла")
+    return meta
 
 
 def _load_all_file_meta() -> list[dict]:
-    records: list[dict] = []
-    for meta_path in sorted(UPLOAD_DIR.glob(FILES_META_GLOB), key=lambda item: item.stat().st_mtime, reverse=True):
-        if meta_path.name == FOLDERS_META_PATH.name:
-            continue
-        try:
-            payload = json.loads(meta_path.read_text(encoding="utf-8"))
-        except Exception:
-            continue
-        if not isinstance(payload, dict):
-            continue
-        file_id = payload.get("file_id")
-        if not file_id or not FILE_ID_RE.fullmatch(str(file_id)):
-            continue
-        if not _blob_path(file_id).exists():
-            continue
-        records.append(payload)
-    return records
+    return get_catalog().all_records()
 
 
-def _load_folders() -> list[dict]:
-    payload = _json_read(FOLDERS_META_PATH, [])
-    if not isinstance(payload, list):
-        return []
-
-    folders: list[dict] = []
-    for item in payload:
-        if not isinstance(item, dict):
-            continue
-        folder_id = str(item.get("folder_id", ""))
-        if not FOLDER_ID_RE.fullmatch(folder_id):
-            continue
-        folders.append(
-            {
-                "folder_id": folder_id,
-                "name": _sanitize_folder_name(item.get("name", "")) or "Папка",
-                "parent_id": item.get("parent_id") if item.get("parent_id") in {None, ""} or FOLDER_ID_RE.fullmatch(str(item.get("parent_id"))) else None,
-                "created_at": item.get("created_at") or _now_iso(),
-                "updated_at": item.get("updated_at") or item.get("created_at") or _now_iso(),
-            }
-        )
-    return folders
+def _write_meta(meta: dict, size_bytes: int | None = None) -> dict:
+    return get_catalog().put(meta, size_bytes)
 
 
-def _save_folders(folders: list[dict]) -> None:
-    _json_write(FOLDERS_META_PATH, folders)
+def _topology() -> FolderTopology:
+    return folder_topology.get()
 
 
-def _folder_index(folders: list[dict] | None = None) -> dict[str, dict]:
-    folders = folders if folders is not None else _load_folders()
-    return {folder["folder_id"]: folder for folder in folders}
-
-
-def _folder_children_map(folders: list[dict]) -> dict[str | None, list[dict]]:
-    children: dict[str | None, list[dict]] = defaultdict(list)
-    for folder in folders:
-        parent_id = folder.get("parent_id")
-        children[parent_id].append(folder)
-    for items in children.values():
-        items.sort(key=lambda item: (item["name"].casefold(), item["created_at"]))
-    return children
+def _save_folder(folder: dict) -> None:
+    get_catalog().put_folder(folder)
 
 
 def _validate_folder_id(folder_id: str | None) -> str | None:
@@ -163,40 +113,14 @@ def _validate_file_id(file_id: str) -> str:
     return file_id
 
 
-def _ensure_folder_exists(folder_id: str | None, folders: list[dict] | None = None) -> None:
+def _ensure_folder_exists(folder_id: str | None, topology: FolderTopology | None = None) -> None:
     if folder_id is None:
         return
-    index = _folder_index(folders)
-    if folder_id not in index:
+    topology = topology or _topology()
+    if folder_id not in topology.index:
         raise HTTPException(status_code=404, detail="Папка не найдена")
 
 
-def _folder_path(folder_id: str | None, folders: list[dict] | None = None) -> list[str]:
-    if folder_id is None:
-        return ["Корень хранилища"]
-
-    index = _folder_index(folders)
-    chain: list[str] = []
-    current = index.get(folder_id)
-    guard = 0
-
-    while current:
-        chain.append(current["name"])
-        parent_id = current.get("parent_id")
-        if parent_id is None:
-            break
-        current = index.get(parent_id)
-        guard += 1
-        if guard > 256:
-            break
-
-    return ["Корень", *reversed(chain)]
-
-
-def _folder_path_label(folder_id: str | None, folders: list[dict] | None = None) -> str:
-    return " / ".join(_folder_path(folder_id, folders))
-
-
 def _build_public_url(file_id: str, request: Request | None = None) -> str:
     public_path = f"/files/open/{quote(file_id)}"
     if request is None:
@@ -204,208 +128,133 @@ def _build_public_url(file_id: str, request: Request | None = None) -> str:
     return str(request.base_url).rstrip("/") + public_path
 
 
-def _compute_folder_metrics(files: list[dict], folders: list[dict]) -> tuple[dict[str | None, dict[str, int]], dict[str, tuple[int, int]]]:
-    files_by_folder: dict[str | None, list[dict]] = defaultdict(list)
-    for file_record in files:
-        files_by_folder[file_record.get("folder_id")].append(file_record)
-
-    children_map = defaultdict(list)
-    for folder in folders:
-        children_map[folder.get("parent_id")].append(folder["folder_id"])
-
-    memo: dict[str | None, tuple[int, int]] = {}
-
-    def aggregate(folder_id: str | None) -> tuple[int, int]:
-        if folder_id in memo:
-            return memo[folder_id]
-
-        direct_files = files_by_folder.get(folder_id, [])
-        total_count = len(direct_files)
-        total_size = sum(int(item.get("size_bytes", 0) or 0) for item in direct_files)
-
-        for child_id in children_map.get(folder_id, []):
-            child_count, child_size = aggregate(child_id)
-            total_count += child_count
-            total_size += child_size
-
-        memo[folder_id] = (total_count, total_size)
-        return memo[folder_id]
-
-    folder_metrics: dict[str | None, dict[str, int]] = {}
-    for folder in folders:
-        count, size = aggregate(folder["folder_id"])
-        folder_metrics[folder["folder_id"]] = {"file_count": count, "size_bytes": size}
-
-    root_count, root_size = aggregate(None)
-    folder_metrics[None] = {"file_count": root_count, "size_bytes": root_size}
-    return folder_metrics, memo
-
-
-def _folder_tree_payload(folders: list[dict], metrics: dict[str | None, dict[str, int]]) -> list[dict]:
-    index = _folder_index(folders)
-    children_map = _folder_children_map(folders)
-
-    def build_node(folder: dict, level: int) -> dict:
-        folder_id = folder["folder_id"]
-        path_label = _folder_path_label(folder_id, folders)
-        child_nodes = children_map.get(folder_id, [])
-        return {
-            "folder_id": folder_id,
-            "name": folder["name"],
-            "parent_id": folder.get("parent_id"),
-            "level": level,
-            "path": path_label,
-            "file_count": metrics.get(folder_id, {}).get("file_count", 0),
-            "size_bytes": metrics.get(folder_id, {}).get("size_bytes", 0),
-            "has_children": bool(child_nodes),
-            "created_at": folder.get("created_at"),
-            "updated_at": folder.get("updated_at"),
-            "children": [build_node(index[child_id], level + 1) for child_id in child_nodes],
-        }
-
-    roots = [folder for folder in folders if folder.get("parent_id") is None]
-    roots.sort(key=lambda item: (item["name"].casefold(), item["created_at"]))
-    return [build_node(folder, 0) for folder in roots]
-
-
-def _folder_name(folder_id: str | None, folders: list[dict]) -> str:
-    if folder_id is None:
-        return "Корень"
-    return _folder_index(folders).get(folder_id, {}).get("name", "Папка")
-
-
-def _to_client_record(meta: dict, request: Request | None = None, folders: list[dict] | None = None) -> dict:
-    folders = folders if folders is not None else _load_folders()
+def _to_client_record(
+    meta: dict,
+    request: Request | None = None,
+    topology: FolderTopology | None = None,
+    fields: tuple[str, ...] | None = None,
+) -> dict:
+    """
+    Клиентское представление файла. fields ограничивает набор полей
+    (лишнее не вычисляется); имя и путь папки берутся из снимка topology.
+    """
+    fields = fields or CLIENT_RECORD_FIELDS
     file_id = meta["file_id"]
-    blob_path = _blob_path(file_id)
-    stat = blob_path.stat() if blob_path.exists() else None
     folder_id = meta.get("folder_id")
     folder_id = folder_id if folder_id in {None, ""} or FOLDER_ID_RE.fullmatch(str(folder_id)) else None
 
-    return {
-        "file_id": file_id,
-        "original_name": meta.get("original_name", file_id),
-        "storage_name": blob_path.name,
-        "content_type": meta.get("content_type", "application/octet-stream"),
-        "size_bytes": stat.st_size if stat else int(meta.get("size_bytes", 0) or 0),
-        "uploaded_at": meta.get("uploaded_at"),
-        "folder_id": folder_id,
-        "folder_name": _folder_name(folder_id, folders),
-        "folder_path": _folder_path_label(folder_id, folders),
-        "public_url": _build_public_url(file_id, request),
+    folder_name = folder_path = None
+    if "folder_name" in fields or "folder_path" in fields:
+        topology = topology or _topology()
+        folder_name = topology.name(folder_id or None)
+        folder_path = topology.label(folder_id or None)
+
+    values = {
+        "file_id": lambda: file_id,
+        "original_name": lambda: meta.get("original_name", file_id),
+        "storage_name": lambda: _blob_path(meta).name,
+        "content_type": lambda: meta.get("content_type", "application/octet-stream"),
+        "size_bytes": lambda: int(meta.get("size_bytes", 0) or 0),
+        "uploaded_at": lambda: meta.get("uploaded_at"),
+        "folder_id": lambda: folder_id,
+        "folder_name": lambda: folder_name,
+        "folder_path": lambda: folder_path,
+        "public_url": lambda: _build_public_url(file_id, request),
     }
+    return {name: values[name]() for name in fields}
 
 
-def _list_client_files(request: Request | None = None) -> list[dict]:
-    folders = _load_folders()
-    return [_to_client_record(meta, request, folders) for meta in _load_all_file_meta()]
-
-
-def _list_client_folders() -> list[dict]:
-    folders = _load_folders()
-    files = _load_all_file_meta()
-    metrics, _ = _compute_folder_metrics(files, folders)
-    tree = _folder_tree_payload(folders, metrics)
+def _query_flag(request: Request, name: str) -> bool:
+    return str(request.query_params.get(name, "")).lower() in {"1", "true", "yes"}
 
-    flattened: list[dict] = []
-
-    def walk(nodes: list[dict]) -> None:
-        for node in nodes:
-            flattened.append(node)
-            walk(node.get("children", []))
-
-    walk(tree)
-    flattened.insert(
-        0,
-        {
-            "folder_id": None,
-            "name": "Корень",
-            "parent_id": None,
-            "level": 0,
-            "path": "Корень хранилища",
-            "file_count": metrics.get(None, {}).get("file_count", 0),
-            "size_bytes": metrics.get(None, {}).get("size_bytes", 0),
-            "has_children": bool(tree),
-            "created_at": None,
-            "updated_at": None,
-            "children": tree,
-        },
-    )
-    return flattened
 
+def _parse_fields(raw: str | None) -> tuple[str, ...] | None:
+    if not raw:
+        return None
+    fields = tuple(dict.fromkeys(item.strip() for item in raw.split(",") if item.strip()))
+    unknown = [item for item in fields if item not in CLIENT_RECORD_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Неизвестные поля: {', '.join(unknown)}")
+    return fields or None
+
+
+def _parse_listing_query(request: Request, folder_ids: set[str | None] | None) -> FileQuery:
+    params = request.query_params
+    sort = params.get("sort") or "uploaded_at"
+    order = (params.get("order") or ("asc" if sort == "name" else "desc")).lower()
+    if order not in {"asc", "desc"}:
+        raise HTTPException(status_code=400, detail="order должен быть asc или desc")
+    descending = order == "desc"
+
+    cursor = params.get("cursor")
+    raw_limit = params.get("limit")
+    limit: int | None = None
+    if raw_limit is not None or cursor:
+        # Без limit и cursor отдаём всё сразу — так работают старые клиенты.
+        try:
+            limit = int(raw_limit) if raw_limit is not None else DEFAULT_PAGE_SIZE
+        except ValueError:
+            raise HTTPException(status_code=400, detail="limit должен быть числом")
+        limit = min(max(limit, 1), MAX_PAGE_SIZE)
 
-def _lookup_folder(folder_id: str) -> dict:
-    folders = _load_folders()
-    index = _folder_index(folders)
-    folder = index.get(folder_id)
-    if not folder:
-        raise HTTPException(status_code=404, detail="Папка не найдена")
-    return folder
+    try:
+        return FileQuery(
+            sort=sort,
+            descending=descending,
+            limit=limit,
+            after=decode_cursor(cursor, sort, descending) if cursor else None,
+            folder_ids=folder_ids,
+            content_types=normalize_content_types(params.get("content_type")),
+            uploaded_from=normalize_timestamp(params.get("uploaded_from")),
+            uploaded_to=normalize_timestamp(params.get("uploaded_to"), end_of_day=True),
+        )
+    except ListingQueryError as error:
+        raise HTTPException(status_code=400, detail=str(error))
 
 
-def _find_folder_siblings(folder: dict, folders: list[dict]) -> list[dict]:
-    siblings = [
-        item
-        for item in folders
-        if item.get("parent_id") == folder.get("parent_id") and item["folder_id"] != folder["folder_id"]
-    ]
-    return siblings
+def _folder_scope(folder_id: str | None, recursive: bool, topology: FolderTopology) -> set[str | None]:
+    return topology.subtree(folder_id) if recursive else {folder_id}
 
 
-def _folder_descendant_ids(folder_id: str, folders: list[dict] | None = None) -> list[str]:
-    folders = folders if folders is not None else _load_folders()
-    children_map = defaultdict(list)
-    for folder in folders:
-        children_map[folder.get("parent_id")].append(folder["folder_id"])
+def _list_files_page(request: Request, folder_ids: set[str | None] | None, topology: FolderTopology) -> dict:
+    query = _parse_listing_query(request, folder_ids)
+    fields = _parse_fields(request.query_params.get("fields"))
+    records = get_catalog().query(query)
 
-    collected: list[str] = []
+    has_more = query.limit is not None and len(records) > query.limit
+    if has_more:
+        records = records[: query.limit]
+    return {
+        "success": True,
+        "files": [_to_client_record(meta, request, topology, fields) for meta in records],
+        "next_cursor": encode_cursor(query, records[-1]) if has_more else None,
+        "has_more": has_more,
+    }
 
-    def walk(current_id: str) -> None:
-        for child_id in children_map.get(current_id, []):
-            collected.append(child_id)
-            walk(child_id)
 
-    walk(folder_id)
-    return collected
+def _release_blobs(records: list[dict]) -> None:
+    # Общий blob удаляется только вместе с последней ссылающейся на него записью.
+    for record in records:
+        blob_store.release(record)
 
 
 def _delete_files_by_ids(file_ids: list[str]) -> int:
-    removed = 0
-    for file_id in file_ids:
-        meta_path = _meta_path(file_id)
-        blob_path = _blob_path(file_id)
-        existed = False
-        if blob_path.exists():
-            blob_path.unlink()
-            existed = True
-        if meta_path.exists():
-            meta_path.unlink()
-            existed = True
-        if existed:
-            removed += 1
-    return removed
+    # Счётчики ссылок должны учесть удаляемые записи, пока те ещё в каталоге.
+    blob_store.load_refs()
+    removed = get_catalog().remove(file_ids)
+    _release_blobs(removed)
+    return len(removed)
 
 
 def _remove_folder(folder_id: str) -> int:
-    folders = _load_folders()
-    folder_ids = [folder_id, *_folder_descendant_ids(folder_id, folders)]
-    folder_set = set(folder_ids)
-
-    files_to_delete = []
-    for meta in _load_all_file_meta():
-        file_folder = meta.get("folder_id")
-        if file_folder in folder_set:
-            files_to_delete.append(meta["file_id"])
-
-    _delete_files_by_ids(files_to_delete)
-
-    remaining_folders = [folder for folder in folders if folder["folder_id"] not in folder_set]
-    _save_folders(remaining_folders)
-    return len(folder_set)
+    blob_store.load_refs()
+    folder_ids, removed = get_catalog().delete_folder_tree(folder_id)
+    _release_blobs(removed)
+    return len(folder_ids)
 
 
 def _validate_folder_name(name: str) -> str:
-    cleaned = _sanitize_folder_name(name)
+    cleaned = sanitize_folder_name(name)
     if not cleaned:
         raise HTTPException(status_code=400, detail="Название папки не может быть пустым")
     if len(cleaned) > 96:
@@ -415,10 +264,10 @@ def _validate_folder_name(name: str) -> str:
 
 @router.get("/dashboard")
 async def get_dashboard():
-    files = _load_all_file_meta()
-    folders = _load_folders()
+    catalog = get_catalog()
+    files_count, total_size = catalog.totals()
+    topology = _topology()
 
-    total_size = sum(int(item.get("size_bytes", 0) or 0) for item in files)
     stats = os.statvfs(str(UPLOAD_DIR))
     disk_total = stats.f_frsize * stats.f_blocks
     disk_free = stats.f_frsize * stats.f_bavail
@@ -429,14 +278,14 @@ async def get_dashboard():
         {
             "success": True,
             "dashboard": {
-                "files_count": len(files),
-                "folders_count": len(folders),
+                "files_count": files_count,
+                "folders_count": len(topology.folders),
                 "total_size_bytes": total_size,
                 "disk_total_bytes": disk_total,
                 "disk_free_bytes": disk_free,
                 "disk_used_bytes": disk_used,
                 "disk_used_percent": disk_used_percent,
-                "root_files_count": sum(1 for item in files if item.get("folder_id") in {None, ""}),
+                "root_files_count": catalog.folder_totals().get(None, (0, 0))[0],
             },
         }
     )
@@ -444,8 +293,21 @@ async def get_dashboard():
 
 @router.get("/files")
 async def list_files(request: Request):
-    files = _list_client_files(request)
-    return JSONResponse({"success": True, "files": files})
+    """Список файлов.
+
+    Необязательные параметры: sort (uploaded_at | name | size), order (asc | desc),
+    limit и cursor (из next_cursor предыдущей страницы), content_type (через
+    запятую, `image/*` — по префиксу), uploaded_from / uploaded_to (ISO-дата),
+    folder_id (`null` — корень) с recursive=true для всего поддерева, fields —
+    какие поля вернуть. Без limit и cursor возвращаются все файлы.
+    """
+    topology = _topology()
+    folder_ids = None
+    if "folder_id" in request.query_params:
+        folder_id = _validate_folder_id(request.query_params.get("folder_id"))
+        _ensure_folder_exists(folder_id, topology)
+        folder_ids = _folder_scope(folder_id, _query_flag(request, "recursive"), topology)
+    return JSONResponse(_list_files_page(request, folder_ids, topology))
 
 
 @router.post("/upload")
@@ -461,21 +323,21 @@ async def upload_files(request: Request, files: list[UploadFile] = File(...), fo
     if not files:
         return JSONResponse({"success": False, "error": "Файлы не переданы"}, status_code=400)
 
-    folders = _load_folders()
+    topology = _topology()
     resolved_folder_id: str | None = None
 
     # Приоритет 1: явный folder_id (обратная совместимость)
     if folder_id not in {None, "", "null"}:
         resolved_folder_id = _validate_folder_id(folder_id)
-        _ensure_folder_exists(resolved_folder_id, folders)
+        _ensure_folder_exists(resolved_folder_id, topology)
 
     # Приоритет 2: имя папки — ищем или создаём
     elif folder not in {None, "", "null"}:
         folder_name = _validate_folder_name(str(folder))
         # Ищем папку с таким именем в корне (parent_id is None)
         existing = None
-        for f in folders:
-            if f.get("parent_id") is None and f["name"].casefold() == folder_name.casefold():
+        for f in topology.children.get(None, []):
+            if f["name"].casefold() == folder_name.casefold():
                 existing = f
                 break
 
@@ -491,11 +353,10 @@ async def upload_files(request: Request, files: list[UploadFile] = File(...), fo
                 "created_at": _now_iso(),
                 "updated_at": _now_iso(),
             }
-            folders.append(new_folder)
-            _save_folders(folders)
+            _save_folder(new_folder)
             resolved_folder_id = new_folder["folder_id"]
-            # Перезагружаем folders, чтобы _to_client_record видел новую папку
-            folders = _load_folders()
+            # Новая папка сбросила снимок — берём свежий, чтобы _to_client_record её видел
+            topology = _topology()
 
     # Если ни folder_id, ни folder не указаны — resolved_folder_id остаётся None (корень)
 
@@ -504,28 +365,30 @@ async def upload_files(request: Request, files: list[UploadFile] = File(...), fo
     for uploaded_file in files:
         filename = _sanitize_filename(uploaded_file.filename)
         file_id = uuid4().hex
-        blob_path = _blob_path(file_id)
-        meta_path = _meta_path(file_id)
 
-        content = await uploaded_file.read()
-        if not content:
-            continue
-        if len(content) > MAX_FILE_SIZE_BYTES:
+        try:
+            temp_path = await asyncio.to_thread(blob_store.temp_path)
+            temp_path, size_bytes, sha256 = await stream_to_temp(uploaded_file, temp_path, MAX_FILE_SIZE_BYTES)
+        except UploadTooLargeError:
             raise HTTPException(status_code=413, detail=f"Файл '{filename}' слишком большой")
+        if temp_path is None:
+            continue
+        await asyncio.to_thread(blob_store.ingest_file, temp_path, sha256)
 
         content_type = uploaded_file.content_type or _guess_content_type(filename)
 
-        blob_path.write_bytes(content)
         meta = {
             "file_id": file_id,
             "original_name": filename,
             "content_type": content_type,
-            "size_bytes": len(content),
+            "size_bytes": size_bytes,
+            "sha256": sha256,
+            "storage": "cas",
             "uploaded_at": _now_iso(),
             "folder_id": resolved_folder_id,
         }
-        _json_write(meta_path, meta)
-        created.append(_to_client_record(meta, request, folders))
+        meta = await asyncio.to_thread(_write_meta, meta, size_bytes)
+        created.append(_to_client_record(meta, request, topology))
 
     if not created:
         return JSONResponse({"success": False, "error": "Не удалось сохранить ни одного файла"}, status_code=400)
@@ -537,7 +400,7 @@ async def upload_files(request: Request, files: list[UploadFile] = File(...), fo
 async def update_file(file_id: str, request: Request, payload: dict = Body(...)):
     file_id = _validate_file_id(file_id)
     meta = _load_meta(file_id)
-    folders = _load_folders()
+    topology = _topology()
 
     updated = False
 
@@ -550,7 +413,7 @@ async def update_file(file_id: str, request: Request, payload: dict = Body(...))
 
     if "folder_id" in payload:
         folder_id = _validate_folder_id(payload.get("folder_id"))
-        _ensure_folder_exists(folder_id, folders)
+        _ensure_folder_exists(folder_id, topology)
         meta["folder_id"] = folder_id
         updated = True
 
@@ -558,29 +421,26 @@ async def update_file(file_id: str, request: Request, payload: dict = Body(...))
         raise HTTPException(status_code=400, detail="Нет данных для обновления")
 
     meta["updated_at"] = _now_iso()
-    _json_write(_meta_path(file_id), meta)
-    return JSONResponse({"success": True, "file": _to_client_record(meta, request, folders)})
+    meta = _write_meta(meta)
+    return JSONResponse({"success": True, "file": _to_client_record(meta, request, topology)})
 
 
 @router.post("/files/batch/move")
 async def move_files_batch(request: Request, payload: dict = Body(...)):
     file_ids = payload.get("file_ids") or []
     folder_id = _validate_folder_id(payload.get("folder_id"))
-    folders = _load_folders()
-    _ensure_folder_exists(folder_id, folders)
+    topology = _topology()
+    _ensure_folder_exists(folder_id, topology)
 
     if not isinstance(file_ids, list) or not file_ids:
         raise HTTPException(status_code=400, detail="Список файлов пуст")
 
-    moved = []
-    for raw_file_id in file_ids:
-        file_id = _validate_file_id(str(raw_file_id))
-        meta = _load_meta(file_id)
-        meta["folder_id"] = folder_id
-        meta["updated_at"] = _now_iso()
-        _json_write(_meta_path(file_id), meta)
-        moved.append(_to_client_record(meta, request, folders))
+    normalized = list(dict.fromkeys(_validate_file_id(str(raw_file_id)) for raw_file_id in file_ids))
+    moved_meta = get_catalog().move(normalized, folder_id, _now_iso())
+    if len(moved_meta) != len(normalized):
+        raise HTTPException(status_code=404, detail="Файл не найден")
 
+    moved = [_to_client_record(meta, request, topology) for meta in moved_meta]
     return JSONResponse({"success": True, "files": moved})
 
 
@@ -600,26 +460,13 @@ async def delete_files_batch(payload: dict = Body(...)):
 async def get_file_info(file_id: str, request: Request):
     file_id = _validate_file_id(file_id)
     meta = _load_meta(file_id)
-    folders = _load_folders()
-    return JSONResponse({"success": True, "file": _to_client_record(meta, request, folders)})
+    return JSONResponse({"success": True, "file": _to_client_record(meta, request)})
 
 
 @router.delete("/files/{file_id}")
 async def delete_file(file_id: str):
     file_id = _validate_file_id(file_id)
-    meta_path = _meta_path(file_id)
-    blob_path = _blob_path(file_id)
-    existed = False
-
-    if blob_path.exists():
-        blob_path.unlink()
-        existed = True
-
-    if meta_path.exists():
-        meta_path.unlink()
-        existed = True
-
-    if not existed:
+    if not _delete_files_by_ids([file_id]):
         raise HTTPException(status_code=404, detail="Файл не найден")
 
     return JSONResponse({"success": True})
@@ -627,29 +474,12 @@ async def delete_file(file_id: str):
 
 @router.get("/folders")
 async def list_folders():
-    folders = _load_folders()
-    files = _load_all_file_meta()
-    metrics, _ = _compute_folder_metrics(files, folders)
-    tree = _folder_tree_payload(folders, metrics)
-
+    topology = _topology()
+    tree = topology.tree()
     return JSONResponse(
         {
             "success": True,
-            "folders": [
-                {
-                    "folder_id": None,
-                    "name": "Корень",
-                    "parent_id": None,
-                    "level": 0,
-                    "path": "Корень хранилища",
-                    "file_count": metrics.get(None, {}).get("file_count", 0),
-                    "size_bytes": metrics.get(None, {}).get("size_bytes", 0),
-                    "has_children": bool(tree),
-                    "created_at": None,
-                    "updated_at": None,
-                },
-                *[item for item in _folder_tree_payload(folders, metrics)],
-            ],
+            "folders": [topology.root_node(), *tree],
             "tree": tree,
         }
     )
@@ -657,12 +487,12 @@ async def list_folders():
 
 @router.post("/folders")
 async def create_folder(payload: dict = Body(...)):
-    folders = _load_folders()
+    topology = _topology()
     name = _validate_folder_name(str(payload.get("name", "")))
     parent_id = _validate_folder_id(payload.get("parent_id"))
-    _ensure_folder_exists(parent_id, folders)
+    _ensure_folder_exists(parent_id, topology)
 
-    sibling_names = {item["name"].casefold() for item in folders if item.get("parent_id") == parent_id}
+    sibling_names = {item["name"].casefold() for item in topology.children.get(parent_id, [])}
     if name.casefold() in sibling_names:
         raise HTTPException(status_code=409, detail="Папка с таким именем уже существует")
 
@@ -673,78 +503,38 @@ async def create_folder(payload: dict = Body(...)):
         "created_at": _now_iso(),
         "updated_at": _now_iso(),
     }
-    folders.append(folder)
-    _save_folders(folders)
-
-    files = _load_all_file_meta()
-    metrics, _ = _compute_folder_metrics(files, folders)
-    folder_payload = _folder_tree_payload(folders, metrics)
-    index = _folder_index(folders)
-    created = index[folder["folder_id"]]
-    created_payload = {
-        "folder_id": created["folder_id"],
-        "name": created["name"],
-        "parent_id": created.get("parent_id"),
-        "level": 0 if created.get("parent_id") is None else 1,
-        "path": _folder_path_label(created["folder_id"], folders),
-        "file_count": metrics.get(created["folder_id"], {}).get("file_count", 0),
-        "size_bytes": metrics.get(created["folder_id"], {}).get("size_bytes", 0),
-        "has_children": False,
-        "created_at": created.get("created_at"),
-        "updated_at": created.get("updated_at"),
-        "children": [],
-    }
+    _save_folder(folder)
 
-    return JSONResponse({"success": True, "folder": created_payload, "folders": [*folder_payload]})
+    topology = _topology()
+    created_payload = {**topology.node(folder["folder_id"]), "children": []}
+    return JSONResponse({"success": True, "folder": created_payload, "folders": topology.tree()})
 
 
 @router.patch("/folders/{folder_id}")
 async def rename_folder(folder_id: str, payload: dict = Body(...)):
     folder_id = _validate_folder_id(folder_id)
-    folders = _load_folders()
-    index = _folder_index(folders)
-    folder = index.get(folder_id)
+    topology = _topology()
+    folder = topology.index.get(folder_id)
     if not folder:
         raise HTTPException(status_code=404, detail="Папка не найдена")
 
     name = _validate_folder_name(str(payload.get("name", "")))
-    sibling_names = {item["name"].casefold() for item in folders if item.get("parent_id") == folder.get("parent_id") and item["folder_id"] != folder_id}
+    siblings = topology.children.get(folder["parent_id"] if folder["parent_id"] in topology.index else None, [])
+    sibling_names = {item["name"].casefold() for item in siblings if item["folder_id"] != folder_id}
     if name.casefold() in sibling_names:
         raise HTTPException(status_code=409, detail="Папка с таким именем уже существует")
 
-    folder["name"] = name
-    folder["updated_at"] = _now_iso()
-    _save_folders(folders)
+    folder = {**folder, "name": name, "updated_at": _now_iso()}
+    _save_folder(folder)
 
-    files = _load_all_file_meta()
-    metrics, _ = _compute_folder_metrics(files, folders)
-    return JSONResponse(
-        {
-            "success": True,
-            "folder": {
-                "folder_id": folder["folder_id"],
-                "name": folder["name"],
-                "parent_id": folder.get("parent_id"),
-                "level": 0,
-                "path": _folder_path_label(folder["folder_id"], folders),
-                "file_count": metrics.get(folder["folder_id"], {}).get("file_count", 0),
-                "size_bytes": metrics.get(folder["folder_id"], {}).get("size_bytes", 0),
-                "has_children": bool(_folder_descendant_ids(folder["folder_id"], folders)),
-                "created_at": folder.get("created_at"),
-                "updated_at": folder.get("updated_at"),
-                "children": [],
-            },
-        }
-    )
+    topology = _topology()
+    return JSONResponse({"success": True, "folder": {**topology.node(folder_id), "children": []}})
 
 
 @router.delete("/folders/{folder_id}")
 async def delete_folder(folder_id: str):
     folder_id = _validate_folder_id(folder_id)
-    folders = _load_folders()
-    index = _folder_index(folders)
-    if folder_id not in index:
-        raise HTTPException(status_code=404, detail="Папка не найдена")
+    _ensure_folder_exists(folder_id)
 
     removed_count = _remove_folder(folder_id)
     return JSONResponse({"success": True, "removed_folders": removed_count})
@@ -753,22 +543,264 @@ async def delete_folder(folder_id: str):
 @router.get("/folders/{folder_id}/contents")
 async def folder_contents(folder_id: str, request: Request):
     folder_id = _validate_folder_id(folder_id)
-    if folder_id is not None:
-        _lookup_folder(folder_id)
+    topology = _topology()
+    _ensure_folder_exists(folder_id, topology)
+
+    folder_ids = _folder_scope(folder_id, _query_flag(request, "recursive"), topology)
+    return JSONResponse(_list_files_page(request, folder_ids, topology))
+
+
+MAX_ARCHIVE_FILE_IDS = 1000
+
+
+def _archive_dirs(folder_id: str | None, base_depth: int, topology: FolderTopology) -> list[str]:
+    # Путь папки внутри архива: цепочка имён без «Корня» и без уровней выше выгружаемой папки.
+    chain = topology.paths.get(folder_id, ())[1:] if folder_id else ()
+    return [safe_component(name, "Папка") for name in chain[base_depth:]]
+
+
+@router.get("/archive")
+async def download_archive(request: Request):
+    """Скачивание ZIP-архива, собираемого на лету.
+
+    folder_id — папка со всеми вложенными (`null` — всё хранилище), либо
+    file_ids — список id через запятую. Структура папок сохраняется;
+    уже сжатые форматы (медиа, архивы, PDF) кладутся без повторного сжатия.
+    """
+    params = request.query_params
+    topology = _topology()
+
+    if "folder_id" in params:
+        folder_id = _validate_folder_id(params.get("folder_id"))
+        _ensure_folder_exists(folder_id, topology)
+        scope = topology.subtree(folder_id)
+        records = get_catalog().query(FileQuery(sort="name", descending=False, folder_ids=scope))
+        base_depth = topology.depth[folder_id] if folder_id else 0
+        archive_name = topology.name(folder_id) if folder_id else "filevault"
+        directories = sorted("/".join(_archive_dirs(item, base_depth, topology)) for item in scope - {None})
+    elif params.get("file_ids"):
+        file_ids = list(dict.fromkeys(item.strip() for item in str(params.get("file_ids")).split(",") if item.strip()))
+        if len(file_ids) > MAX_ARCHIVE_FILE_IDS:
+            raise HTTPException(status_code=400, detail=f"Не больше {MAX_ARCHIVE_FILE_IDS} файлов за раз")
+        catalog = get_catalog()
+        records = []
+        for file_id in file_ids:
+            meta = catalog.get(_validate_file_id(file_id))
+            if meta is None:
+                raise HTTPException(status_code=404, detail=f"Файл не найден: {file_id}")
+            records.append(meta)
+        base_depth = 0
+        archive_name = "filevault-files"
+        directories = []
+    else:
+        raise HTTPException(status_code=400, detail="Укажите folder_id или file_ids")
+
+    names = UniqueNames()
+    entries = []
+    for meta in records:
+        parts = _archive_dirs(meta.get("folder_id") or None, base_depth, topology)
+        arcname = names.claim("/".join([*parts, safe_component(meta.get("original_name") or meta["file_id"], meta["file_id"])]))
+        uploaded = meta.get("uploaded_at")
+        try:
+            modified = datetime.fromisoformat(str(uploaded)).astimezone() if uploaded else None
+        except ValueError:
+            modified = None
+        entries.append(
+            ArchiveEntry(
+                arcname=arcname,
+                path=_blob_path(meta),
+                content_type=meta.get("content_type") or _guess_content_type(arcname),
+                modified=modified,
+            )
+        )
+
+    filename = quote(f"{safe_component(archive_name, 'filevault')}.zip")
+    return StreamingResponse(
+        iter_zip(entries, [item for item in directories if item]),
+        media_type="application/zip",
+        headers={"content-disposition": f"attachment; filename*=UTF-8''{filename}", "cache-control": "no-store"},
+    )
+
+
+@router.get("/search")
+async def search_files(request: Request):
+    """Поиск по именам, путям папок и содержимому текстовых/JSON-файлов.
+
+    Параметры: q (слова ищутся по префиксу, все должны совпасть), limit,
+    offset (следующая страница — next_offset из ответа), folder_id с
+    recursive=true — искать только в поддереве, fields.
+    """
+    params = request.query_params
+    query = str(params.get("q") or "").strip()
+    if not query:
+        raise HTTPException(status_code=400, detail="Пустой поисковый запрос")
+    try:
+        limit = min(max(int(params.get("limit") or 20), 1), 100)
+        offset = max(int(params.get("offset") or 0), 0)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="limit и offset должны быть числами")
+    fields = _parse_fields(params.get("fields"))
+
+    topology = _topology()
+    folder_ids = None
+    if "folder_id" in params:
+        folder_id = _validate_folder_id(params.get("folder_id"))
+        _ensure_folder_exists(folder_id, topology)
+        folder_ids = _folder_scope(folder_id, _query_flag(request, "recursive"), topology)
+
+    # Порядок выдачи детерминирован (score, затем file_id), поэтому страницы по offset не пересекаются.
+    hits = await asyncio.to_thread(search_index.search, query, limit=offset + limit + 1, folder_ids=folder_ids)
+    has_more = len(hits) > offset + limit
+    hits = hits[offset:offset + limit]
+    catalog = get_catalog()
+    results = []
+    for hit in hits:
+        meta = catalog.get(hit["file_id"])
+        if meta is None:
+            continue
+        record = _to_client_record(meta, request, topology, fields)
+        results.append({**record, "score": hit["score"], "matched": hit["matched"]})
+    return JSONResponse({
+        "success": True,
+        "query": query,
+        "files": results,
+        "has_more": has_more,
+        "next_offset": offset + limit if has_more else None,
+    })
+
+
+def _upload_session_error(error: UploadSessionError) -> HTTPException:
+    return HTTPException(status_code=error.status_code, detail=error.detail)
+
+
+@router.post("/uploads")
+async def create_upload_session(payload: dict = Body(...)):
+    """Открывает сессию возобновляемой загрузки.
+
+    Тело: filename, size_bytes, необязательные content_type, folder_id, chunk_size.
+    Дальше клиент шлёт части `PUT /uploads/{upload_id}/parts/{n}` (n с нуля,
+    в любом порядке и параллельно) и завершает `POST /uploads/{upload_id}/complete`.
+    """
+    filename = _sanitize_filename(str(payload.get("filename") or payload.get("original_name") or ""))
+    folder_id = _validate_folder_id(payload.get("folder_id"))
+    _ensure_folder_exists(folder_id)
+
+    try:
+        size_bytes = int(payload.get("size_bytes"))
+        chunk_size = int(payload["chunk_size"]) if payload.get("chunk_size") else None
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="size_bytes и chunk_size должны быть числами")
+
+    try:
+        session = await upload_sessions.create(
+            filename=filename,
+            content_type=str(payload.get("content_type") or "") or _guess_content_type(filename),
+            folder_id=folder_id,
+            size_bytes=size_bytes,
+            chunk_size=chunk_size,
+        )
+    except UploadSessionError as error:
+        raise _upload_session_error(error)
+
+    return JSONResponse({"success": True, "upload": session.to_client()})
 
-    files = _load_all_file_meta()
-    folders = _load_folders()
 
-    folder_files = [_to_client_record(meta, request, folders) for meta in files if meta.get("folder_id") == folder_id]
-    return JSONResponse({"success": True, "files": folder_files})
+@router.get("/uploads/{upload_id}")
+async def get_upload_session(upload_id: str):
+    try:
+        session = await upload_sessions.get(upload_id)
+    except UploadSessionError as error:
+        raise _upload_session_error(error)
+    return JSONResponse({"success": True, "upload": session.to_client()})
 
 
-@public_router.get("/files/open/{file_id}")
-async def open_file(file_id: str):
+@router.put("/uploads/{upload_id}/parts/{part_number}")
+async def upload_session_part(upload_id: str, part_number: int, request: Request):
+    try:
+        session = await upload_sessions.write_part(upload_id, part_number, request.stream())
+    except UploadSessionError as error:
+        raise _upload_session_error(error)
+    return JSONResponse(
+        {
+            "success": True,
+            "part_number": part_number,
+            "received_count": len(session.received),
+            "total_parts": session.total_parts,
+        }
+    )
+
+
+@router.post("/uploads/{upload_id}/complete")
+async def complete_upload_session(upload_id: str, request: Request):
+    file_id = uuid4().hex
+    try:
+        session, sha256 = await upload_sessions.complete(upload_id, blob_store.ingest_file)
+    except UploadSessionError as error:
+        raise _upload_session_error(error)
+
+    topology = _topology()
+    folder_id = session.folder_id if session.folder_id in topology.index else None
+    meta = {
+        "file_id": file_id,
+        "original_name": session.filename,
+        "content_type": session.content_type,
+        "size_bytes": session.size_bytes,
+        "sha256": sha256,
+        "storage": "cas",
+        "uploaded_at": _now_iso(),
+        "folder_id": folder_id,
+    }
+    meta = await asyncio.to_thread(_write_meta, meta, session.size_bytes)
+    return JSONResponse({"success": True, "file": _to_client_record(meta, request, topology)})
+
+
+@router.delete("/uploads/{upload_id}")
+async def abort_upload_session(upload_id: str):
+    try:
+        await upload_sessions.abort(upload_id)
+    except UploadSessionError as error:
+        raise _upload_session_error(error)
+    return JSONResponse({"success": True})
+
+
+_hash_backfill_tasks: dict[str, asyncio.Task] = {}
+
+
+def _backfill_sha256(file_id: str) -> None:
+    meta = get_catalog().get(file_id)
+    if meta is None or meta.get("sha256"):
+        return
+    # Пока считался хеш, файл могли переименовать или удалить: пишем только
+    # sha256 в актуальные метаданные и ничего — если файла уже нет.
+    try:
+        sha256 = sha256_file(_blob_path(meta))
+    except OSError:
+        return
+    get_catalog().update_fields(file_id, {"sha256": sha256}, expect_size=meta.get("size_bytes"))
+
+
+def _schedule_sha256_backfill(file_id: str) -> None:
+    """Файлам, загруженным до появления хеша, досчитываем его в фоне один раз."""
+    if file_id in _hash_backfill_tasks:
+        return
+    task = asyncio.create_task(asyncio.to_thread(_backfill_sha256, file_id))
+    _hash_backfill_tasks[file_id] = task
+    task.add_done_callback(lambda _: _hash_backfill_tasks.pop(file_id, None))
+
+
+def _uploaded_timestamp(meta: dict) -> float | None:
+    try:
+        return datetime.fromisoformat(str(meta.get("uploaded_at"))).timestamp()
+    except ValueError:
+        return None
+
+
+@public_router.api_route("/files/open/{file_id}", methods=["GET", "HEAD"])
+async def open_file(file_id: str, request: Request):
     file_id = _validate_file_id(file_id)
 
     meta = _load_meta(file_id)
-    blob_path = _blob_path(file_id)
+    blob_path = _blob_path(meta)
 
     if not blob_path.exists():
         raise HTTPException(status_code=404, detail="Файл не найден")
@@ -776,12 +808,24 @@ async def open_file(file_id: str):
     original_name = meta.get("original_name", f"{file_id}.bin")
     content_type = meta.get("content_type") or _guess_content_type(original_name)
     inline_name = quote(original_name)
-
-    return FileResponse(
-        path=blob_path,
+    size_bytes = int(meta.get("size_bytes", 0) or 0)
+
+    # Blob никогда не переписывается на месте (в CAS имя и есть хеш), поэтому ETag сильный.
+    sha256 = meta.get("sha256")
+    if sha256:
+        etag = f'"{sha256}"'
+    else:
+        etag = f'"{file_id}-{size_bytes}"'
+        _schedule_sha256_backfill(file_id)
+
+    return build_blob_response(
+        request,
+        blob_path,
         media_type=content_type,
-        filename=original_name,
-        headers={"Content-Disposition": f"inline; filename*=UTF-8''{inline_name}"},
+        etag=etag,
+        last_modified=_uploaded_timestamp(meta),
+        size=size_bytes,
+        headers={"content-disposition": f"inline; filename*=UTF-8''{inline_name}"},
     )
 
 CRPT_UPLOAD_DIR = Path("data/crpt_uploads")
@@ -3,7 +3,13 @@ from __future__ import annotations
 from typing import Any, Dict
 
 from fastapi import APIRouter, Request, Response
-from services.telegram_tunnel import read_incoming_payload, send_tunnel_message, tunnel_status
+from services.telegram_tunnel import (
+    get_delivery_receipt,
+    read_incoming_payload,
+    reload_tunnel,
+    send_tunnel_message,
+    tunnel_status,
+)
 
 router = APIRouter(tags=["telegram"])
 
@@ -20,15 +26,33 @@ async def telegram_tunnel(request: Request, response: Response) -> Dict[str, Any
     - GET /mytelegram?payload=...
     - GET /mytelegram?text=...
     - POST /mytelegram с JSON-телом
+
+    С wait=false отвечает 202 сразу после постановки в очередь.
     """
     _no_store(response)
 
     raw_payload = await read_incoming_payload(request)
     result = await send_tunnel_message(request, raw_payload)
+    if result.get("action") == "queued":
+        response.status_code = 202
     return result
 
 
+@router.get("/mytelegram/receipts/{receipt_id}")
+async def telegram_tunnel_receipt(receipt_id: str, request: Request, response: Response) -> Dict[str, Any]:
+    """Статус доставки сообщения: queued, sending, retrying, delivered или failed."""
+    _no_store(response)
+    return await get_delivery_receipt(request, receipt_id)
+
+
 @router.get("/mytelegram/health")
 async def telegram_tunnel_health(response: Response) -> Dict[str, Any]:
     _no_store(response)
     return await tunnel_status()
+
+
+@router.post("/mytelegram/settings/reload")
+async def telegram_tunnel_reload(request: Request, response: Response) -> Dict[str, Any]:
+    """Перечитывает TELEGRAM_* из окружения без перезапуска сервиса."""
+    _no_store(response)
+    return await reload_tunnel(request)
@@ -3,6 +3,7 @@ import os
 from fastapi import APIRouter
 from fastapi.responses import HTMLResponse, RedirectResponse
 
+from services.http_clients import http_clients
 from services.stats_manager import get_all_stats
 from services.template_cache import read_template
 
@@ -15,6 +16,12 @@ async def api_stats():
     return {"stats": get_all_stats()}
 
 
+@router.get("/api/stats/http")
+async def api_http_stats():
+    """Состояние общих HTTP-клиентов: пулы соединений и кэш DNS."""
+    return http_clients.stats()
+
+
 @router.get("/")
 async def dashboard():
     """Отдает главную страницу (Хаб проектов)."""
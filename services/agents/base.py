@@ -1,7 +1,7 @@
 from __future__ import annotations
 
 from dataclasses import dataclass
-from typing import Any, Protocol
+from typing import Any, AsyncIterator, Protocol, runtime_checkable
 
 
 @dataclass(slots=True)
@@ -25,8 +25,38 @@ class AgentExecutionResult:
     job_disk_path: str | None = None
 
 
+@dataclass(slots=True)
+class AgentEvent:
+    """
+    Событие потокового агента: "progress"/"partial" — промежуточные,
+    "result" — итоговый ответ (то же, что вернул бы run), всегда последним.
+    """
+
+    event: str
+    data: dict[str, Any]
+
+
 class Agent(Protocol):
     name: str
 
     async def run(self, command: AgentCommand) -> dict[str, Any]:
         ...
+
+
+@runtime_checkable
+class StreamingAgent(Protocol):
+    """Необязательное расширение Agent: async-генератор событий вместо одного ответа в конце."""
+
+    name: str
+
+    def stream(self, command: AgentCommand) -> AsyncIterator[AgentEvent]:
+        ...
+
+
+async def iter_agent_events(agent: Agent, command: AgentCommand) -> AsyncIterator[AgentEvent]:
+    """Поток событий любого агента; у агента без stream это одно событие result."""
+    if not isinstance(agent, StreamingAgent):
+        yield AgentEvent("result", await agent.run(command))
+        return
+    async for event in agent.stream(command):
+        yield event
@@ -0,0 +1,142 @@
+from __future__ import annotations
+
+import asyncio
+import os
+from typing import Any, AsyncIterator
+from uuid import uuid4
+
+from .jobs import agent_error_status, agent_jobs, agent_results, describe_agent_error, response_file_payload
+from .registry import same_agent
+from .storage import archive_agent_payload, store_agent_job, store_json_as_filevault_record, utc_now_iso
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return max(1, int(os.environ.get(name, default)))
+    except (TypeError, ValueError):
+        return default
+
+
+MAX_BATCH_ITEMS = _env_int("AGENTS_BATCH_MAX_ITEMS", 100)
+MAX_BATCH_CONCURRENCY = _env_int("AGENTS_BATCH_CONCURRENCY", 8)
+
+
+class AgentBatch:
+    """
+    Пакет команд агентам, выполняемых параллельно (не больше concurrency
+    одновременно). Результаты отдаются по мере готовности через stream(),
+    итоговая сводка — последней. Каждое задание пишет только inbox и outbox;
+    архив и файл в FileVault сохраняются одной записью на весь пакет.
+
+    Пакет выполняется в собственной задаче: если клиент отвалился посреди
+    NDJSON-потока, оставшиеся команды всё равно доработают и попадут в архив.
+    """
+
+    def __init__(self, items: list[dict[str, Any]], concurrency: int, batch_id: str | None = None) -> None:
+        self.batch_id = batch_id or uuid4().hex[:16]
+        self.received_at = utc_now_iso()
+        self.items = items
+        self.concurrency = min(max(concurrency, 1), MAX_BATCH_CONCURRENCY)
+        self.results: list[dict[str, Any] | None] = [None] * len(items)
+        self.summary: dict[str, Any] | None = None
+        self._events: asyncio.Queue[dict[str, Any]] = asyncio.Queue()
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def wait(self) -> dict[str, Any]:
+        self.start()
+        await asyncio.shield(self._task)
+        return self.summary
+
+    async def stream(self) -> AsyncIterator[dict[str, Any]]:
+        """Результаты в порядке готовности, последним — сводка (type=summary)."""
+        self.start()
+        while True:
+            event = await self._events.get()
+            yield event
+            if event["type"] == "summary":
+                return
+
+    # ------------------------------------------------------------------ #
+
+    async def _run(self) -> None:
+        semaphore = asyncio.Semaphore(self.concurrency)
+        try:
+            await asyncio.gather(*(self._run_item(index, semaphore) for index in range(len(self.items))))
+            self.summary = await self._store_consolidated()
+        except Exception as error:
+            self.summary = self._summary(error=f"{type(error).__name__}: {error}")
+        self._events.put_nowait(self.summary)
+
+    async def _run_item(self, index: int, semaphore: asyncio.Semaphore) -> None:
+        item = self.items[index]
+        record = item.get("job")
+        if record is None:
+            self._publish(index, {"ok": False, **item["error"]})
+            return
+
+        request_id = record["request_id"]
+        base = {"request_id": request_id, "agent": record["agent"]}
+        async with semaphore:
+            try:
+                idempotent = True
+                response = await agent_results.get(request_id)
+                if response is None:
+                    future = agent_jobs.inflight(request_id)
+                    if future is not None:
+                        response = (await asyncio.shield(future)).response
+                if response is None:
+                    idempotent = False
+                    agent_jobs.reserve(request_id)
+                    try:
+                        await store_agent_job(request_id, record)
+                    except BaseException as error:
+                        agent_jobs.abandon(request_id, error)
+                        raise
+                    response = (await agent_jobs.run_inline(record, batch_id=self.batch_id)).response
+                elif response.get("agent") and not same_agent(response["agent"], record["agent"]):
+                    self._publish(index, {**base, "ok": False, "status_code": 409, "error": "Этот request_id уже использован для другого агента"})
+                    return
+            except Exception as error:
+                self._publish(index, {**base, "ok": False, "status_code": agent_error_status(error), "error": describe_agent_error(error)})
+                return
+        self._publish(index, {**base, "ok": True, "idempotent": idempotent, "response": response})
+
+    def _publish(self, index: int, result: dict[str, Any]) -> None:
+        result = {"type": "item", "index": index, **result}
+        self.results[index] = result
+        self._events.put_nowait(result)
+
+    def _summary(self, **extra: Any) -> dict[str, Any]:
+        succeeded = sum(1 for item in self.results if item and item["ok"])
+        return {
+            "type": "summary",
+            "batch_id": self.batch_id,
+            "total": len(self.items),
+            "succeeded": succeeded,
+            "failed": len(self.items) - succeeded,
+            "received_at": self.received_at,
+            "completed_at": utc_now_iso(),
+            **extra,
+        }
+
+    async def _store_consolidated(self) -> dict[str, Any]:
+        archive_path = await archive_agent_payload(f"batch-{self.batch_id}", {
+            "batch_id": self.batch_id,
+            "received_at": self.received_at,
+            "items": [
+                {"job": item.get("job"), "result": result}
+                for item, result in zip(self.items, self.results)
+            ],
+        })
+        summary = self._summary(archive_disk_path=archive_path)
+        stored_file = await store_json_as_filevault_record(
+            {**summary, "results": self.results},
+            original_name=f"agent-batch-{self.batch_id}.json",
+            folder_id=None,
+        )
+        summary["response_file"] = response_file_payload(stored_file)
+        return summary
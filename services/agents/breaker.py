@@ -0,0 +1,123 @@
+from __future__ import annotations
+
+import os
+import time
+from typing import Any
+
+from utils.logger import log
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return max(1, int(os.environ.get(name, default)))
+    except (TypeError, ValueError):
+        return default
+
+
+BREAKER_FAILURE_THRESHOLD = _env_int("AGENTS_BREAKER_FAILURES", 5)
+BREAKER_RESET_SECONDS = _env_int("AGENTS_BREAKER_RESET_SECONDS", 30)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class AgentCircuitOpenError(Exception):
+    """Агент временно отключён предохранителем после серии ошибок."""
+
+    def __init__(self, agent: str, retry_after: float) -> None:
+        super().__init__(f"Агент {agent} временно недоступен после серии ошибок, повторите через {retry_after:.0f} с")
+        self.agent = agent
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Предохранитель одного агента. После BREAKER_FAILURE_THRESHOLD ошибок
+    подряд (исключения, таймауты, ответы с ok=false) размыкается и сразу
+    отклоняет вызовы; через BREAKER_RESET_SECONDS пропускает один пробный
+    вызов (half-open): успех замыкает цепь, ошибка размыкает её снова.
+
+    Все методы вызываются из event loop, поэтому без блокировок.
+    """
+
+    def __init__(self, agent: str, threshold: int = BREAKER_FAILURE_THRESHOLD, reset_seconds: float = BREAKER_RESET_SECONDS) -> None:
+        self.agent = agent
+        self.threshold = threshold
+        self.reset_seconds = reset_seconds
+        self.state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_running = False
+        self._total_failures = 0
+        self._total_rejected = 0
+        self._last_error: str | None = None
+
+    def retry_after(self) -> float:
+        return max(self._opened_at + self.reset_seconds - time.monotonic(), 0.0)
+
+    def before_call(self) -> None:
+        """Пропускает вызов или бросает AgentCircuitOpenError."""
+        if self.state == OPEN:
+            if self.retry_after() > 0:
+                self._reject()
+            self.state = HALF_OPEN
+            log("AGENTS", f"Предохранитель агента {self.agent}: пробный вызов")
+        if self.state == HALF_OPEN:
+            if self._trial_running:
+                self._reject(self.reset_seconds)
+            self._trial_running = True
+
+    def _reject(self, retry_after: float | None = None) -> None:
+        self._total_rejected += 1
+        raise AgentCircuitOpenError(self.agent, self.retry_after() if retry_after is None else retry_after)
+
+    def record_success(self) -> None:
+        if self.state != CLOSED:
+            log("AGENTS", f"Предохранитель агента {self.agent} снова замкнут")
+        self.state = CLOSED
+        self._failures = 0
+        self._trial_running = False
+
+    def record_failure(self, reason: str) -> None:
+        self._failures += 1
+        self._total_failures += 1
+        self._last_error = reason
+        self._trial_running = False
+        if self.state == HALF_OPEN or self._failures >= self.threshold:
+            if self.state != OPEN:
+                log("AGENTS", f"Предохранитель агента {self.agent} разомкнут после {self._failures} ошибок подряд: {reason}")
+            self.state = OPEN
+            self._opened_at = time.monotonic()
+
+    def release_trial(self) -> None:
+        """Пробный вызов отменён, не дойдя до результата, — следующий запрос попробует снова."""
+        self._trial_running = False
+
+    def to_client(self) -> dict[str, Any]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self._failures,
+            "threshold": self.threshold,
+            "retry_after_seconds": round(self.retry_after(), 1) if self.state == OPEN else 0,
+            "failures": self._total_failures,
+            "rejected": self._total_rejected,
+            "last_error": self._last_error,
+        }
+
+
+class AgentCircuitBreakers:
+    def __init__(self) -> None:
+        self._breakers: dict[str, CircuitBreaker] = {}
+
+    def get(self, agent: str) -> CircuitBreaker:
+        breaker = self._breakers.get(agent)
+        if breaker is None:
+            breaker = self._breakers[agent] = CircuitBreaker(agent)
+        return breaker
+
+    def stats(self) -> dict[str, dict[str, Any]]:
+        return {agent: breaker.to_client() for agent, breaker in sorted(self._breakers.items())}
+
+
+agent_breakers = AgentCircuitBreakers()
@@ -0,0 +1,608 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Any, Callable
+
+from utils.logger import log
+
+from .base import AgentCommand, AgentEvent, iter_agent_events
+from .breaker import AgentCircuitOpenError, agent_breakers
+from .registry import agent_spec, get_agent, has_agent
+from .storage import (
+    StoredArtifact,
+    archive_agent_payload,
+    list_pending_agent_jobs,
+    load_agent_job,
+    load_agent_outbox,
+    move_agent_job_to_dead_letter,
+    store_agent_job,
+    store_agent_outbox,
+    store_json_as_filevault_record,
+    utc_now_iso,
+)
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return max(1, int(os.environ.get(name, default)))
+    except (TypeError, ValueError):
+        return default
+
+
+AGENT_WORKERS = _env_int("AGENTS_WORKERS", 4)
+AGENT_CONCURRENCY = _env_int("AGENTS_PER_AGENT_CONCURRENCY", 2)
+AGENT_QUEUE_LIMIT = _env_int("AGENTS_QUEUE_LIMIT", 1000)
+AGENT_MAX_ATTEMPTS = _env_int("AGENTS_MAX_ATTEMPTS", 3)
+AGENT_REPLAY_CONCURRENCY = _env_int("AGENTS_REPLAY_CONCURRENCY", 4)
+AGENT_RESULT_CACHE_SIZE = _env_int("AGENTS_RESULT_CACHE_SIZE", 512)
+AGENT_DEFAULT_TIMEOUT_SECONDS = _env_int("AGENTS_DEFAULT_TIMEOUT_SECONDS", 120)
+RETRY_BASE_DELAY_SECONDS = 2.0
+FINISHED_JOBS_LIMIT = 1000
+
+
+class AgentQueueFullError(Exception):
+    """Очередь агентов заполнена — новое задание не принято."""
+
+
+class AgentJobFailedError(Exception):
+    """Задание окончательно не выполнено (dead_letter или остановка сервиса)."""
+
+
+@dataclass(slots=True)
+class AgentJobResult:
+    response: dict[str, Any]
+    outbox_disk_path: str
+    stored_file: StoredArtifact | None = None
+
+
+def command_from_job(job_record: dict[str, Any]) -> AgentCommand:
+    return AgentCommand(
+        agent=job_record["agent"],
+        query=job_record["query"],
+        request_id=job_record["request_id"],
+        raw=job_record.get("raw") or {"args": job_record.get("args") or {}},
+        received_at=job_record["received_at"],
+    )
+
+
+def agent_error_status(error: BaseException) -> int:
+    """HTTP-статус для ошибки выполнения агента."""
+    if isinstance(error, AgentCircuitOpenError):
+        return 503
+    if isinstance(error, TimeoutError):
+        return 504
+    return 500
+
+
+def describe_agent_error(error: BaseException) -> str:
+    if isinstance(error, TimeoutError):
+        return "Агент не уложился в отведённое время"
+    if isinstance(error, AgentCircuitOpenError):
+        return str(error)
+    return f"{type(error).__name__}: {error}"
+
+
+async def _execute_agent(command: AgentCommand, on_event: Callable[[AgentEvent], None] | None) -> dict[str, Any]:
+    spec = agent_spec(command.agent)
+    breaker = agent_breakers.get(spec.name)
+    breaker.before_call()
+    try:
+        agent = get_agent(command.agent)
+        # Дедлайн выполнения: timeout из AGENT_SPEC, иначе AGENTS_DEFAULT_TIMEOUT_SECONDS.
+        async with asyncio.timeout(spec.timeout or AGENT_DEFAULT_TIMEOUT_SECONDS):
+            output = None
+            if on_event is None:
+                output = await agent.run(command)
+            else:
+                async for event in iter_agent_events(agent, command):
+                    if event.event == "result":
+                        output = event.data
+                        break
+                    on_event(event)
+        if output is None:
+            raise RuntimeError(f"Агент {command.agent} завершил поток без результата")
+    except asyncio.CancelledError:
+        breaker.release_trial()
+        raise
+    except Exception as error:
+        breaker.record_failure(describe_agent_error(error))
+        raise
+    # Агенты обычно ловят ошибки upstream сами и отвечают ok=false — для предохранителя это тоже сбой.
+    if isinstance(output, dict) and output.get("ok") is False:
+        breaker.record_failure(str(output.get("error") or "ok=false"))
+    else:
+        breaker.record_success()
+    return output
+
+
+async def run_agent_job(
+    job_record: dict[str, Any],
+    *,
+    batch_id: str | None = None,
+    on_event: Callable[[AgentEvent], None] | None = None,
+) -> AgentJobResult:
+    """
+    Выполняет задание агента и сохраняет ответ в outbox, архив и FileVault.
+    Для заданий пакета (batch_id) пишется только outbox: архив и файл
+    в FileVault пакет сохраняет одной записью на всех.
+
+    Запись идёт через групповой писатель; ответ не ждёт fsync, если задание
+    не пришло с durable (тогда outbox и архив синхронизируются до ответа).
+    Запись inbox синхронизируется всегда — на ней держится повтор после рестарта.
+
+    С on_event агент выполняется через поток событий (если умеет), и
+    промежуточные события передаются в on_event; в outbox всё равно попадает
+    только итоговый ответ.
+    """
+    durable = bool(job_record.get("durable"))
+    command = command_from_job(job_record)
+    agent_output = await _execute_agent(command, on_event)
+
+    response_payload = {
+        "ok": True,
+        "agent": command.agent,
+        "request_id": command.request_id,
+        "received_at": command.received_at,
+        "completed_at": utc_now_iso(),
+        "query": command.query,
+        "args": job_record.get("args") or {},
+        "result": agent_output,
+        "channel": "server-file",
+        "version": 1,
+    }
+
+    if batch_id is not None:
+        outbox_payload = {**response_payload, "batch_id": batch_id, "response_file": None}
+        outbox_disk_path = await store_agent_outbox(command.request_id, outbox_payload, durable=durable)
+        agent_results.put(command.request_id, outbox_payload)
+        return AgentJobResult(response=outbox_payload, outbox_disk_path=outbox_disk_path)
+
+    file_name = f"agent-response-{command.agent}-{command.request_id}.json"
+    stored_file = await store_json_as_filevault_record(response_payload, original_name=file_name, folder_id=None)
+
+    # Ссылка на файл в FileVault лежит в outbox, чтобы повторный запрос с тем же
+    # request_id получил тот же ответ без нового прогона агента.
+    outbox_payload = {**response_payload, "response_file": response_file_payload(stored_file)}
+    outbox_disk_path = await store_agent_outbox(command.request_id, outbox_payload, durable=durable)
+    await archive_agent_payload(command.request_id, {
+        "job": job_record,
+        "response": response_payload,
+    }, durable=durable)
+    agent_results.put(command.request_id, outbox_payload)
+    return AgentJobResult(response=outbox_payload, outbox_disk_path=outbox_disk_path, stored_file=stored_file)
+
+
+def response_file_payload(stored_file: StoredArtifact) -> dict[str, Any]:
+    return {
+        "file_id": stored_file.file_id,
+        "original_name": stored_file.original_name,
+        "blob_path": stored_file.blob_path,
+        "meta_path": stored_file.meta_path,
+        "public_name": stored_file.public_name,
+        "size_bytes": stored_file.size_bytes,
+        "uploaded_at": stored_file.uploaded_at,
+    }
+
+
+class AgentResultCache:
+    """
+    LRU последних ответов агентов по request_id. Промах дочитывается из
+    outbox в отдельном потоке, так что кэш — лишь быстрый слой над диском,
+    переживает рестарт и не блокирует event loop чтением файла.
+    """
+
+    def __init__(self, capacity: int = AGENT_RESULT_CACHE_SIZE) -> None:
+        self.capacity = capacity
+        self._items: OrderedDict[str, dict[str, Any]] = OrderedDict()
+        self._hits = 0
+        self._disk_hits = 0
+        self._misses = 0
+
+    async def get(self, request_id: str) -> dict[str, Any] | None:
+        cached = self._items.get(request_id)
+        if cached is not None:
+            self._items.move_to_end(request_id)
+            self._hits += 1
+            return cached
+        payload = await asyncio.to_thread(load_agent_outbox, request_id)
+        if payload is None:
+            self._misses += 1
+            return None
+        self._disk_hits += 1
+        self.put(request_id, payload)
+        return payload
+
+    def put(self, request_id: str, payload: dict[str, Any]) -> None:
+        self._items[request_id] = payload
+        self._items.move_to_end(request_id)
+        while len(self._items) > self.capacity:
+            self._items.popitem(last=False)
+
+    def discard(self, request_id: str) -> None:
+        self._items.pop(request_id, None)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "size": len(self._items),
+            "capacity": self.capacity,
+            "hits": self._hits,
+            "disk_hits": self._disk_hits,
+            "misses": self._misses,
+        }
+
+
+agent_results = AgentResultCache()
+
+
+@dataclass(slots=True)
+class AgentJob:
+    request_id: str
+    agent: str
+    record: dict[str, Any]
+    status: str = "queued"
+    submitted_at: str = field(default_factory=utc_now_iso)
+    started_at: str | None = None
+    finished_at: str | None = None
+    error: str | None = None
+    replayed: bool = False
+
+    @property
+    def attempts(self) -> int:
+        return int(self.record.get("attempts") or 1)
+
+    def to_client(self) -> dict[str, Any]:
+        return {
+            "request_id": self.request_id,
+            "agent": self.agent,
+            "status": self.status,
+            "attempts": self.attempts,
+            "submitted_at": self.submitted_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "error": self.error,
+        }
+
+
+class AgentJobQueue:
+    """
+    Очередь фоновых заданий агентов.
+
+    Общий пул из AGENTS_WORKERS воркеров разбирает готовую очередь, а
+    лимит на агента (concurrency из его AGENT_SPEC, иначе
+    AGENTS_PER_AGENT_CONCURRENCY) держится диспетчеризацией: задание
+    попадает в готовую очередь, только когда у его агента есть свободный
+    слот, остальные ждут в очереди своего агента. Поэтому медленный агент
+    не занимает воркеры, нужные другим агентам. Синхронные прогоны
+    (run_inline: inbox, SSE, пакеты) берут слоты из тех же счётчиков и
+    ждут в той же очереди агента.
+
+    inbox и outbox работают как durable-очередь: задание без ответа в
+    outbox считается невыполненным. Счётчик попыток хранится в самой записи
+    inbox; упавшее задание повторяется с экспоненциальной задержкой, а после
+    AGENTS_MAX_ATTEMPTS попыток уходит в dead_letter.
+    """
+
+    def __init__(self, workers: int = AGENT_WORKERS, per_agent: int = AGENT_CONCURRENCY, limit: int = AGENT_QUEUE_LIMIT) -> None:
+        self.workers = workers
+        self.per_agent = per_agent
+        self.limit = limit
+        self._ready: asyncio.Queue[AgentJob] | None = None
+        # Очередь агента: задания фоновой очереди и future синхронных прогонов, ждущих слота.
+        self._backlog: dict[str, deque[AgentJob | asyncio.Future[None]]] = {}
+        self._running: dict[str, int] = {}
+        self._active: dict[str, AgentJob] = {}
+        self._finished: OrderedDict[str, AgentJob] = OrderedDict()
+        # Все выполняющиеся задания (и из очереди, и синхронные): повторный
+        # запрос с тем же request_id ждёт этот future, а не запускает агента снова.
+        self._inflight: dict[str, asyncio.Future[AgentJobResult]] = {}
+        self._tasks: list[asyncio.Task] = []
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._started_at = time.time()
+        self._replay_slots: asyncio.Semaphore | None = None
+        self._completed = 0
+        self._failed = 0
+        self._retried = 0
+        self._replayed = 0
+        self._dead_lettered = 0
+        self._cancelled = 0
+
+    def start(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._tasks and self._loop is loop:
+            return
+        # Новый event loop (или первый запуск): задания прежнего цикла уже не доедут.
+        self._loop = loop
+        self._running.clear()
+        self._backlog.clear()
+        self._active.clear()
+        self._inflight.clear()
+        self._ready = asyncio.Queue()
+        self._replay_slots = asyncio.Semaphore(AGENT_REPLAY_CONCURRENCY)
+        self._tasks = [asyncio.create_task(self._worker(index)) for index in range(self.workers)]
+        log("AGENTS", f"Очередь агентов запущена: воркеров={self.workers}, на агента={self.per_agent}")
+
+    async def stop(self) -> None:
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    # ------------------------------------------------------------------ #
+
+    def submit(self, job_record: dict[str, Any], *, replayed: bool = False) -> AgentJob:
+        """Ставит задание в очередь; сам job_record уже должен лежать в inbox."""
+        self.start()
+        if len(self._active) >= self.limit:
+            raise AgentQueueFullError("Очередь агентов переполнена")
+        job = AgentJob(request_id=job_record["request_id"], agent=job_record["agent"], record=job_record, replayed=replayed)
+        self._active[job.request_id] = job
+        self._finished.pop(job.request_id, None)
+        self._track(job.request_id)
+        self._enqueue(job)
+        return job
+
+    async def run_inline(
+        self,
+        job_record: dict[str, Any],
+        *,
+        batch_id: str | None = None,
+        on_event: Callable[[AgentEvent], None] | None = None,
+    ) -> AgentJobResult:
+        """
+        Синхронный режим: выполняет задание сразу, но регистрирует его как
+        выполняющееся. Ошибку получает сам клиент, поэтому задание не
+        повторяется, а сразу уходит в dead_letter — у записи в inbox всегда
+        есть исход.
+        """
+        request_id = job_record["request_id"]
+        self._track(request_id)
+        try:
+            await self._acquire_slot(job_record["agent"])
+            try:
+                result = await run_agent_job(job_record, batch_id=batch_id, on_event=on_event)
+            finally:
+                self._release(job_record["agent"])
+        except Exception as error:
+            self._resolve(request_id, error=error)
+            reason = describe_agent_error(error)
+            self._failed += 1
+            self._dead_lettered += 1
+            await move_agent_job_to_dead_letter(request_id, job_record, reason)
+            log("AGENTS", f"Синхронное задание {request_id} ({job_record['agent']}) не выполнено: {reason}", level=logging.WARNING)
+            raise
+        except BaseException as error:
+            self._resolve(request_id, error=error)
+            raise
+        self._resolve(request_id, result=result)
+        return result
+
+    async def record_cancelled(self, job_record: dict[str, Any], reason: str) -> None:
+        """Исход задания, отменённого до ответа (например, клиент отключился)."""
+        self._cancelled += 1
+        await move_agent_job_to_dead_letter(job_record["request_id"], job_record, reason, cancelled=True)
+        log("AGENTS", f"Задание {job_record['request_id']} ({job_record['agent']}) отменено: {reason}")
+
+    def inflight(self, request_id: str) -> asyncio.Future[AgentJobResult] | None:
+        future = self._inflight.get(request_id)
+        return future if future is not None and future.get_loop() is asyncio.get_running_loop() else None
+
+    def reserve(self, request_id: str) -> None:
+        """
+        Регистрирует задание выполняющимся до первого await вызывающего:
+        повторный запрос с тем же request_id, пришедший, пока пишется inbox,
+        уже увидит inflight() и будет ждать, а не запустит агента ещё раз.
+        Если до запуска дело не дошло, резерв снимается через abandon().
+        """
+        self._track(request_id)
+
+    def abandon(self, request_id: str, error: BaseException) -> None:
+        """Снимает резерв задания, которое так и не запустилось (или было отменено)."""
+        self._resolve(request_id, error=error)
+
+    def _track(self, request_id: str) -> None:
+        if self.inflight(request_id) is not None:
+            # Уже зарезервировано вызывающим (reserve) — ждущие держат именно этот future.
+            return
+        future = asyncio.get_running_loop().create_future()
+        # Исключение могут так и не забрать (никто не ждал) — не шумим об этом в логах.
+        future.add_done_callback(lambda item: item.cancelled() or item.exception())
+        self._inflight[request_id] = future
+
+    def _resolve(self, request_id: str, *, result: AgentJobResult | None = None, error: BaseException | None = None) -> None:
+        future = self._inflight.pop(request_id, None)
+        if future is None or future.done():
+            return
+        if error is None:
+            future.set_result(result)
+        elif isinstance(error, Exception):
+            future.set_exception(error)
+        else:
+            future.set_exception(AgentJobFailedError(str(error) or type(error).__name__))
+
+    def _slot(self, agent: str) -> tuple[str, int]:
+        """Ключ и лимит параллельности агента: псевдонимы делят слоты, лимит — из AGENT_SPEC."""
+        try:
+            spec = agent_spec(agent)
+        except KeyError:
+            return agent, self.per_agent
+        return spec.name, spec.concurrency or self.per_agent
+
+    def _enqueue(self, job: AgentJob) -> None:
+        job.status = "queued"
+        key, limit = self._slot(job.agent)
+        if self._running.get(key, 0) < limit:
+            self._dispatch(job)
+        else:
+            self._backlog.setdefault(key, deque()).append(job)
+
+    def get(self, request_id: str) -> AgentJob | None:
+        return self._active.get(request_id) or self._finished.get(request_id)
+
+    def _dispatch(self, job: AgentJob) -> None:
+        key, _ = self._slot(job.agent)
+        self._running[key] = self._running.get(key, 0) + 1
+        self._ready.put_nowait(job)
+
+    async def _acquire_slot(self, agent: str) -> None:
+        """Слот агента для синхронного прогона; без свободного — ждёт в очереди агента наравне с заданиями."""
+        key, limit = self._slot(agent)
+        if self._running.get(key, 0) < limit and not self._backlog.get(key):
+            self._running[key] = self._running.get(key, 0) + 1
+            return
+        waiter: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+        self._backlog.setdefault(key, deque()).append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # Слот уже передан нам — отдаём следующему в очереди.
+                self._release(agent)
+            raise
+
+    def _release(self, agent: str) -> None:
+        key, _ = self._slot(agent)
+        self._running[key] = max(self._running.get(key, 1) - 1, 0)
+        backlog = self._backlog.get(key)
+        while backlog:
+            waiting = backlog.popleft()
+            if isinstance(waiting, AgentJob):
+                self._dispatch(waiting)
+                break
+            if not waiting.done():
+                # Отменённые ожидания пропускаем, живому передаём слот без освобождения.
+                self._running[key] = self._running.get(key, 0) + 1
+                waiting.set_result(None)
+                break
+        if backlog is not None and not backlog:
+            self._backlog.pop(key, None)
+
+    def _finish(self, job: AgentJob, status: str, error: str | None = None) -> None:
+        job.status = status
+        job.error = error
+        job.finished_at = utc_now_iso()
+        self._active.pop(job.request_id, None)
+        self._finished[job.request_id] = job
+        while len(self._finished) > FINISHED_JOBS_LIMIT:
+            self._finished.popitem(last=False)
+        if job.replayed:
+            self._replay_slots.release()
+
+    async def _bump_attempts(self, record: dict[str, Any]) -> None:
+        record["attempts"] = int(record.get("attempts") or 1) + 1
+        await store_agent_job(record["request_id"], record)
+
+    async def _handle_failure(self, job: AgentJob, error: Exception) -> None:
+        reason = describe_agent_error(error)
+        if job.attempts >= AGENT_MAX_ATTEMPTS:
+            self._failed += 1
+            self._dead_lettered += 1
+            await move_agent_job_to_dead_letter(job.request_id, job.record, reason)
+            self._finish(job, "dead", reason)
+            self._resolve(job.request_id, error=AgentJobFailedError(reason))
+            log("AGENTS", f"Задание {job.request_id} ({job.agent}) перенесено в dead_letter после {job.attempts} попыток: {reason}", level=logging.ERROR)
+            return
+        delay = RETRY_BASE_DELAY_SECONDS * 2 ** (job.attempts - 1)
+        self._retried += 1
+        await self._bump_attempts(job.record)
+        job.status = "retrying"
+        job.error = reason
+        self._loop.call_later(delay, self._enqueue, job)
+        log("AGENTS", f"Задание {job.request_id} ({job.agent}) упало ({reason}), повтор через {delay:.0f} с", level=logging.WARNING)
+
+    async def _worker(self, index: int) -> None:
+        while True:
+            job = await self._ready.get()
+            job.status = "running"
+            job.started_at = utc_now_iso()
+            started = time.monotonic()
+            try:
+                result = await run_agent_job(job.record)
+            except asyncio.CancelledError:
+                # Запись остаётся в inbox без ответа — после перезапуска задание будет повторено.
+                self._finish(job, "interrupted", "Выполнение прервано остановкой сервиса")
+                self._resolve(job.request_id, error=AgentJobFailedError("Выполнение прервано остановкой сервиса"))
+                raise
+            except AgentCircuitOpenError as error:
+                # Агент не запускался — попытку не тратим, ждём, пока предохранитель пустит пробный вызов.
+                job.status = "waiting"
+                job.error = str(error)
+                self._loop.call_later(max(error.retry_after, 1.0), self._enqueue, job)
+            except Exception as error:
+                await self._handle_failure(job, error)
+            else:
+                self._completed += 1
+                self._finish(job, "done")
+                self._resolve(job.request_id, result=result)
+                elapsed_ms = round((time.monotonic() - started) * 1000)
+                log("AGENTS", f"Задание {job.request_id} ({job.agent}) выполнено за {elapsed_ms} мс")
+            finally:
+                self._release(job.agent)
+                self._ready.task_done()
+
+    async def replay_pending(self) -> int:
+        """
+        Повторно ставит в очередь задания из inbox без ответа в outbox —
+        оставшиеся от прошлого запуска. Одновременно в работе не больше
+        AGENTS_REPLAY_CONCURRENCY таких заданий, чтобы не забить очередь
+        и не отнять воркеры у новых запросов.
+        """
+        self.start()
+        pending = await asyncio.to_thread(list_pending_agent_jobs, self._started_at)
+        if not pending:
+            return 0
+        log("AGENTS", f"Найдено незавершённых заданий в inbox: {len(pending)}")
+
+        replayed = 0
+        for request_id in pending:
+            if request_id in self._active or request_id in self._inflight:
+                continue
+            record = await asyncio.to_thread(load_agent_job, request_id)
+            if record is None:
+                continue
+            record.setdefault("request_id", request_id)
+            attempts = int(record.get("attempts") or 1)
+            if attempts >= AGENT_MAX_ATTEMPTS or not has_agent(record.get("agent")):
+                reason = "Превышено число попыток" if has_agent(record.get("agent")) else "Агент больше не зарегистрирован"
+                await move_agent_job_to_dead_letter(request_id, record, reason)
+                self._dead_lettered += 1
+                log("AGENTS", f"Задание {request_id} перенесено в dead_letter: {reason} (попыток: {attempts})", level=logging.WARNING)
+                continue
+
+            # Прерванный прогон тоже считается попыткой: так задание, которое
+            # роняет процесс, не будет перезапускаться бесконечно.
+            await self._bump_attempts(record)
+            while True:
+                await self._replay_slots.acquire()
+                try:
+                    self.submit(record, replayed=True)
+                    break
+                except AgentQueueFullError:
+                    self._replay_slots.release()
+                    await asyncio.sleep(1.0)
+            replayed += 1
+        self._replayed += replayed
+        return replayed
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "per_agent_concurrency": self.per_agent,
+            "limit": self.limit,
+            "queued": sum(1 for job in self._active.values() if job.status == "queued"),
+            "running": {agent: count for agent, count in self._running.items() if count},
+            "completed": self._completed,
+            "failed": self._failed,
+            "retried": self._retried,
+            "replayed": self._replayed,
+            "dead_lettered": self._dead_lettered,
+            "cancelled": self._cancelled,
+            "max_attempts": AGENT_MAX_ATTEMPTS,
+        }
+
+
+agent_jobs = AgentJobQueue()
@@ -1,47 +1,223 @@
 from __future__ import annotations
 
+import ast
+import importlib
+import pkgutil
+from dataclasses import dataclass
+from importlib.metadata import entry_points
+from pathlib import Path
+from threading import RLock
+from typing import Any
+
+from utils.logger import log
+
 from .base import Agent
-from .test_agent import TestEchoAgent
-from .weather_monitor import WeatherMonitorAgent
-from .weather_notifier import WeatherNotifierAgent
 
-TEST_ECHO_AGENT = TestEchoAgent()
-WEATHER_MONITOR_AGENT = WeatherMonitorAgent()
-WEATHER_NOTIFIER_AGENT = WeatherNotifierAgent()
+# Внешние пакеты регистрируют агентов через entry points этой группы; точка
+# входа указывает на dict с тем же форматом, что и AGENT_SPEC модулей пакета.
+ENTRY_POINT_GROUP = "bot29.agents"
+SPEC_ATTRIBUTE = "AGENT_SPEC"
+DEFAULT_AGENT = "test_echo"
+PACKAGE_DIR = Path(__file__).parent
+
+
+@dataclass(slots=True, frozen=True)
+class AgentSpec:
+    """
+    Описание агента, известное до его импорта: где лежит класс, под какими
+    именами агент доступен и как его выполнять (лимит параллельности,
+    таймаут, можно ли отдавать готовый ответ на одинаковую команду).
+    """
 
-AGENT_REGISTRY: dict[str, Agent] = {
-    TEST_ECHO_AGENT.name: TEST_ECHO_AGENT,
-    "test": TEST_ECHO_AGENT,
-    "echo": TEST_ECHO_AGENT,
-    WEATHER_MONITOR_AGENT.name: WEATHER_MONITOR_AGENT,
-    "weather": WEATHER_MONITOR_AGENT,
-    WEATHER_NOTIFIER_AGENT.name: WEATHER_NOTIFIER_AGENT,
-    "weather_tg": WEATHER_NOTIFIER_AGENT,
-}
+    name: str
+    module: str
+    class_name: str
+    aliases: tuple[str, ...] = ()
+    concurrency: int | None = None
+    timeout: float | None = None
+    cacheable: bool = False
+    description: str = ""
+
+    @classmethod
+    def from_mapping(cls, payload: dict[str, Any], *, module: str) -> "AgentSpec":
+        name = normalize_agent_name(payload["name"])
+        concurrency = payload.get("concurrency")
+        timeout = payload.get("timeout")
+        return cls(
+            name=name,
+            module=str(payload.get("module") or module),
+            class_name=str(payload["class"]),
+            aliases=tuple(normalize_agent_name(alias) for alias in payload.get("aliases") or ()),
+            concurrency=max(1, int(concurrency)) if concurrency else None,
+            timeout=float(timeout) if timeout else None,
+            cacheable=bool(payload.get("cacheable", False)),
+            description=str(payload.get("description") or ""),
+        )
+
+    def to_client(self) -> dict[str, Any]:
+        return {
+            "name": self.name,
+            "aliases": list(self.aliases),
+            "concurrency": self.concurrency,
+            "timeout": self.timeout,
+            "cacheable": self.cacheable,
+            "description": self.description,
+        }
 
 
 def normalize_agent_name(raw_name: str | None) -> str:
-    value = (raw_name or "test_echo").strip().lower().replace("-", "_")
+    value = (raw_name or DEFAULT_AGENT).strip().lower().replace("-", "_")
     if not value:
-        return "test_echo"
+        return DEFAULT_AGENT
     return value
 
 
+def _read_module_spec(path: Path) -> dict[str, Any] | None:
+    """
+    Достаёт литерал AGENT_SPEC из исходника без импорта модуля: обнаружение
+    агентов не тянет их зависимости, а стоимость старта не растёт с их числом.
+    """
+    try:
+        tree = ast.parse(path.read_text(encoding="utf-8"), filename=str(path))
+    except (OSError, SyntaxError, UnicodeDecodeError):
+        return None
+    for node in tree.body:
+        target = None
+        if isinstance(node, ast.Assign) and len(node.targets) == 1:
+            target = node.targets[0]
+        elif isinstance(node, ast.AnnAssign) and node.value is not None:
+            target = node.target
+        if isinstance(target, ast.Name) and target.id == SPEC_ATTRIBUTE:
+            try:
+                payload = ast.literal_eval(node.value)
+            except ValueError:
+                return None
+            return payload if isinstance(payload, dict) else None
+    return None
+
+
+class AgentRegistry:
+    """
+    Реестр агентов. Спецификации собираются при первом обращении: модули
+    пакета services.agents с литералом AGENT_SPEC плюс entry points группы
+    bot29.agents. Сам агент импортируется и создаётся только при первом
+    вызове get().
+    """
+
+    def __init__(self) -> None:
+        self._lock = RLock()
+        self._specs: dict[str, AgentSpec] | None = None
+        self._names: dict[str, str] = {}
+        self._instances: dict[str, Agent] = {}
+
+    def _discover(self) -> dict[str, AgentSpec]:
+        specs = self._specs
+        if specs is not None:
+            return specs
+        with self._lock:
+            if self._specs is not None:
+                return self._specs
+            discovered: list[AgentSpec] = []
+            for module_info in pkgutil.iter_modules([str(PACKAGE_DIR)]):
+                if module_info.ispkg:
+                    continue
+                payload = _read_module_spec(PACKAGE_DIR / f"{module_info.name}.py")
+                if payload is None:
+                    continue
+                try:
+                    discovered.append(AgentSpec.from_mapping(payload, module=f"{__package__}.{module_info.name}"))
+                except (KeyError, TypeError, ValueError) as error:
+                    log("AGENTS", f"Некорректный AGENT_SPEC в {module_info.name}: {error}")
+            for entry_point in entry_points(group=ENTRY_POINT_GROUP):
+                try:
+                    payload = entry_point.load()
+                    discovered.append(AgentSpec.from_mapping(payload, module=entry_point.module))
+                except Exception as error:
+                    log("AGENTS", f"Не удалось загрузить агента {entry_point.name} из entry point: {error}")
+
+            self._specs = {}
+            self._names = {}
+            for spec in sorted(discovered, key=lambda item: item.name):
+                self._add(spec)
+            return self._specs
+
+    def _add(self, spec: AgentSpec) -> None:
+        if spec.name in self._specs:
+            log("AGENTS", f"Агент {spec.name} объявлен повторно, используется первое объявление")
+            return
+        self._specs[spec.name] = spec
+        for name in (spec.name, *spec.aliases):
+            self._names.setdefault(name, spec.name)
+
+    def register(self, agent: Agent, **metadata: Any) -> AgentSpec:
+        """Регистрирует уже созданного агента (плагины во время работы, отладка)."""
+        self._discover()
+        spec = AgentSpec.from_mapping(
+            {"name": agent.name, "class": type(agent).__name__, **metadata},
+            module=type(agent).__module__,
+        )
+        with self._lock:
+            self._specs.pop(spec.name, None)
+            self._names = {name: target for name, target in self._names.items() if target != spec.name}
+            self._instances[spec.name] = agent
+            self._add(spec)
+        return spec
+
+    def resolve(self, name: str | None) -> AgentSpec:
+        specs = self._discover()
+        canonical = self._names.get(normalize_agent_name(name))
+        if canonical is None:
+            raise KeyError(f"Unknown agent: {name}")
+        return specs[canonical]
+
+    def get(self, name: str | None) -> Agent:
+        spec = self.resolve(name)
+        agent = self._instances.get(spec.name)
+        if agent is not None:
+            return agent
+        with self._lock:
+            agent = self._instances.get(spec.name)
+            if agent is None:
+                module = importlib.import_module(spec.module)
+                agent = self._instances[spec.name] = getattr(module, spec.class_name)()
+                log("AGENTS", f"Агент {spec.name} загружен ({spec.module}.{spec.class_name})")
+            return agent
+
+    def names(self) -> list[str]:
+        """Имена и псевдонимы: каждый агент, а за ним его псевдонимы."""
+        specs = self._discover()
+        return [name for spec in specs.values() for name in (spec.name, *spec.aliases)]
+
+    def describe(self) -> list[dict[str, Any]]:
+        return [{**spec.to_client(), "loaded": spec.name in self._instances} for spec in self._discover().values()]
+
+
+agent_registry = AgentRegistry()
+
+
+def agent_spec(name: str | None) -> AgentSpec:
+    return agent_registry.resolve(name)
+
+
 def get_agent(name: str | None) -> Agent:
-    normalized = normalize_agent_name(name)
-    agent = AGENT_REGISTRY.get(normalized)
-    if agent is None:
-        raise KeyError(f"Unknown agent: {name}")
-    return agent
+    return agent_registry.get(name)
 
 
 def list_agents() -> list[str]:
-    return list(dict.fromkeys(AGENT_REGISTRY.keys()))
+    return agent_registry.names()
 
 
 def has_agent(name: str | None) -> bool:
     try:
-        get_agent(name)
+        agent_registry.resolve(name)
         return True
     except KeyError:
         return False
+
+
+def same_agent(left: str | None, right: str | None) -> bool:
+    """Одинаковый ли агент под двумя именами (псевдонимы считаются одним агентом)."""
+    try:
+        return agent_registry.resolve(left).name == agent_registry.resolve(right).name
+    except KeyError:
+        return normalize_agent_name(left) == normalize_agent_name(right)
@@ -0,0 +1,455 @@
+from __future__ import annotations
+
+import asyncio
+import gzip
+import json
+import logging
+import os
+import re
+import time
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any
+from uuid import uuid4
+
+from services.filevault.blobs import blob_store
+from services.filevault.catalog import get_catalog
+from utils.logger import log
+
+from .jobs import agent_jobs, agent_results
+from .storage import ARCHIVE_ROOT, DEAD_LETTER_ROOT, INBOX_ROOT, OUTBOX_ROOT
+from .writer import agent_writer
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return max(1, int(os.environ.get(name, default)))
+    except (TypeError, ValueError):
+        return default
+
+
+def _env_limit(name: str, default: int) -> int | None:
+    """Лимит политики хранения; 0 в переменной окружения отключает его."""
+    try:
+        value = int(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        value = default
+    return value if value > 0 else None
+
+
+RETENTION_INTERVAL_SECONDS = _env_int("AGENTS_RETENTION_INTERVAL_SECONDS", 60 * 60)
+RETENTION_STEP_FILES = _env_int("AGENTS_RETENTION_STEP_FILES", 500)
+ARCHIVE_COMPACT_AFTER_DAYS = _env_int("AGENTS_ARCHIVE_COMPACT_AFTER_DAYS", 1)
+DROP_RESPONSE_FILES = os.environ.get("AGENTS_RETENTION_DROP_RESPONSE_FILES", "1").strip().lower() not in {"0", "false", "no"}
+# Свежие ответы не трогаем даже при переполнении лимитов: их ещё могут запросить повторно.
+MIN_RETENTION_AGE_SECONDS = 60 * 60
+STEP_PAUSE_SECONDS = 0.05
+COMPACT_CHUNK_SIZE = 256 * 1024
+
+SEGMENT_RE = re.compile(r"^(\d{4}-\d{2}-\d{2})\.ndjson(\.gz)?$")
+
+
+@dataclass(slots=True, frozen=True)
+class RetentionPolicy:
+    max_age_days: int | None
+    max_files: int | None
+    max_bytes: int | None
+
+    @classmethod
+    def from_env(cls, prefix: str, *, max_age_days: int, max_files: int, max_bytes: int) -> "RetentionPolicy":
+        return cls(
+            max_age_days=_env_limit(f"{prefix}_MAX_AGE_DAYS", max_age_days),
+            max_files=_env_limit(f"{prefix}_MAX_FILES", max_files),
+            max_bytes=_env_limit(f"{prefix}_MAX_BYTES", max_bytes),
+        )
+
+    def to_client(self) -> dict[str, int | None]:
+        return {"max_age_days": self.max_age_days, "max_files": self.max_files, "max_bytes": self.max_bytes}
+
+
+# Готовые задания: пара inbox + outbox (и файл ответа в FileVault) удаляются вместе,
+# иначе inbox без outbox выглядел бы незавершённым и был бы повторён при старте.
+JOBS_POLICY = RetentionPolicy.from_env("AGENTS_RETENTION_JOBS", max_age_days=30, max_files=20000, max_bytes=0)
+DEAD_LETTER_POLICY = RetentionPolicy.from_env("AGENTS_RETENTION_DEAD_LETTER", max_age_days=90, max_files=5000, max_bytes=0)
+ARCHIVE_POLICY = RetentionPolicy.from_env("AGENTS_RETENTION_ARCHIVE", max_age_days=365, max_files=0, max_bytes=1024 * 1024 * 1024)
+
+
+@dataclass(slots=True)
+class _Entry:
+    name: str
+    mtime: float
+    size: int
+
+
+def _scan(directory: Path, pattern: re.Pattern[str] | None = None) -> list[_Entry]:
+    """Файлы каталога от старых к новым; временные файлы писателя пропускаются."""
+    entries: list[_Entry] = []
+    try:
+        iterator = os.scandir(directory)
+    except OSError:
+        return entries
+    with iterator:
+        for item in iterator:
+            if item.name.startswith(".") or not item.is_file(follow_symlinks=False):
+                continue
+            if pattern is not None and not pattern.fullmatch(item.name):
+                continue
+            try:
+                stat = item.stat(follow_symlinks=False)
+            except OSError:
+                continue
+            entries.append(_Entry(item.name, stat.st_mtime, stat.st_size))
+    entries.sort(key=lambda entry: entry.mtime)
+    return entries
+
+
+def _select_expired(entries: list[_Entry], policy: RetentionPolicy, now: float, *, min_age: float = 0.0) -> list[_Entry]:
+    """
+    Что удалить по политике: всё старше max_age_days плюс самые старые
+    записи сверх max_files/max_bytes. entries отсортированы от старых к новым.
+    """
+    expired: list[_Entry] = []
+    kept_files = len(entries)
+    kept_bytes = sum(entry.size for entry in entries)
+    age_limit = policy.max_age_days * 86400 if policy.max_age_days else None
+    for entry in entries:
+        age = now - entry.mtime
+        if age < min_age:
+            break
+        over_age = age_limit is not None and age > age_limit
+        over_files = policy.max_files is not None and kept_files > policy.max_files
+        over_bytes = policy.max_bytes is not None and kept_bytes > policy.max_bytes
+        if not (over_age or over_files or over_bytes):
+            break
+        expired.append(entry)
+        kept_files -= 1
+        kept_bytes -= entry.size
+    return expired
+
+
+def _segment_day(name: str) -> date | None:
+    match = SEGMENT_RE.fullmatch(name)
+    if match is None:
+        return None
+    try:
+        return date.fromisoformat(match.group(1))
+    except ValueError:
+        return None
+
+
+class AgentRetentionService:
+    """
+    Фоновая уборка data/agents: удаляет готовые задания, dead_letter и старые
+    сегменты архива по политикам возраста/количества/объёма и сжимает
+    закрытые дневные сегменты архива в `<день>.ndjson.gz`.
+
+    Работа идёт шагами по RETENTION_STEP_FILES файлов в пуле потоков с паузой
+    между шагами, так что даже первый проход по большому каталогу не
+    блокирует event loop. Удаления inbox/outbox идут через групповой писатель,
+    чтобы не разойтись по порядку с записью того же задания.
+    """
+
+    def __init__(self) -> None:
+        self._task: asyncio.Task | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._lock: asyncio.Lock | None = None
+        self._runs = 0
+        self._running = False
+        self._last_run_at: str | None = None
+        self._last_run_ms = 0.0
+        self._last_error: str | None = None
+        self._removed: dict[str, int] = {"jobs": 0, "dead_letter": 0, "archive": 0, "response_files": 0}
+        self._reclaimed: dict[str, int] = {"jobs": 0, "dead_letter": 0, "archive": 0, "response_files": 0}
+        self._segments_compacted = 0
+        self._compaction_saved_bytes = 0
+
+    def start(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._task is not None and not self._task.done() and self._loop is loop:
+            return
+        self._loop = loop
+        self._lock = asyncio.Lock()
+        self._task = asyncio.create_task(self._run_forever())
+
+    async def stop(self) -> None:
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    async def _run_forever(self) -> None:
+        while True:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as error:
+                self._last_error = f"{type(error).__name__}: {error}"
+                log("AGENTS", f"Ошибка уборки данных агентов: {self._last_error}", level=logging.ERROR)
+            await asyncio.sleep(RETENTION_INTERVAL_SECONDS)
+
+    async def run_once(self) -> dict[str, int]:
+        """Один полный проход; возвращает, сколько файлов и байт освобождено за него."""
+        if self._lock is None or self._loop is not asyncio.get_running_loop():
+            self._loop = asyncio.get_running_loop()
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            self._running = True
+            started = time.monotonic()
+            report = {"files_removed": 0, "bytes_reclaimed": 0, "segments_compacted": 0}
+            try:
+                await self._collect_jobs(report)
+                await self._collect_dead_letter(report)
+                # Сначала удаляем просроченные сегменты, чтобы не сжимать то, что всё равно уйдёт.
+                await self._collect_archive(report)
+                await self._compact_archive(report)
+            finally:
+                self._running = False
+                self._runs += 1
+                self._last_run_at = datetime.now(timezone.utc).isoformat()
+                self._last_run_ms = round((time.monotonic() - started) * 1000, 2)
+            self._last_error = None
+            if report["files_removed"] or report["segments_compacted"]:
+                log(
+                    "AGENTS",
+                    f"Уборка данных агентов: удалено файлов {report['files_removed']}, "
+                    f"освобождено {report['bytes_reclaimed']} байт, сжато сегментов {report['segments_compacted']}",
+                )
+            return report
+
+    def _account(self, report: dict[str, int], area: str, files: int, reclaimed: int) -> None:
+        self._removed[area] += files
+        self._reclaimed[area] += reclaimed
+        report["files_removed"] += files
+        report["bytes_reclaimed"] += reclaimed
+
+    # ------------------------------------------------------------------ #
+
+    async def _collect_jobs(self, report: dict[str, int]) -> None:
+        outbox = await asyncio.to_thread(_scan, OUTBOX_ROOT)
+        expired = _select_expired(outbox, JOBS_POLICY, time.time(), min_age=MIN_RETENTION_AGE_SECONDS)
+        for offset in range(0, len(expired), RETENTION_STEP_FILES):
+            # Задание, которое прямо сейчас перезапрашивают с тем же request_id, не трогаем.
+            chunk = [
+                entry.name
+                for entry in expired[offset:offset + RETENTION_STEP_FILES]
+                if agent_jobs.inflight(Path(entry.name).stem) is None
+            ]
+            files, reclaimed, response_files, response_bytes = await agent_writer.call(
+                lambda chunk=chunk: self._drop_jobs(chunk), wait=True
+            )
+            for name in chunk:
+                agent_results.discard(Path(name).stem)
+            self._account(report, "jobs", files, reclaimed)
+            self._account(report, "response_files", response_files, response_bytes)
+            await asyncio.sleep(STEP_PAUSE_SECONDS)
+
+    def _drop_jobs(self, names: list[str]) -> tuple[int, int, int, int]:
+        files = reclaimed = 0
+        response_ids: list[tuple[str, str]] = []
+        for name in names:
+            outbox_path = OUTBOX_ROOT / name
+            if DROP_RESPONSE_FILES:
+                try:
+                    response_file = json.loads(outbox_path.read_text(encoding="utf-8")).get("response_file") or {}
+                except (OSError, ValueError, AttributeError):
+                    response_file = {}
+                if response_file.get("file_id"):
+                    response_ids.append((str(response_file["file_id"]), str(response_file.get("original_name") or "")))
+            for path in (INBOX_ROOT / name, outbox_path):
+                try:
+                    size = path.stat().st_size
+                    path.unlink()
+                except FileNotFoundError:
+                    continue
+                files += 1
+                reclaimed += size
+        response_files, response_bytes = self._drop_response_files(response_ids)
+        return files, reclaimed, response_files, response_bytes
+
+    @staticmethod
+    def _drop_response_files(response_ids: list[tuple[str, str]]) -> tuple[int, int]:
+        # Удаляем только файлы, которые так и лежат в корне под исходным именем:
+        # перенесённый или переименованный пользователем ответ уже не служебный.
+        if not response_ids:
+            return 0, 0
+        catalog = get_catalog()
+        doomed: list[str] = []
+        for file_id, original_name in response_ids:
+            meta = catalog.get(file_id)
+            if meta and meta.get("folder_id") is None and meta.get("original_name") == original_name:
+                doomed.append(file_id)
+        if not doomed:
+            return 0, 0
+        reclaimed = 0
+        blob_store.load_refs()
+        removed = catalog.remove(doomed)
+        for meta in removed:
+            if blob_store.release(meta):
+                reclaimed += int(meta.get("size_bytes") or 0)
+        return len(removed), reclaimed
+
+    async def _collect_dead_letter(self, report: dict[str, int]) -> None:
+        entries = await asyncio.to_thread(_scan, DEAD_LETTER_ROOT)
+        expired = _select_expired(entries, DEAD_LETTER_POLICY, time.time())
+        for offset in range(0, len(expired), RETENTION_STEP_FILES):
+            chunk = [DEAD_LETTER_ROOT / entry.name for entry in expired[offset:offset + RETENTION_STEP_FILES]]
+            files, reclaimed = await agent_writer.call(lambda chunk=chunk: _unlink_all(chunk), wait=True)
+            self._account(report, "dead_letter", files, reclaimed)
+            await asyncio.sleep(STEP_PAUSE_SECONDS)
+
+    # ------------------------------------------------------------------ #
+
+    async def _compact_archive(self, report: dict[str, int]) -> None:
+        """
+        Сжимает закрытые дневные сегменты (старше ARCHIVE_COMPACT_AFTER_DAYS —
+        в них писатель уже не дописывает) и сворачивает архивные файлы
+        `<id>.json` старого формата в сегменты своего дня.
+        """
+        cutoff = datetime.now(timezone.utc).date() - timedelta(days=ARCHIVE_COMPACT_AFTER_DAYS)
+        entries = await asyncio.to_thread(_scan, ARCHIVE_ROOT)
+
+        legacy = [entry for entry in entries if entry.name.endswith(".json")]
+        for offset in range(0, len(legacy), RETENTION_STEP_FILES):
+            chunk = legacy[offset:offset + RETENTION_STEP_FILES]
+            compacted, saved = await asyncio.to_thread(_fold_legacy_archive, chunk)
+            self._segments_compacted += compacted
+            self._compaction_saved_bytes += saved
+            report["segments_compacted"] += compacted
+            await asyncio.sleep(STEP_PAUSE_SECONDS)
+
+        for entry in entries:
+            day = _segment_day(entry.name)
+            if day is None or entry.name.endswith(".gz") or day >= cutoff:
+                continue
+            saved = await asyncio.to_thread(_compress_segment, ARCHIVE_ROOT / entry.name)
+            self._segments_compacted += 1
+            self._compaction_saved_bytes += saved
+            report["segments_compacted"] += 1
+            await asyncio.sleep(STEP_PAUSE_SECONDS)
+
+    async def _collect_archive(self, report: dict[str, int]) -> None:
+        cutoff = datetime.now(timezone.utc).date() - timedelta(days=ARCHIVE_COMPACT_AFTER_DAYS)
+        entries = await asyncio.to_thread(_scan, ARCHIVE_ROOT, SEGMENT_RE)
+        # Возраст сегмента — по дню в имени, а не по mtime: сжатие его обновляет.
+        by_day: list[_Entry] = []
+        for entry in entries:
+            day = _segment_day(entry.name)
+            if day is not None and day < cutoff:
+                stamp = datetime(day.year, day.month, day.day, tzinfo=timezone.utc).timestamp()
+                by_day.append(_Entry(entry.name, stamp, entry.size))
+        by_day.sort(key=lambda entry: entry.mtime)
+        expired = _select_expired(by_day, ARCHIVE_POLICY, time.time())
+        if expired:
+            files, reclaimed = await asyncio.to_thread(_unlink_all, [ARCHIVE_ROOT / entry.name for entry in expired])
+            self._account(report, "archive", files, reclaimed)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "running": self._running,
+            "runs": self._runs,
+            "interval_seconds": RETENTION_INTERVAL_SECONDS,
+            "last_run_at": self._last_run_at,
+            "last_run_ms": self._last_run_ms,
+            "last_error": self._last_error,
+            "files_removed": dict(self._removed),
+            "bytes_reclaimed": dict(self._reclaimed),
+            "bytes_reclaimed_total": sum(self._reclaimed.values()),
+            "segments_compacted": self._segments_compacted,
+            "compaction_saved_bytes": self._compaction_saved_bytes,
+            "policies": {
+                "jobs": JOBS_POLICY.to_client(),
+                "dead_letter": DEAD_LETTER_POLICY.to_client(),
+                "archive": ARCHIVE_POLICY.to_client(),
+            },
+        }
+
+
+def _unlink_all(paths: list[Path]) -> tuple[int, int]:
+    files = reclaimed = 0
+    for path in paths:
+        try:
+            size = path.stat().st_size
+            path.unlink()
+        except FileNotFoundError:
+            continue
+        files += 1
+        reclaimed += size
+    return files, reclaimed
+
+
+def _append_gzip_member(target: Path, chunks) -> int:
+    """
+    Дописывает gzip-член в `<день>.ndjson.gz` через временный файл и rename:
+    сбой посреди сжатия не портит уже сжатые данные. Возвращает размер результата.
+    """
+    temp_path = target.with_name(f".{target.name}.{uuid4().hex}.tmp")
+    try:
+        with temp_path.open("wb") as handle:
+            if target.exists():
+                with target.open("rb") as existing:
+                    while True:
+                        block = existing.read(COMPACT_CHUNK_SIZE)
+                        if not block:
+                            break
+                        handle.write(block)
+            with gzip.GzipFile(fileobj=handle, mode="wb", compresslevel=6) as compressor:
+                for chunk in chunks:
+                    compressor.write(chunk)
+            handle.flush()
+            os.fsync(handle.fileno())
+        os.replace(temp_path, target)
+    except BaseException:
+        temp_path.unlink(missing_ok=True)
+        raise
+    return target.stat().st_size
+
+
+def _compress_segment(path: Path) -> int:
+    target = path.with_name(f"{path.name}.gz")
+    before = path.stat().st_size + (target.stat().st_size if target.exists() else 0)
+
+    def chunks():
+        with path.open("rb") as source:
+            while True:
+                block = source.read(COMPACT_CHUNK_SIZE)
+                if not block:
+                    return
+                yield block
+
+    after = _append_gzip_member(target, chunks())
+    path.unlink()
+    return max(before - after, 0)
+
+
+def _fold_legacy_archive(entries: list[_Entry]) -> tuple[int, int]:
+    by_day: dict[str, list[tuple[_Entry, bytes]]] = {}
+    for entry in entries:
+        path = ARCHIVE_ROOT / entry.name
+        try:
+            payload = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            continue
+        archived_at = datetime.fromtimestamp(entry.mtime, timezone.utc)
+        record = {"archive_id": path.stem, "archived_at": archived_at.isoformat()}
+        if isinstance(payload, dict):
+            record.update(payload)
+        else:
+            record["payload"] = payload
+        line = json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+        by_day.setdefault(archived_at.strftime("%Y-%m-%d"), []).append((entry, line))
+
+    compacted = saved = 0
+    for day, items in by_day.items():
+        target = ARCHIVE_ROOT / f"{day}.ndjson.gz"
+        before = sum(entry.size for entry, _ in items) + (target.stat().st_size if target.exists() else 0)
+        after = _append_gzip_member(target, (line for _, line in items))
+        for entry, _ in items:
+            (ARCHIVE_ROOT / entry.name).unlink(missing_ok=True)
+        compacted += 1
+        saved += max(before - after, 0)
+    return compacted, saved
+
+
+agent_retention = AgentRetentionService()
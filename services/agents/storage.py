@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import hashlib
 import json
 import mimetypes
 import os
@@ -10,14 +11,19 @@ from pathlib import Path
 from typing import Any
 from uuid import uuid4
 
+from services.filevault.blobs import blob_store
+from services.filevault.catalog import get_catalog
+
+from .writer import agent_writer
 
 FILEVAULT_ROOT = Path("data/filevault_uploads")
 AGENTS_ROOT = Path("data/agents")
 INBOX_ROOT = AGENTS_ROOT / "inbox"
 OUTBOX_ROOT = AGENTS_ROOT / "outbox"
 ARCHIVE_ROOT = AGENTS_ROOT / "archive"
+DEAD_LETTER_ROOT = AGENTS_ROOT / "dead_letter"
 
-for directory in (FILEVAULT_ROOT, AGENTS_ROOT, INBOX_ROOT, OUTBOX_ROOT, ARCHIVE_ROOT):
+for directory in (FILEVAULT_ROOT, AGENTS_ROOT, INBOX_ROOT, OUTBOX_ROOT, ARCHIVE_ROOT, DEAD_LETTER_ROOT):
     directory.mkdir(parents=True, exist_ok=True)
 
 
@@ -37,8 +43,9 @@ def utc_now_iso() -> str:
     return datetime.now(timezone.utc).isoformat()
 
 
-def _json_write(path: Path, payload: Any) -> None:
-    path.write_text(json.dumps(payload, ensure_ascii=False, indent=2), encoding="utf-8")
+def _json_bytes(payload: Any) -> bytes:
+    # Компактный JSON: артефакты читают программы, а не люди, а отступы удваивали объём записи.
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
 
 
 def _sanitize_filename(filename: str) -> str:
@@ -53,43 +60,44 @@ def _guess_content_type(filename: str, fallback: str = "application/json") -> st
     return mime or fallback
 
 
-def _meta_path(file_id: str) -> Path:
-    return FILEVAULT_ROOT / f"{file_id}.json"
-
-
-def _blob_path(file_id: str) -> Path:
-    return FILEVAULT_ROOT / f"{file_id}.bin"
-
-
-def store_json_as_filevault_record(
+async def store_json_as_filevault_record(
     payload: dict[str, Any],
     *,
     original_name: str,
     folder_id: str | None = None,
 ) -> StoredArtifact:
+    """
+    Сохраняет JSON как файл FileVault через групповой писатель. Ссылку на файл
+    сразу отдают клиенту, поэтому вызов ждёт коммита — но в общей пачке и вне event loop.
+    """
     file_id = uuid4().hex
     sanitized_name = _sanitize_filename(original_name)
-    blob_path = _blob_path(file_id)
-    meta_path = _meta_path(file_id)
-
-    body = json.dumps(payload, ensure_ascii=False, indent=2).encode("utf-8")
-    blob_path.write_bytes(body)
+    catalog = get_catalog()
 
+    body = _json_bytes(payload)
     meta = {
         "file_id": file_id,
         "original_name": sanitized_name,
         "content_type": _guess_content_type(sanitized_name),
         "size_bytes": len(body),
+        "sha256": hashlib.sha256(body).hexdigest(),
+        "storage": "cas",
         "uploaded_at": utc_now_iso(),
         "folder_id": folder_id,
     }
-    _json_write(meta_path, meta)
+
+    def commit() -> None:
+        # Одинаковые ответы агентов (например, повторные запросы) делят один blob.
+        blob_store.ingest_bytes(body)
+        catalog.put(meta, len(body))
+
+    await agent_writer.call(commit, wait=True)
 
     return StoredArtifact(
         file_id=file_id,
         original_name=sanitized_name,
-        blob_path=str(blob_path),
-        meta_path=str(meta_path),
+        blob_path=str(blob_store.path_for_meta(meta)),
+        meta_path=catalog.meta_location(file_id),
         public_name=sanitized_name,
         content_type=meta["content_type"],
         size_bytes=len(body),
@@ -97,19 +105,74 @@ def store_json_as_filevault_record(
     )
 
 
-def store_agent_job(job_id: str, payload: dict[str, Any]) -> str:
+async def store_agent_job(job_id: str, payload: dict[str, Any], *, durable: bool = True) -> str:
+    # Запись inbox — основа повтора после рестарта, поэтому по умолчанию ждёт fsync;
+    # групповой писатель объединяет fsync одновременных заданий в один.
     path = INBOX_ROOT / f"{job_id}.json"
-    _json_write(path, payload)
+    await agent_writer.write(path, _json_bytes(payload), durable=durable)
     return str(path)
 
 
-def store_agent_outbox(job_id: str, payload: dict[str, Any]) -> str:
+async def store_agent_outbox(job_id: str, payload: dict[str, Any], *, durable: bool = False) -> str:
     path = OUTBOX_ROOT / f"{job_id}.json"
-    _json_write(path, payload)
+    await agent_writer.write(path, _json_bytes(payload), durable=durable)
     return str(path)
 
 
-def archive_agent_payload(job_id: str, payload: dict[str, Any]) -> str:
-    path = ARCHIVE_ROOT / f"{job_id}.json"
-    _json_write(path, payload)
+def load_agent_outbox(job_id: str) -> dict[str, Any] | None:
+    try:
+        payload = json.loads((OUTBOX_ROOT / f"{job_id}.json").read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+    return payload if isinstance(payload, dict) else None
+
+
+def load_agent_job(job_id: str) -> dict[str, Any] | None:
+    try:
+        payload = json.loads((INBOX_ROOT / f"{job_id}.json").read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+    return payload if isinstance(payload, dict) else None
+
+
+def list_pending_agent_jobs(started_before: float) -> list[str]:
+    """request_id заданий из inbox без ответа в outbox, от старых к новым."""
+    pending: list[tuple[float, str]] = []
+    for path in INBOX_ROOT.glob("*.json"):
+        try:
+            mtime = path.stat().st_mtime
+        except OSError:
+            continue
+        if mtime >= started_before or (OUTBOX_ROOT / path.name).exists():
+            continue
+        pending.append((mtime, path.stem))
+    pending.sort()
+    return [job_id for _, job_id in pending]
+
+
+async def move_agent_job_to_dead_letter(job_id: str, payload: dict[str, Any], reason: str, *, cancelled: bool = False) -> str:
+    path = DEAD_LETTER_ROOT / f"{job_id}.json"
+    record = {**payload, "dead_letter": {"reason": reason, "cancelled": cancelled, "moved_at": utc_now_iso()}}
+    await agent_writer.write(path, _json_bytes(record))
+    await agent_writer.unlink(INBOX_ROOT / f"{job_id}.json")
+    return str(path)
+
+
+def load_dead_letter(job_id: str) -> dict[str, Any] | None:
+    try:
+        payload = json.loads((DEAD_LETTER_ROOT / f"{job_id}.json").read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+    return payload if isinstance(payload, dict) else None
+
+
+def archive_segment_path(day: str | None = None) -> Path:
+    return ARCHIVE_ROOT / f"{day or datetime.now(timezone.utc).strftime('%Y-%m-%d')}.ndjson"
+
+
+async def archive_agent_payload(job_id: str, payload: dict[str, Any], *, durable: bool = False) -> str:
+    """Дописывает запись в дневной append-only сегмент архива (NDJSON) вместо файла на задание."""
+    path = archive_segment_path()
+    record = {"archive_id": job_id, "archived_at": utc_now_iso(), **payload}
+    await agent_writer.append(path, _json_bytes(record) + b"\n", durable=durable)
     return str(path)
@@ -1,15 +1,25 @@
 from __future__ import annotations
 
 from datetime import datetime, timezone
-from typing import Any
+from typing import Any, AsyncIterator
 
-from .base import AgentCommand
+from .base import AgentCommand, AgentEvent
 
 
 def _utc_now_iso() -> str:
     return datetime.now(timezone.utc).isoformat()
 
 
+AGENT_SPEC = {
+    "name": "test_echo",
+    "class": "TestEchoAgent",
+    "aliases": ["test", "echo"],
+    "timeout": 5,
+    "cacheable": True,
+    "description": "Тестовый агент: возвращает запрос и простую статистику по нему",
+}
+
+
 class TestEchoAgent:
     name = "test_echo"
 
@@ -31,3 +41,9 @@ class TestEchoAgent:
             "echo": query,
             "note": "Это тестовый агент. Он не выполняет внешние действия, а только формирует JSON-ответ.",
         }
+
+    async def stream(self, command: AgentCommand) -> AsyncIterator[AgentEvent]:
+        words = [part for part in command.query.split() if part]
+        for index, word in enumerate(words, start=1):
+            yield AgentEvent("partial", {"index": index, "total": len(words), "word": word})
+        yield AgentEvent("result", await self.run(command))
@@ -2,25 +2,39 @@ from __future__ import annotations
 
 import base64
 import hashlib
+import asyncio
 import hmac
 import json
 import os
+import re
 from pathlib import Path
-from typing import Any
+from typing import Any, AsyncIterator
+from uuid import uuid4
 
 from fastapi import HTTPException, Request, status
 
-from .base import AgentCommand
-from .registry import get_agent, has_agent, list_agents, normalize_agent_name
-from .storage import (
-    archive_agent_payload,
-    store_agent_job,
-    store_agent_outbox,
-    store_json_as_filevault_record,
-    utc_now_iso,
+from .base import AgentEvent
+from .batch import MAX_BATCH_CONCURRENCY, MAX_BATCH_ITEMS, AgentBatch
+from .breaker import AgentCircuitOpenError, agent_breakers
+from .jobs import (
+    AgentJobFailedError,
+    AgentJobResult,
+    AgentQueueFullError,
+    agent_error_status,
+    agent_jobs,
+    agent_results,
+    describe_agent_error,
 )
+from .registry import agent_registry, agent_spec, has_agent, list_agents, normalize_agent_name, same_agent
+from .retention import agent_retention
+from .storage import INBOX_ROOT, OUTBOX_ROOT, load_agent_job, load_dead_letter, store_agent_job, utc_now_iso
+from .writer import agent_writer
 
 MAX_QUERY_LENGTH = 12000
+SSE_KEEPALIVE_SECONDS = 15.0
+DISCONNECT_POLL_SECONDS = 0.5
+# request_id становится именем файла в inbox/outbox — только безопасные символы.
+REQUEST_ID_RE = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_.-]{0,127}$")
 
 
 def load_tunnel_secret() -> str | None:
@@ -75,6 +89,8 @@ def _parse_query_payload(request: Request) -> dict[str, Any]:
             "kind": params.get("kind") or "single",
             "format": params.get("format") or "json",
             "args": {},
+            # EventSource умеет только GET: request_id из query нужен для идемпотентных переподключений.
+            "request_id": params.get("request_id") or params.get("job_id"),
         }
 
     raise HTTPException(
@@ -94,6 +110,20 @@ async def read_agent_payload(request: Request) -> dict[str, Any]:
     return _parse_query_payload(request)
 
 
+def _default_request_id(agent: str, query: str, args: dict[str, Any]) -> str:
+    # У cacheable-агентов одинаковая команда получает одинаковый id, и повтор
+    # отдаётся из кэша/outbox без нового прогона; остальным нужен уникальный id.
+    try:
+        cacheable = agent_spec(agent).cacheable
+    except KeyError:
+        cacheable = False
+    if cacheable:
+        seed = f"{agent_spec(agent).name}:{query}:{json.dumps(args, ensure_ascii=False, sort_keys=True, default=str)}"
+    else:
+        seed = f"{agent}:{query}:{utc_now_iso()}"
+    return hashlib.sha1(seed.encode("utf-8")).hexdigest()[:16]
+
+
 def _normalize_payload(raw_payload: dict[str, Any]) -> dict[str, Any]:
     if not isinstance(raw_payload, dict):
         raise HTTPException(status_code=422, detail="Ожидался JSON-объект")
@@ -119,11 +149,9 @@ def _normalize_payload(raw_payload: dict[str, Any]) -> dict[str, Any]:
     if not isinstance(args, dict):
         raise HTTPException(status_code=422, detail="Поле args должно быть JSON-объектом")
 
-    request_id = str(
-        raw_payload.get("request_id")
-        or raw_payload.get("job_id")
-        or hashlib.sha1(f"{agent}:{query}:{utc_now_iso()}".encode("utf-8")).hexdigest()[:16]
-    )
+    request_id = str(raw_payload.get("request_id") or raw_payload.get("job_id") or _default_request_id(agent, query, args))
+    if not REQUEST_ID_RE.fullmatch(request_id):
+        raise HTTPException(status_code=422, detail="request_id может содержать только латиницу, цифры, '_', '-' и '.'")
 
     response_format = str(raw_payload.get("response_format") or raw_payload.get("format") or "json").strip().lower()
     if response_format not in {"json", "plain"}:
@@ -133,6 +161,14 @@ def _normalize_payload(raw_payload: dict[str, Any]) -> dict[str, Any]:
     if kind not in {"single", "file", "command"}:
         kind = "single"
 
+    mode = str(raw_payload.get("mode") or "sync").strip().lower()
+    if mode not in {"sync", "async"}:
+        mode = "sync"
+
+    # durable: ответ уходит только после fsync outbox и архива; inbox синхронизируется всегда.
+    durability = str(raw_payload.get("durability") or "").strip().lower()
+    durable = raw_payload.get("durable") is True or durability == "sync"
+
     return {
         "agent": agent,
         "query": query,
@@ -140,12 +176,22 @@ def _normalize_payload(raw_payload: dict[str, Any]) -> dict[str, Any]:
         "request_id": request_id,
         "response_format": response_format,
         "kind": kind,
+        "mode": mode,
+        "durable": durable,
         "raw": raw_payload,
         "received_at": utc_now_iso(),
     }
 
 
-async def handle_agent_request(request: Request, raw_payload: dict[str, Any]) -> dict[str, Any]:
+def wants_async(request: Request, raw_payload: dict[str, Any]) -> bool:
+    """Асинхронный режим: mode=async в теле/query или заголовок Prefer: respond-async."""
+    if str(raw_payload.get("mode") or request.query_params.get("mode") or "").strip().lower() == "async":
+        return True
+    return "respond-async" in (request.headers.get("prefer") or "").lower()
+
+
+def _prepare_job(request: Request, raw_payload: dict[str, Any]) -> tuple[dict[str, Any], dict[str, Any]]:
+    """Проверяет запрос и собирает запись задания для inbox; возвращает (payload, job_record)."""
     _require_secret(request)
     payload = _normalize_payload(raw_payload)
 
@@ -158,14 +204,6 @@ async def handle_agent_request(request: Request, raw_payload: dict[str, Any]) ->
             },
         )
 
-    command = AgentCommand(
-        agent=payload["agent"],
-        query=payload["query"],
-        request_id=payload["request_id"],
-        raw=payload["raw"],
-        received_at=payload["received_at"],
-    )
-
     job_record = {
         "request_id": payload["request_id"],
         "agent": payload["agent"],
@@ -174,63 +212,303 @@ async def handle_agent_request(request: Request, raw_payload: dict[str, Any]) ->
         "kind": payload["kind"],
         "response_format": payload["response_format"],
         "received_at": payload["received_at"],
+        "attempts": 1,
+        "durable": payload["durable"],
+        "raw": payload["raw"],
         "source": {
             "method": request.method,
             "path": str(request.url.path),
             "client": request.client.host if request.client else None,
         },
     }
-    job_disk_path = store_agent_job(payload["request_id"], job_record)
+    return payload, job_record
 
-    agent = get_agent(payload["agent"])
-    agent_output = await agent.run(command)
 
-    response_payload = {
-        "ok": True,
-        "agent": payload["agent"],
-        "request_id": payload["request_id"],
-        "received_at": payload["received_at"],
-        "completed_at": utc_now_iso(),
-        "query": payload["query"],
-        "args": payload["args"],
-        "result": agent_output,
-        "channel": "server-file",
-        "version": 1,
-    }
-
-    outbox_disk_path = store_agent_outbox(payload["request_id"], response_payload)
-    archive_agent_payload(payload["request_id"], {
-        "job": job_record,
-        "response": response_payload,
-    })
+def _ensure_same_agent(payload: dict[str, Any], agent: str | None) -> None:
+    if agent and not same_agent(agent, payload["agent"]):
+        raise HTTPException(status_code=409, detail="Этот request_id уже использован для другого агента")
 
-    file_name = f"agent-response-{payload['agent']}-{payload['request_id']}.json"
-    stored_file = store_json_as_filevault_record(response_payload, original_name=file_name, folder_id=None)
 
+def _sync_response(payload: dict[str, Any], response: dict[str, Any], *, idempotent: bool = False) -> dict[str, Any]:
+    request_id = payload["request_id"]
     return {
         "ok": True,
         "accepted": True,
         "agent": payload["agent"],
-        "request_id": payload["request_id"],
+        "request_id": request_id,
         "query": payload["query"],
         "response_format": payload["response_format"],
         "kind": payload["kind"],
-        "job_disk_path": job_disk_path,
-        "outbox_disk_path": outbox_disk_path,
-        "response_file": {
-            "file_id": stored_file.file_id,
-            "original_name": stored_file.original_name,
-            "blob_path": stored_file.blob_path,
-            "meta_path": stored_file.meta_path,
-            "public_name": stored_file.public_name,
-            "size_bytes": stored_file.size_bytes,
-            "uploaded_at": stored_file.uploaded_at,
-        },
+        "job_disk_path": str(INBOX_ROOT / f"{request_id}.json"),
+        "outbox_disk_path": str(OUTBOX_ROOT / f"{request_id}.json"),
+        "response_file": response.get("response_file"),
+        "idempotent": idempotent,
         "available_agents": list_agents(),
         "tunnel": "agents",
     }
 
 
+async def handle_agent_request(request: Request, raw_payload: dict[str, Any]) -> dict[str, Any]:
+    payload, job_record = _prepare_job(request, raw_payload)
+    request_id = payload["request_id"]
+
+    # Идемпотентность: готовый ответ отдаём из кэша/outbox, выполняющееся задание — дожидаемся.
+    response = await agent_results.get(request_id)
+    if response is None:
+        future = agent_jobs.inflight(request_id)
+        if future is not None:
+            try:
+                response = (await asyncio.shield(future)).response
+            except Exception as error:
+                raise _agent_http_error(error) from error
+    if response is not None:
+        _ensure_same_agent(payload, response.get("agent"))
+        return _sync_response(payload, response, idempotent=True)
+
+    # Резерв до первого await: дубликаты, пришедшие пока пишется inbox, ждут этот запуск.
+    agent_jobs.reserve(request_id)
+    try:
+        await store_agent_job(request_id, job_record)
+        result = await _run_while_connected(request, job_record)
+    except ClientDisconnectedError:
+        # Ответ уже некому отдать; исход всё равно фиксируется в dead_letter.
+        agent_jobs.abandon(request_id, AgentJobFailedError("Клиент отключился до ответа агента"))
+        await agent_jobs.record_cancelled(job_record, "Клиент отключился до ответа агента")
+        raise HTTPException(status_code=499, detail="Клиент отключился")
+    except BaseException as error:
+        # No-op, если run_inline уже разрешил future; иначе задание не запустилось.
+        agent_jobs.abandon(request_id, error)
+        if not isinstance(error, Exception):
+            raise
+        raise _agent_http_error(error) from error
+    return _sync_response(payload, result.response)
+
+
+class ClientDisconnectedError(Exception):
+    """Клиент синхронного запроса закрыл соединение, не дождавшись ответа."""
+
+
+async def _wait_for_disconnect(request: Request) -> None:
+    while not await request.is_disconnected():
+        await asyncio.sleep(DISCONNECT_POLL_SECONDS)
+
+
+async def _run_while_connected(request: Request, job_record: dict[str, Any]) -> AgentJobResult:
+    """
+    Выполняет задание, пока клиент на связи. Если он отключился, агент
+    получает CancelledError — отмена кооперативная, в ближайшем await агента.
+    """
+    job = asyncio.ensure_future(agent_jobs.run_inline(job_record))
+    watcher = asyncio.create_task(_wait_for_disconnect(request))
+    try:
+        await asyncio.wait({job, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    except asyncio.CancelledError:
+        # Остановка сервера: задание остаётся в inbox и будет повторено после рестарта.
+        watcher.cancel()
+        job.cancel()
+        raise
+    watcher.cancel()
+    if not job.done():
+        job.cancel()
+        await asyncio.gather(job, return_exceptions=True)
+        raise ClientDisconnectedError()
+    return job.result()
+
+
+def _agent_http_error(error: Exception) -> HTTPException:
+    if isinstance(error, HTTPException):
+        return error
+    status_code = agent_error_status(error)
+    headers = None
+    if isinstance(error, AgentCircuitOpenError):
+        headers = {"Retry-After": str(max(1, round(error.retry_after)))}
+    return HTTPException(status_code=status_code, detail=describe_agent_error(error), headers=headers)
+
+
+async def submit_agent_request(request: Request, raw_payload: dict[str, Any]) -> dict[str, Any]:
+    """Асинхронный режим: задание ставится в очередь, ответ — сразу, без ожидания агента."""
+    payload, job_record = _prepare_job(request, raw_payload)
+    request_id = payload["request_id"]
+    accepted = {
+        "ok": True,
+        "accepted": True,
+        "agent": payload["agent"],
+        "request_id": request_id,
+        "job_disk_path": str(INBOX_ROOT / f"{request_id}.json"),
+        "status_url": f"/api/agents/jobs/{request_id}",
+        "tunnel": "agents",
+    }
+
+    response = await agent_results.get(request_id)
+    if response is not None:
+        _ensure_same_agent(payload, response.get("agent"))
+        return {**accepted, "status": "done", "idempotent": True}
+    if agent_jobs.inflight(request_id) is not None:
+        job = agent_jobs.get(request_id)
+        if job is not None:
+            _ensure_same_agent(payload, job.agent)
+        return {**accepted, "status": job.status if job is not None else "running", "idempotent": True}
+
+    agent_jobs.reserve(request_id)
+    try:
+        await store_agent_job(request_id, job_record)
+        job = agent_jobs.submit(job_record)
+    except AgentQueueFullError as error:
+        agent_jobs.abandon(request_id, error)
+        raise HTTPException(status_code=503, detail=str(error))
+    except BaseException as error:
+        agent_jobs.abandon(request_id, error)
+        raise
+    return {**accepted, "status": job.status, "idempotent": False}
+
+
+def prepare_agent_stream(request: Request, raw_payload: dict[str, Any]) -> AsyncIterator[tuple[str, dict[str, Any]]]:
+    """
+    Проверяет запрос до начала ответа (ошибки — обычным HTTP-статусом) и
+    возвращает поток событий (имя, данные) для SSE: accepted сразу,
+    затем промежуточные события агента и последним result или error.
+    """
+    payload, job_record = _prepare_job(request, raw_payload)
+    return _stream_agent_job(payload, job_record)
+
+
+async def _stream_agent_job(payload: dict[str, Any], job_record: dict[str, Any]) -> AsyncIterator[tuple[str, dict[str, Any]]]:
+    request_id = payload["request_id"]
+    yield "accepted", {
+        "request_id": request_id,
+        "agent": payload["agent"],
+        "status_url": f"/api/agents/jobs/{request_id}",
+    }
+
+    response = await agent_results.get(request_id)
+    if response is None:
+        future = agent_jobs.inflight(request_id)
+        if future is not None:
+            try:
+                response = (await asyncio.shield(future)).response
+            except Exception as error:
+                yield "error", {"status_code": agent_error_status(error), "error": describe_agent_error(error)}
+                return
+    if response is not None:
+        if response.get("agent") and not same_agent(response["agent"], payload["agent"]):
+            yield "error", {"status_code": 409, "error": "Этот request_id уже использован для другого агента"}
+            return
+        yield "result", _sync_response(payload, response, idempotent=True)
+        return
+
+    agent_jobs.reserve(request_id)
+    try:
+        await store_agent_job(request_id, job_record)
+    except BaseException as error:
+        agent_jobs.abandon(request_id, error)
+        raise
+    events: asyncio.Queue[AgentEvent | None] = asyncio.Queue()
+
+    def finished(task: asyncio.Task) -> None:
+        # Клиент мог уже отключиться — тогда исключение некому забрать, читаем его здесь.
+        if not task.cancelled():
+            task.exception()
+        events.put_nowait(None)
+
+    # Задание живёт в своей задаче: обрыв SSE-соединения не мешает дописать ответ в outbox.
+    task = asyncio.create_task(agent_jobs.run_inline(job_record, on_event=events.put_nowait))
+    task.add_done_callback(finished)
+    while True:
+        try:
+            event = await asyncio.wait_for(events.get(), SSE_KEEPALIVE_SECONDS)
+        except asyncio.TimeoutError:
+            yield "ping", {}
+            continue
+        if event is None:
+            break
+        yield event.event, event.data
+
+    try:
+        result = task.result()
+    except Exception as error:
+        yield "error", {"status_code": agent_error_status(error), "error": describe_agent_error(error)}
+        return
+    yield "result", _sync_response(payload, result.response)
+
+
+def prepare_agent_batch(request: Request, body: Any) -> tuple[AgentBatch, bool]:
+    """
+    Разбирает пакет: либо массив команд, либо {"commands": [...], "concurrency": N,
+    "stream": true}. Ошибки отдельных команд не валят пакет — они вернутся
+    результатом этой команды. Возвращает (пакет, нужен ли NDJSON-поток).
+    """
+    _require_secret(request)
+    options: dict[str, Any] = {}
+    if isinstance(body, dict):
+        options = body
+        body = body.get("commands")
+    if not isinstance(body, list) or not body:
+        raise HTTPException(status_code=422, detail="Ожидался непустой массив commands")
+    if len(body) > MAX_BATCH_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Не больше {MAX_BATCH_ITEMS} команд в пакете")
+
+    try:
+        concurrency = int(options.get("concurrency") or request.query_params.get("concurrency") or MAX_BATCH_CONCURRENCY)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=422, detail="concurrency должно быть числом")
+
+    batch_id = uuid4().hex[:16]
+    items: list[dict[str, Any]] = []
+    for index, raw_item in enumerate(body):
+        if isinstance(raw_item, dict) and not (raw_item.get("request_id") or raw_item.get("job_id")):
+            # Одинаковые команды пакета не должны слиться в одну по сгенерированному id.
+            raw_item = {**raw_item, "request_id": f"{batch_id}-{index}"}
+        try:
+            _, job_record = _prepare_job(request, raw_item)
+        except HTTPException as error:
+            items.append({"job": None, "error": {"status_code": error.status_code, "error": error.detail}})
+            continue
+        items.append({"job": job_record})
+
+    stream = bool(options.get("stream")) or str(request.query_params.get("stream", "")).lower() in {"1", "true", "ndjson"}
+    stream = stream or "application/x-ndjson" in (request.headers.get("accept") or "").lower()
+    return AgentBatch(items, concurrency, batch_id), stream
+
+
+async def get_agent_job_status(request: Request, request_id: str) -> dict[str, Any]:
+    """Статус задания: готовый ответ из outbox, состояние в очереди или запись в inbox."""
+    _require_secret(request)
+    if not REQUEST_ID_RE.fullmatch(request_id or ""):
+        raise HTTPException(status_code=400, detail="Неверный request_id")
+
+    response = await agent_results.get(request_id)
+    job = agent_jobs.get(request_id)
+    if response is not None:
+        return {"ok": True, "request_id": request_id, "status": "done", "response": response}
+    if job is not None:
+        return {"ok": True, **job.to_client(), "response": None}
+
+    dead = await asyncio.to_thread(load_dead_letter, request_id)
+    if dead is not None:
+        return {
+            "ok": True,
+            "request_id": request_id,
+            "agent": dead.get("agent"),
+            "status": "cancelled" if (dead.get("dead_letter") or {}).get("cancelled") else "dead",
+            "attempts": dead.get("attempts"),
+            "error": (dead.get("dead_letter") or {}).get("reason"),
+            "response": None,
+        }
+
+    job_record = await asyncio.to_thread(load_agent_job, request_id)
+    if job_record is None:
+        raise HTTPException(status_code=404, detail="Задание не найдено")
+    return {
+        "ok": True,
+        "request_id": request_id,
+        "agent": job_record.get("agent"),
+        "status": "pending",
+        "attempts": job_record.get("attempts"),
+        "submitted_at": job_record.get("received_at"),
+        "response": None,
+    }
+
+
 async def get_agent_tunnel_status() -> dict[str, Any]:
     secret = load_tunnel_secret()
     return {
@@ -238,10 +516,17 @@ async def get_agent_tunnel_status() -> dict[str, Any]:
         "configured": bool(list_agents()),
         "secret_required": bool(secret),
         "agents": list_agents(),
+        "registry": agent_registry.describe(),
+        "breakers": agent_breakers.stats(),
+        "queue": agent_jobs.stats(),
+        "results_cache": agent_results.stats(),
+        "writer": agent_writer.stats(),
+        "retention": agent_retention.stats(),
         "storage": {
             "inbox_dir": str(Path("data/agents/inbox")),
             "outbox_dir": str(Path("data/agents/outbox")),
             "archive_dir": str(Path("data/agents/archive")),
+            "dead_letter_dir": str(Path("data/agents/dead_letter")),
             "filevault_root": str(Path("data/filevault_uploads")),
         },
     }
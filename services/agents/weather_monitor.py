@@ -3,7 +3,7 @@ from __future__ import annotations
 from datetime import datetime, timezone
 from typing import Any
 
-import httpx
+from services.http_clients import http_clients
 
 from .base import AgentCommand
 
@@ -57,15 +57,24 @@ def _now_iso() -> str:
     return datetime.now(timezone.utc).isoformat()
 
 
+AGENT_SPEC = {
+    "name": "weather_monitor",
+    "class": "WeatherMonitorAgent",
+    "aliases": ["weather"],
+    "timeout": 20,
+    "concurrency": 2,
+    "description": "Текущая погода в Уфе (Open-Meteo)",
+}
+
+
 class WeatherMonitorAgent:
     name = "weather_monitor"
 
     async def run(self, command: AgentCommand) -> dict[str, Any]:
         try:
-            async with httpx.AsyncClient(timeout=15.0) as client:
-                response = await client.get(OPEN_METEO_URL)
-                response.raise_for_status()
-                data = response.json()
+            response = await http_clients.get("weather").get(OPEN_METEO_URL)
+            response.raise_for_status()
+            data = response.json()
         except Exception as e:
             return {"ok": False, "error": f"Ошибка получения погоды: {e}"}
 
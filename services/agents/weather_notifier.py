@@ -4,7 +4,7 @@ import os
 from pathlib import Path
 from typing import Any
 
-import httpx
+from services.http_clients import http_clients
 
 from .base import AgentCommand
 
@@ -12,6 +12,17 @@ WEATHER_DATA_DIR = Path("data/weather")
 MESSAGE_ID_FILE = WEATHER_DATA_DIR / "telegram_message_id.txt"
 
 
+# Агент правит одно и то же сообщение в Telegram по сохранённому message_id — строго по одному.
+AGENT_SPEC = {
+    "name": "weather_notifier",
+    "class": "WeatherNotifierAgent",
+    "aliases": ["weather_tg"],
+    "timeout": 30,
+    "concurrency": 1,
+    "description": "Публикует сводку погоды в Telegram",
+}
+
+
 class WeatherNotifierAgent:
     name = "weather_notifier"
 
@@ -27,16 +38,15 @@ class WeatherNotifierAgent:
             weather = self._read_stored_weather()
             if not weather:
                 try:
-                    async with httpx.AsyncClient(timeout=15.0) as client:
-                        resp = await client.get(
-                            "https://api.open-meteo.com/v1/forecast"
-                            "?latitude=54.74&longitude=55.97"
-                            "&current=temperature_2m,relative_humidity_2m,apparent_temperature,weather_code,wind_speed_10m"
-                            "&timezone=auto"
-                        )
-                        resp.raise_for_status()
-                        weather = resp.json().get("current", {})
-                        weather["_units"] = resp.json().get("current_units", {})
+                    resp = await http_clients.get("weather").get(
+                        "https://api.open-meteo.com/v1/forecast"
+                        "?latitude=54.74&longitude=55.97"
+                        "&current=temperature_2m,relative_humidity_2m,apparent_temperature,weather_code,wind_speed_10m"
+                        "&timezone=auto"
+                    )
+                    resp.raise_for_status()
+                    weather = resp.json().get("current", {})
+                    weather["_units"] = resp.json().get("current_units", {})
                 except Exception as e:
                     return {"ok": False, "error": f"Не удалось получить погоду: {e}"}
 
@@ -90,13 +100,12 @@ class WeatherNotifierAgent:
         if message_id:
             payload["message_id"] = message_id
         try:
-            async with httpx.AsyncClient(timeout=15.0) as client:
-                resp = await client.post(
-                    f"http://localhost:{port}/mytelegram",
-                    json=payload,
-                    headers={"x-telegram-tunnel-secret": secret},
-                )
-                data = resp.json()
+            resp = await http_clients.get("local").post(
+                f"http://localhost:{port}/mytelegram",
+                json=payload,
+                headers={"x-telegram-tunnel-secret": secret},
+            )
+            data = resp.json()
             if data.get("ok"):
                 action = "edited" if message_id else "sent"
                 return {"ok": True, "action": action, "message_id": data.get("message_id")}
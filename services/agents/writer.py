@@ -0,0 +1,220 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable
+from uuid import uuid4
+
+from utils.logger import log
+
+MAX_COMMIT_OPS = 512
+
+
+@dataclass(slots=True)
+class _WriteOp:
+    kind: str  # "write" | "append" | "unlink" | "call"
+    path: Path | None = None
+    data: bytes = b""
+    call: Callable[[], Any] | None = None
+    durable: bool = False
+    future: asyncio.Future | None = None
+    result: Any = None
+    error: BaseException | None = None
+
+
+@dataclass(slots=True)
+class _WriterStats:
+    commits: int = 0
+    ops: int = 0
+    bytes_written: int = 0
+    fsyncs: int = 0
+    errors: int = 0
+    last_commit_ms: float = 0.0
+    largest_commit: int = 0
+
+
+def _fsync_directory(path: Path) -> None:
+    fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class AgentStorageWriter:
+    """
+    Групповая запись артефактов агентов вне event loop.
+
+    Операции копятся в очереди; одна фоновая задача забирает всё, что
+    накопилось, и выполняет пачкой в пуле потоков — пока идёт коммит,
+    следующие операции собираются в новую пачку. Порядок операций
+    сохраняется, так что inbox всегда пишется раньше outbox того же задания.
+
+    Сегменты архива (append-only) синхронизируются одним fsync на пачку.
+    Отдельные файлы inbox/outbox fsync-аются, только если в пачке есть
+    операция с durable=True — и тогда один раз на файл и каталог; такие
+    вызовы ждут окончания коммита, остальные возвращаются сразу.
+    """
+
+    def __init__(self) -> None:
+        self._pending: list[_WriteOp] = []
+        self._wakeup: asyncio.Event | None = None
+        self._idle: asyncio.Event | None = None
+        self._task: asyncio.Task | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._stats = _WriterStats()
+
+    def start(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._task is not None and not self._task.done() and self._loop is loop:
+            return
+        self._loop = loop
+        self._wakeup = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._task = asyncio.create_task(self._run())
+        if self._pending:
+            self._wakeup.set()
+            self._idle.clear()
+
+    async def stop(self) -> None:
+        await self.flush()
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    async def flush(self) -> None:
+        """Дожидается записи всего, что уже поставлено в очередь."""
+        if self._task is None:
+            return
+        await self._idle.wait()
+
+    # ------------------------------------------------------------------ #
+
+    async def _submit(self, op: _WriteOp, wait: bool) -> Any:
+        self.start()
+        if wait:
+            op.future = self._loop.create_future()
+        self._pending.append(op)
+        self._idle.clear()
+        self._wakeup.set()
+        if op.future is not None:
+            return await op.future
+        return None
+
+    async def write(self, path: Path, data: bytes, *, durable: bool = False) -> None:
+        """Атомарная замена файла (tmp + rename)."""
+        await self._submit(_WriteOp("write", path=path, data=data, durable=durable), durable)
+
+    async def append(self, path: Path, data: bytes, *, durable: bool = False) -> None:
+        await self._submit(_WriteOp("append", path=path, data=data, durable=durable), durable)
+
+    async def unlink(self, path: Path, *, durable: bool = False) -> None:
+        await self._submit(_WriteOp("unlink", path=path, durable=durable), durable)
+
+    async def call(self, function: Callable[[], Any], *, wait: bool = False) -> Any:
+        """Произвольная блокирующая операция в общем порядке записи (например, файл в FileVault)."""
+        return await self._submit(_WriteOp("call", call=function), wait)
+
+    # ------------------------------------------------------------------ #
+
+    async def _run(self) -> None:
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            while self._pending:
+                batch, self._pending = self._pending[:MAX_COMMIT_OPS], self._pending[MAX_COMMIT_OPS:]
+                await asyncio.to_thread(self._commit, batch)
+                for op in batch:
+                    if op.future is None or op.future.done():
+                        continue
+                    if op.error is not None:
+                        op.future.set_exception(op.error)
+                    else:
+                        op.future.set_result(op.result)
+            self._idle.set()
+
+    def _commit(self, batch: list[_WriteOp]) -> None:
+        started = time.monotonic()
+        durable = any(op.durable for op in batch)
+        directories_to_sync: set[Path] = set()
+        segments: dict[Path, Any] = {}
+        try:
+            for op in batch:
+                try:
+                    if op.kind == "write":
+                        op.path.parent.mkdir(parents=True, exist_ok=True)
+                        temp_path = op.path.with_name(f".{op.path.name}.{uuid4().hex}.tmp")
+                        with temp_path.open("wb") as handle:
+                            handle.write(op.data)
+                            if durable:
+                                handle.flush()
+                                os.fsync(handle.fileno())
+                                self._stats.fsyncs += 1
+                        os.replace(temp_path, op.path)
+                        self._stats.bytes_written += len(op.data)
+                        if durable:
+                            directories_to_sync.add(op.path.parent)
+                    elif op.kind == "append":
+                        handle = segments.get(op.path)
+                        if handle is None:
+                            op.path.parent.mkdir(parents=True, exist_ok=True)
+                            is_new = not op.path.exists()
+                            handle = segments[op.path] = op.path.open("ab")
+                            if is_new:
+                                directories_to_sync.add(op.path.parent)
+                        handle.write(op.data)
+                        self._stats.bytes_written += len(op.data)
+                    elif op.kind == "unlink":
+                        op.path.unlink(missing_ok=True)
+                        if durable:
+                            directories_to_sync.add(op.path.parent)
+                    elif op.kind == "call":
+                        op.result = op.call()
+                except Exception as error:
+                    op.error = error
+                    self._stats.errors += 1
+                    log("AGENTS", f"Ошибка записи артефакта агента ({op.kind} {op.path or ''}): {error}", level=logging.ERROR)
+
+            # Один fsync на сегмент за всю пачку — в этом и смысл группового коммита.
+            for handle in segments.values():
+                handle.flush()
+                os.fsync(handle.fileno())
+                self._stats.fsyncs += 1
+            for directory in directories_to_sync:
+                _fsync_directory(directory)
+                self._stats.fsyncs += 1
+        except Exception as error:
+            self._stats.errors += 1
+            log("AGENTS", f"Ошибка группового коммита артефактов агентов: {error}", level=logging.ERROR)
+            for op in batch:
+                if op.error is None and op.durable:
+                    op.error = error
+        finally:
+            for handle in segments.values():
+                handle.close()
+
+        self._stats.commits += 1
+        self._stats.ops += len(batch)
+        self._stats.largest_commit = max(self._stats.largest_commit, len(batch))
+        self._stats.last_commit_ms = round((time.monotonic() - started) * 1000, 2)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "pending": len(self._pending),
+            "commits": self._stats.commits,
+            "ops": self._stats.ops,
+            "bytes_written": self._stats.bytes_written,
+            "fsyncs": self._stats.fsyncs,
+            "errors": self._stats.errors,
+            "largest_commit": self._stats.largest_commit,
+            "last_commit_ms": self._stats.last_commit_ms,
+        }
+
+
+agent_writer = AgentStorageWriter()
@@ -0,0 +1,152 @@
+from __future__ import annotations
+
+import io
+import time
+import zipfile
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path, PurePosixPath
+from typing import Iterable, Iterator
+
+ARCHIVE_CHUNK_SIZE = 256 * 1024
+ZIP64_THRESHOLD = 0x7FFFFFFF
+
+# Эти форматы уже сжаты: deflate только тратит CPU и почти ничего не выигрывает.
+_PRECOMPRESSED_PREFIXES = ("image/", "video/", "audio/", "font/woff")
+_PRECOMPRESSED_TYPES = {
+    "application/zip",
+    "application/gzip",
+    "application/x-gzip",
+    "application/x-7z-compressed",
+    "application/x-rar-compressed",
+    "application/vnd.rar",
+    "application/x-bzip2",
+    "application/x-xz",
+    "application/zstd",
+    "application/pdf",
+    "application/epub+zip",
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "application/vnd.openxmlformats-officedocument.presentationml.presentation",
+}
+_COMPRESSIBLE_IMAGES = {"image/svg+xml", "image/bmp", "image/x-icon", "image/vnd.microsoft.icon"}
+
+
+@dataclass(slots=True)
+class ArchiveEntry:
+    arcname: str
+    path: Path
+    content_type: str
+    modified: datetime | None = None
+
+
+def should_deflate(content_type: str) -> bool:
+    content_type = (content_type or "").split(";", 1)[0].strip().lower()
+    if content_type in _COMPRESSIBLE_IMAGES:
+        return True
+    return not (content_type.startswith(_PRECOMPRESSED_PREFIXES) or content_type in _PRECOMPRESSED_TYPES)
+
+
+def safe_component(value: str, fallback: str = "_") -> str:
+    cleaned = str(value or "").replace("/", "_").replace("\\", "_").strip()
+    return fallback if cleaned in {"", ".", ".."} else cleaned
+
+
+class UniqueNames:
+    """Разводит одинаковые пути внутри архива: `a.txt`, `a (2).txt`, ..."""
+
+    def __init__(self) -> None:
+        self._taken: set[str] = set()
+
+    def claim(self, arcname: str) -> str:
+        candidate = arcname
+        counter = 2
+        while candidate.casefold() in self._taken:
+            path = PurePosixPath(arcname)
+            candidate = str(path.with_name(f"{path.stem} ({counter}){path.suffix}"))
+            counter += 1
+        self._taken.add(candidate.casefold())
+        return candidate
+
+
+class _ChunkSink(io.RawIOBase):
+    """Несбрасываемый поток для ZipFile: накопленные байты забираются генератором."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._buffer = bytearray()
+        self._offset = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._buffer += data
+        self._offset += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._offset
+
+    def drain(self) -> bytes:
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+
+def _zip_time(value: datetime | None) -> tuple[int, int, int, int, int, int]:
+    if value is None:
+        return time.localtime()[:6]
+    stamp = value.timetuple()[:6]
+    return stamp if stamp[0] >= 1980 else (1980, 1, 1, 0, 0, 0)
+
+
+def iter_zip(entries: Iterable[ArchiveEntry], directories: Iterable[str] = ()) -> Iterator[bytes]:
+    """
+    Собирает ZIP на лету и отдаёт его кусками. В памяти держится не больше
+    одного прочитанного блока и выход компрессора; размер и CRC каждого файла
+    пишутся в data descriptor, поэтому перематывать поток не нужно.
+
+    Синхронный генератор: StreamingResponse крутит его в пуле потоков,
+    так что чтение с диска и deflate не блокируют event loop.
+    """
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, mode="w", allowZip64=True) as archive:
+        for directory in directories:
+            info = zipfile.ZipInfo(directory.rstrip("/") + "/", date_time=time.localtime()[:6])
+            info.external_attr = 0o40755 << 16
+            archive.writestr(info, b"")
+        chunk = sink.drain()
+        if chunk:
+            yield chunk
+
+        for entry in entries:
+            try:
+                source = entry.path.open("rb")
+            except OSError:
+                continue
+            with source:
+                size = entry.path.stat().st_size
+                info = zipfile.ZipInfo(entry.arcname, date_time=_zip_time(entry.modified))
+                info.external_attr = 0o644 << 16
+                info.file_size = size
+                if should_deflate(entry.content_type):
+                    info.compress_type = zipfile.ZIP_DEFLATED
+                else:
+                    info.compress_type = zipfile.ZIP_STORED
+                with archive.open(info, mode="w", force_zip64=size > ZIP64_THRESHOLD) as target:
+                    while True:
+                        data = source.read(ARCHIVE_CHUNK_SIZE)
+                        if not data:
+                            break
+                        target.write(data)
+                        chunk = sink.drain()
+                        if chunk:
+                            yield chunk
+            chunk = sink.drain()
+            if chunk:
+                yield chunk
+
+    chunk = sink.drain()
+    if chunk:
+        yield chunk
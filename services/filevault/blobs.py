@@ -0,0 +1,272 @@
+from __future__ import annotations
+
+import fcntl
+import hashlib
+import os
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+from threading import RLock
+from typing import IO, Any
+from uuid import uuid4
+
+from utils.logger import log
+
+from .paths import BLOBS_ROOT, FILEVAULT_ROOT, SHA256_RE, blob_path_for, cas_blob_path
+
+STALE_TEMP_SECONDS = 24 * 60 * 60
+# Свежие blob-ы без ссылки могут принадлежать загрузке, которая ещё не записала метаданные.
+GC_GRACE_SECONDS = 60 * 60
+# Счётчики ссылок живут в памяти процесса: gc/compact из CLI при работающем
+# сервере удалил бы только что принятый им blob. Владелец хранилища держит
+# flock на этом файле, второй процесс его не получит.
+OWNER_LOCK_NAME = "_owner.lock"
+
+
+class BlobStore:
+    """
+    Content-addressed хранилище байтов FileVault: `_blobs/ab/cd/<sha256>`.
+
+    Одинаковое содержимое хранится один раз, сколько бы file_id на него ни
+    ссылалось. Счётчики ссылок держатся в памяти и строятся из каталога при
+    старте (load_refs) — каталог остаётся единственным источником истины, а
+    всё, что осталось без ссылок после сбоя между шагами, подбирает `gc`.
+    """
+
+    def __init__(self, root: Path, blobs_root: Path) -> None:
+        self.root = root
+        self.blobs_root = blobs_root
+        self._lock = RLock()
+        self._refs: Counter[str] | None = None
+        self._owner_lock: IO[str] | None = None
+
+    def acquire_owner_lock(self) -> bool:
+        """
+        Объявляет процесс единственным владельцем хранилища на всё время
+        работы (сервер — при старте, CLI — на время обслуживания).
+        False — хранилищем уже владеет другой процесс.
+        """
+        if self._owner_lock is not None:
+            return True
+        self.blobs_root.mkdir(parents=True, exist_ok=True)
+        handle = (self.blobs_root / OWNER_LOCK_NAME).open("a")
+        try:
+            fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            return False
+        self._owner_lock = handle
+        return True
+
+    def release_owner_lock(self) -> None:
+        handle, self._owner_lock = self._owner_lock, None
+        if handle is not None:
+            # Закрытие снимает flock; файл не удаляем, иначе два процесса могут запереть разные inode.
+            handle.close()
+
+    def path_for(self, sha256: str) -> Path:
+        return cas_blob_path(sha256, self.blobs_root)
+
+    def path_for_meta(self, meta: dict) -> Path:
+        return blob_path_for(meta, self.root)
+
+    def _ensure_refs(self) -> Counter[str]:
+        if self._refs is None:
+            from .catalog import get_catalog
+
+            refs: Counter[str] = Counter()
+            for record in get_catalog().all_records():
+                if record.get("storage") == "cas" and record.get("sha256"):
+                    refs[record["sha256"]] += 1
+            self._refs = refs
+        return self._refs
+
+    def load_refs(self) -> None:
+        """
+        Строит счётчики, если их ещё нет. Вызывается при старте и перед
+        удалением записей из каталога: построенные после удаления, они не
+        учли бы удалённую запись, и общий blob ушёл бы вместе с ней.
+        """
+        with self._lock:
+            self._ensure_refs()
+
+    def reset_refs(self) -> None:
+        with self._lock:
+            self._refs = None
+
+    def temp_path(self) -> Path:
+        # Временный файл лежит на той же файловой системе, что и хранилище, чтобы os.replace был атомарным.
+        # Не в корне: свои временные файлы не должны менять mtime каталога, по которому индекс ловит внешние правки.
+        self.blobs_root.mkdir(parents=True, exist_ok=True)
+        return self.blobs_root / f"_tmp_{uuid4().hex}.part"
+
+    def ingest_file(self, temp_path: Path, sha256: str) -> Path:
+        """
+        Забирает готовый временный файл под ключ sha256 и увеличивает счётчик.
+        Если такой blob уже есть — временный файл просто удаляется.
+        """
+        target = self.path_for(sha256)
+        with self._lock:
+            refs = self._ensure_refs()
+            if target.exists():
+                temp_path.unlink(missing_ok=True)
+                os.utime(target)
+            else:
+                target.parent.mkdir(parents=True, exist_ok=True)
+                os.replace(temp_path, target)
+            refs[sha256] += 1
+        return target
+
+    def ingest_bytes(self, body: bytes) -> tuple[str, Path]:
+        sha256 = hashlib.sha256(body).hexdigest()
+        target = self.path_for(sha256)
+        with self._lock:
+            refs = self._ensure_refs()
+            if target.exists():
+                os.utime(target)
+            else:
+                temp_path = self.temp_path()
+                with temp_path.open("wb") as handle:
+                    handle.write(body)
+                    handle.flush()
+                    os.fsync(handle.fileno())
+                target.parent.mkdir(parents=True, exist_ok=True)
+                os.replace(temp_path, target)
+            refs[sha256] += 1
+        return sha256, target
+
+    def release(self, meta: dict) -> bool:
+        """Снимает ссылку удалённой записи; удаляет байты, когда ссылок не осталось."""
+        path = self.path_for_meta(meta)
+        if meta.get("storage") != "cas":
+            if path.exists():
+                path.unlink()
+                return True
+            return False
+
+        sha256 = meta["sha256"]
+        with self._lock:
+            refs = self._ensure_refs()
+            refs[sha256] -= 1
+            if refs[sha256] > 0:
+                return False
+            refs.pop(sha256, None)
+            if path.exists():
+                path.unlink()
+                return True
+        return False
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            refs = self._ensure_refs()
+            return {"unique_blobs": len(refs), "references": sum(refs.values())}
+
+    # ------------------------------------------------------------------ #
+    # Обслуживание
+    # ------------------------------------------------------------------ #
+
+    def migrate_legacy(self) -> dict[str, int]:
+        """Переносит исторические `<file_id>.bin` в CAS (с дедупликацией), не меняя порядок в списке."""
+        from .catalog import get_catalog
+        from .uploads import sha256_file
+
+        catalog = get_catalog()
+        migrated = 0
+        bytes_saved = 0
+        for record in catalog.all_records():
+            if record.get("storage") == "cas":
+                continue
+            legacy_path = self.path_for_meta(record)
+            if not legacy_path.exists():
+                continue
+            sha256 = record.get("sha256") or sha256_file(legacy_path)
+            if self.path_for(sha256).exists():
+                bytes_saved += legacy_path.stat().st_size
+            self.ingest_file(legacy_path, sha256)
+            record["sha256"] = sha256
+            record["storage"] = "cas"
+            catalog.put(record, keep_order=True)
+            migrated += 1
+        return {"migrated": migrated, "bytes_deduplicated": bytes_saved}
+
+    def collect_garbage(self, dry_run: bool = False) -> dict[str, Any]:
+        """
+        Удаляет blob-ы без ссылок из каталога, осиротевшие `<file_id>.bin`
+        и зависшие временные файлы загрузок. Счётчики пересчитываются заново.
+        """
+        from .catalog import get_catalog
+
+        with self._lock:
+            records = get_catalog().all_records()
+            referenced = {record["sha256"] for record in records if record.get("storage") == "cas" and record.get("sha256")}
+            legacy_ids = {record["file_id"] for record in records if record.get("storage") != "cas"}
+
+            removed_blobs = 0
+            reclaimed = 0
+            grace_cutoff = time.time() - GC_GRACE_SECONDS
+            if self.blobs_root.exists():
+                for path in self.blobs_root.glob("*/*/*"):
+                    if not SHA256_RE.fullmatch(path.name) or path.name in referenced:
+                        continue
+                    if path.stat().st_mtime > grace_cutoff:
+                        continue
+                    reclaimed += path.stat().st_size
+                    removed_blobs += 1
+                    if not dry_run:
+                        path.unlink()
+
+            removed_legacy = 0
+            for path in self.root.glob("*.bin"):
+                if path.stem in legacy_ids or path.stat().st_mtime > grace_cutoff:
+                    continue
+                reclaimed += path.stat().st_size
+                removed_legacy += 1
+                if not dry_run:
+                    path.unlink()
+
+            removed_temp = 0
+            cutoff = time.time() - STALE_TEMP_SECONDS
+            # В корне — временные файлы, оставшиеся от версий до переноса их в _blobs.
+            for path in (*self.blobs_root.glob("_tmp_*.part"), *self.root.glob("_tmp_*.part")):
+                if path.stat().st_mtime < cutoff:
+                    reclaimed += path.stat().st_size
+                    removed_temp += 1
+                    if not dry_run:
+                        path.unlink()
+
+            self._refs = None
+
+        result = {
+            "dry_run": dry_run,
+            "removed_blobs": removed_blobs,
+            "removed_legacy_blobs": removed_legacy,
+            "removed_temp_files": removed_temp,
+            "bytes_reclaimed": reclaimed,
+        }
+        log("FILEVAULT", f"Сборка мусора blob-хранилища: {result}")
+        return result
+
+
+blob_store = BlobStore(FILEVAULT_ROOT, BLOBS_ROOT)
+
+
+def _main(argv: list[str]) -> int:
+    command = argv[0] if argv else ""
+    if command not in {"gc", "compact"}:
+        print("usage: python -m services.filevault.blobs gc [--dry-run] | compact")
+        return 2
+    if not blob_store.acquire_owner_lock():
+        print("Хранилище занято работающим сервером (или другим обслуживанием) — остановите его и повторите.")
+        return 1
+    try:
+        if command == "compact":
+            print(blob_store.migrate_legacy())
+        print(blob_store.collect_garbage(dry_run="--dry-run" in argv))
+    finally:
+        blob_store.release_owner_lock()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(_main(sys.argv[1:]))
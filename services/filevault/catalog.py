@@ -0,0 +1,632 @@
+from __future__ import annotations
+
+import json
+import os
+import sqlite3
+import sys
+import time
+from pathlib import Path
+from threading import RLock
+from typing import Any, Callable, Iterable
+
+from utils.logger import log
+
+from .index import FileMetaIndex, file_index
+from .listing import FileQuery, sort_value
+from .paths import FILEVAULT_ROOT
+
+CATALOG_BACKEND_ENV = "FILEVAULT_CATALOG_BACKEND"
+SQLITE_CATALOG_PATH = FILEVAULT_ROOT / "_catalog.sqlite3"
+
+
+def _escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _json_dumps(payload: Any) -> str:
+    return json.dumps(payload, ensure_ascii=False, indent=2)
+
+
+class CatalogChanges:
+    """
+    Лента изменений каталога для производных структур (поисковый индекс и т.п.).
+
+    Виды событий: "put" — записи созданы или изменены, "remove" — удалены,
+    "folders" — изменился список папок, "reset" — каталог перечитан целиком.
+    Ошибка подписчика логируется и не ломает запись в каталог.
+    """
+
+    def __init__(self) -> None:
+        self._listeners: list[Callable[[str, list[dict]], None]] = []
+
+    def subscribe(self, listener: Callable[[str, list[dict]], None]) -> None:
+        if listener not in self._listeners:
+            self._listeners.append(listener)
+
+    def emit(self, kind: str, records: list[dict] | None = None) -> None:
+        for listener in list(self._listeners):
+            try:
+                listener(kind, records or [])
+            except Exception as error:
+                log("FILEVAULT", f"Ошибка обработчика изменений каталога ({kind}): {error}")
+
+
+catalog_changes = CatalogChanges()
+
+
+class JsonCatalog:
+    """
+    Исходный формат хранения: sidecar `<file_id>.json` на каждый blob и
+    общий `_folders.json`. Чтение идёт через процессный индекс, запись
+    файлов и папок сериализована блокировками, чтобы параллельные запросы
+    не затирали друг друга при read-modify-write.
+    """
+
+    backend = "json"
+
+    def __init__(self, index: FileMetaIndex) -> None:
+        self.index = index
+        self.root = index.root
+        self._files_lock = RLock()
+        self._folders_lock = RLock()
+        # Пересборка индекса с диска и внешняя правка папок идут в ту же ленту, что и свои записи.
+        index.subscribe(catalog_changes.emit)
+
+    def _meta_path(self, file_id: str) -> Path:
+        return self.root / f"{file_id}.json"
+
+    def meta_location(self, file_id: str) -> str:
+        return str(self._meta_path(file_id))
+
+    def refresh(self) -> None:
+        self.index.refresh()
+
+    def check_external_changes(self) -> None:
+        """Замечает правки sidecar-ов мимо API раньше, чем кэши над каталогом ответят по старым данным."""
+        self.index.check()
+
+    # ----------------------------- файлы ----------------------------- #
+
+    def get(self, file_id: str) -> dict | None:
+        return self.index.get(file_id)
+
+    def all_records(self) -> list[dict]:
+        return self.index.all_records()
+
+    def folder_records(self, folder_id: str | None) -> list[dict]:
+        return self.index.folder_records(folder_id)
+
+    def folder_file_ids(self, folder_ids: set[str | None]) -> list[str]:
+        return self.index.folder_file_ids(folder_ids)
+
+    def query(self, query: FileQuery) -> list[dict]:
+        return self.index.query(query)
+
+    def folder_totals(self) -> dict[str | None, tuple[int, int]]:
+        return self.index.folder_totals()
+
+    def totals(self) -> tuple[int, int]:
+        return self.index.totals()
+
+    def _write(self, meta: dict, size_bytes: int | None, keep_order: bool) -> dict:
+        meta_path = self._meta_path(meta["file_id"])
+        with self.index.writing():
+            previous_mtime = meta_path.stat().st_mtime if keep_order and meta_path.exists() else None
+            meta_path.write_text(_json_dumps(meta), encoding="utf-8")
+            if previous_mtime is not None:
+                # Порядок в списке после пересборки индекса берётся из mtime sidecar-а.
+                os.utime(meta_path, (previous_mtime, previous_mtime))
+            return self.index.upsert(meta, size_bytes, keep_order=keep_order)
+
+    def put(self, meta: dict, size_bytes: int | None = None, keep_order: bool = False) -> dict:
+        with self._files_lock:
+            record = self._write(meta, size_bytes, keep_order)
+        catalog_changes.emit("put", [record])
+        return record
+
+    def update_fields(self, file_id: str, fields: dict, *, expect_size: int | None = None) -> dict | None:
+        """
+        Дописывает поля в актуальные метаданные, перечитанные под блокировкой записи.
+        None — файла уже нет или его размер не равен expect_size; тогда ничего не пишется.
+        """
+        with self._files_lock:
+            meta = self.index.get(file_id)
+            if meta is None or not self._meta_path(file_id).exists():
+                return None
+            if expect_size is not None and meta.get("size_bytes") != expect_size:
+                return None
+            meta.update(fields)
+            record = self._write(meta, None, keep_order=True)
+        catalog_changes.emit("put", [record])
+        return record
+
+    def move(self, file_ids: list[str], folder_id: str | None, updated_at: str) -> list[dict]:
+        moved: list[dict] = []
+        for file_id in file_ids:
+            meta = self.index.get(file_id)
+            if meta is None:
+                continue
+            meta["folder_id"] = folder_id
+            meta["updated_at"] = updated_at
+            moved.append(self.put(meta))
+        return moved
+
+    def remove(self, file_ids: Iterable[str]) -> list[dict]:
+        """Удаляет записи; возвращает метаданные удалённых (нужны, чтобы освободить blob-ы)."""
+        removed: list[dict] = []
+        with self._files_lock:
+            for file_id in file_ids:
+                meta_path = self._meta_path(file_id)
+                with self.index.writing():
+                    record = self.index.remove(file_id)
+                    if meta_path.exists():
+                        if record is None:
+                            try:
+                                record = json.loads(meta_path.read_text(encoding="utf-8"))
+                            except Exception:
+                                record = {"file_id": file_id}
+                        meta_path.unlink()
+                if record is not None:
+                    removed.append(record)
+        if removed:
+            catalog_changes.emit("remove", removed)
+        return removed
+
+    # ----------------------------- папки ----------------------------- #
+
+    def folders(self) -> list[Any]:
+        return self.index.folders()
+
+    def put_folder(self, folder: dict) -> None:
+        with self._folders_lock:
+            folders = [item for item in self.index.folders() if isinstance(item, dict)]
+            for position, item in enumerate(folders):
+                if item.get("folder_id") == folder["folder_id"]:
+                    folders[position] = dict(folder)
+                    break
+            else:
+                folders.append(dict(folder))
+            self.index.save_folders(folders)
+        catalog_changes.emit("folders")
+
+    def delete_folder_tree(self, folder_id: str) -> tuple[list[str], list[dict]]:
+        """Удаляет папку с поддеревом; возвращает (id папок, метаданные удалённых файлов)."""
+        with self._folders_lock:
+            folders = [item for item in self.index.folders() if isinstance(item, dict)]
+            children: dict[Any, list[str]] = {}
+            for item in folders:
+                children.setdefault(item.get("parent_id"), []).append(item.get("folder_id"))
+
+            collected = [folder_id]
+            cursor = 0
+            while cursor < len(collected):
+                collected.extend(children.get(collected[cursor], []))
+                cursor += 1
+
+            folder_set = set(collected)
+            removed = self.remove(self.index.folder_file_ids(folder_set))
+            self.index.save_folders([item for item in folders if item.get("folder_id") not in folder_set])
+        catalog_changes.emit("folders")
+        return collected, removed
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    file_id TEXT PRIMARY KEY,
+    folder_id TEXT,
+    original_name TEXT NOT NULL,
+    content_type TEXT,
+    size_bytes INTEGER NOT NULL DEFAULT 0,
+    uploaded_at TEXT,
+    sort_key REAL NOT NULL,
+    meta TEXT NOT NULL,
+    name_key TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS files_folder_idx ON files(folder_id, sort_key DESC);
+CREATE INDEX IF NOT EXISTS files_sort_idx ON files(sort_key DESC);
+CREATE TABLE IF NOT EXISTS folders (
+    folder_id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    parent_id TEXT,
+    created_at TEXT,
+    updated_at TEXT
+);
+CREATE INDEX IF NOT EXISTS folders_parent_idx ON folders(parent_id);
+"""
+
+# Индексы под keyset-пагинацию; создаются после миграции схемы, т.к. name_key мог появиться только что.
+_LISTING_INDEXES = """
+CREATE INDEX IF NOT EXISTS files_name_idx ON files(name_key, file_id);
+CREATE INDEX IF NOT EXISTS files_size_idx ON files(size_bytes, file_id);
+CREATE INDEX IF NOT EXISTS files_uploaded_idx ON files(COALESCE(uploaded_at, ''), file_id);
+"""
+
+_FOLDER_COLUMNS = ("folder_id", "name", "parent_id", "created_at", "updated_at")
+_SORT_COLUMNS = {
+    "name": "name_key",
+    "size": "size_bytes",
+    "uploaded_at": "COALESCE(uploaded_at, '')",
+}
+
+
+class SqliteCatalog:
+    """
+    Каталог FileVault в одном SQLite-файле (WAL). Файлы и папки лежат в
+    индексированных таблицах, поэтому пакетные операции и выборки по папке
+    выполняются одним запросом, а запись папок идёт транзакциями вместо
+    перезаписи `_folders.json` целиком.
+    """
+
+    backend = "sqlite"
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = RLock()
+        self._conn = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._migrate_schema()
+        self._conn.executescript(_LISTING_INDEXES)
+
+    def _migrate_schema(self) -> None:
+        columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(files)")}
+        if "name_key" in columns:
+            return
+        with self._transaction():
+            self._conn.execute("ALTER TABLE files ADD COLUMN name_key TEXT NOT NULL DEFAULT ''")
+            rows = self._conn.execute("SELECT file_id, original_name FROM files").fetchall()
+            self._conn.executemany(
+                "UPDATE files SET name_key = ? WHERE file_id = ?",
+                [(sort_value(dict(row), "name"), row["file_id"]) for row in rows],
+            )
+
+    def meta_location(self, file_id: str) -> str:
+        return f"{self.path}#{file_id}"
+
+    def refresh(self) -> None:
+        # Источник истины — сама база, перечитывать нечего.
+        return None
+
+    def check_external_changes(self) -> None:
+        return None
+
+    def _transaction(self):
+        return _SqliteTransaction(self._conn, self._lock)
+
+    @staticmethod
+    def _row_to_record(row: sqlite3.Row) -> dict:
+        record = json.loads(row["meta"])
+        record["size_bytes"] = int(row["size_bytes"])
+        return record
+
+    @staticmethod
+    def _placeholders(count: int) -> str:
+        return ",".join("?" for _ in range(count))
+
+    # ----------------------------- файлы ----------------------------- #
+
+    def get(self, file_id: str) -> dict | None:
+        with self._lock:
+            row = self._conn.execute("SELECT meta, size_bytes FROM files WHERE file_id = ?", (file_id,)).fetchone()
+        return self._row_to_record(row) if row else None
+
+    def all_records(self) -> list[dict]:
+        with self._lock:
+            rows = self._conn.execute("SELECT meta, size_bytes FROM files ORDER BY sort_key DESC").fetchall()
+        return [self._row_to_record(row) for row in rows]
+
+    def folder_records(self, folder_id: str | None) -> list[dict]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT meta, size_bytes FROM files WHERE folder_id IS ? ORDER BY sort_key DESC",
+                (folder_id,),
+            ).fetchall()
+        return [self._row_to_record(row) for row in rows]
+
+    def _folder_clause(self, folder_ids: set[str | None]) -> tuple[str, list[Any]]:
+        ids = [item for item in folder_ids if item is not None]
+        clauses = []
+        if ids:
+            clauses.append(f"folder_id IN ({self._placeholders(len(ids))})")
+        if None in folder_ids:
+            clauses.append("folder_id IS NULL")
+        return " OR ".join(clauses), ids
+
+    def folder_file_ids(self, folder_ids: set[str | None]) -> list[str]:
+        clause, params = self._folder_clause(folder_ids)
+        if not clause:
+            return []
+        with self._lock:
+            rows = self._conn.execute(f"SELECT file_id FROM files WHERE {clause}", params).fetchall()
+        return [row["file_id"] for row in rows]
+
+    def query(self, query: FileQuery) -> list[dict]:
+        column = _SORT_COLUMNS[query.sort]
+        direction = "DESC" if query.descending else "ASC"
+        clauses: list[str] = []
+        params: list[Any] = []
+
+        if query.after is not None:
+            clauses.append(f"({column}, file_id) {'<' if query.descending else '>'} (?, ?)")
+            params.extend(query.after)
+        if query.folder_ids is not None:
+            clause, folder_params = self._folder_clause(query.folder_ids)
+            if not clause:
+                return []
+            clauses.append(f"({clause})")
+            params.extend(folder_params)
+        if query.content_types:
+            type_clauses = []
+            for content_type in query.exact_types:
+                type_clauses.append("(lower(content_type) = ? OR lower(content_type) LIKE ? ESCAPE '\\')")
+                params.extend([content_type, _escape_like(content_type) + ";%"])
+            for prefix in query.type_prefixes:
+                type_clauses.append("lower(content_type) LIKE ? ESCAPE '\\'")
+                params.append(_escape_like(prefix) + "%")
+            clauses.append(f"({' OR '.join(type_clauses)})")
+        if query.uploaded_from:
+            clauses.append("COALESCE(uploaded_at, '') >= ?")
+            params.append(query.uploaded_from)
+        if query.uploaded_to:
+            clauses.append("COALESCE(uploaded_at, '') <= ?")
+            params.append(query.uploaded_to)
+
+        sql = "SELECT meta, size_bytes FROM files"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += f" ORDER BY {column} {direction}, file_id {direction}"
+        if query.fetch_limit is not None:
+            sql += " LIMIT ?"
+            params.append(query.fetch_limit)
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [self._row_to_record(row) for row in rows]
+
+    def folder_totals(self) -> dict[str | None, tuple[int, int]]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT folder_id, COUNT(*) AS cnt, COALESCE(SUM(size_bytes), 0) AS total FROM files GROUP BY folder_id"
+            ).fetchall()
+        return {row["folder_id"]: (int(row["cnt"]), int(row["total"])) for row in rows}
+
+    def totals(self) -> tuple[int, int]:
+        with self._lock:
+            row = self._conn.execute("SELECT COUNT(*) AS cnt, COALESCE(SUM(size_bytes), 0) AS total FROM files").fetchone()
+        return int(row["cnt"]), int(row["total"])
+
+    def _upsert_row(self, meta: dict, size_bytes: int, sort_key: float) -> None:
+        self._conn.execute(
+            """
+            INSERT INTO files (file_id, folder_id, original_name, content_type, size_bytes, uploaded_at, sort_key, meta, name_key)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(file_id) DO UPDATE SET
+                folder_id = excluded.folder_id,
+                original_name = excluded.original_name,
+                content_type = excluded.content_type,
+                size_bytes = excluded.size_bytes,
+                uploaded_at = excluded.uploaded_at,
+                sort_key = excluded.sort_key,
+                meta = excluded.meta,
+                name_key = excluded.name_key
+            """,
+            (
+                meta["file_id"],
+                meta.get("folder_id") or None,
+                str(meta.get("original_name") or meta["file_id"]),
+                meta.get("content_type"),
+                int(size_bytes),
+                meta.get("uploaded_at"),
+                sort_key,
+                json.dumps(meta, ensure_ascii=False),
+                sort_value(meta, "name"),
+            ),
+        )
+
+    def put(self, meta: dict, size_bytes: int | None = None, keep_order: bool = False) -> dict:
+        with self._transaction():
+            row = self._conn.execute("SELECT size_bytes, sort_key FROM files WHERE file_id = ?", (meta["file_id"],)).fetchone()
+            if size_bytes is None:
+                size_bytes = int(row["size_bytes"]) if row else int(meta.get("size_bytes", 0) or 0)
+            sort_key = row["sort_key"] if keep_order and row else time.time()
+            self._upsert_row(meta, size_bytes, sort_key)
+        record = dict(meta)
+        record["size_bytes"] = int(size_bytes)
+        catalog_changes.emit("put", [record])
+        return record
+
+    def update_fields(self, file_id: str, fields: dict, *, expect_size: int | None = None) -> dict | None:
+        with self._transaction():
+            row = self._conn.execute("SELECT meta, size_bytes, sort_key FROM files WHERE file_id = ?", (file_id,)).fetchone()
+            if row is None or (expect_size is not None and int(row["size_bytes"]) != expect_size):
+                return None
+            record = self._row_to_record(row)
+            record.update(fields)
+            self._upsert_row(record, record["size_bytes"], row["sort_key"])
+        catalog_changes.emit("put", [record])
+        return record
+
+    def move(self, file_ids: list[str], folder_id: str | None, updated_at: str) -> list[dict]:
+        if not file_ids:
+            return []
+        placeholders = self._placeholders(len(file_ids))
+        with self._transaction():
+            self._conn.execute(
+                f"""
+                UPDATE files
+                SET folder_id = ?,
+                    sort_key = ?,
+                    meta = json_set(meta, '$.folder_id', ?, '$.updated_at', ?)
+                WHERE file_id IN ({placeholders})
+                """,
+                (folder_id, time.time(), folder_id, updated_at, *file_ids),
+            )
+            rows = self._conn.execute(
+                f"SELECT file_id, meta, size_bytes FROM files WHERE file_id IN ({placeholders})",
+                file_ids,
+            ).fetchall()
+        by_id = {row["file_id"]: self._row_to_record(row) for row in rows}
+        moved = [by_id[file_id] for file_id in file_ids if file_id in by_id]
+        catalog_changes.emit("put", moved)
+        return moved
+
+    def remove(self, file_ids: Iterable[str]) -> list[dict]:
+        file_ids = list(file_ids)
+        if not file_ids:
+            return []
+        placeholders = self._placeholders(len(file_ids))
+        with self._transaction():
+            rows = self._conn.execute(f"SELECT meta, size_bytes FROM files WHERE file_id IN ({placeholders})", file_ids).fetchall()
+            self._conn.execute(f"DELETE FROM files WHERE file_id IN ({placeholders})", file_ids)
+        removed = [self._row_to_record(row) for row in rows]
+        self._drop_legacy_sidecars([record["file_id"] for record in removed])
+        if removed:
+            catalog_changes.emit("remove", removed)
+        return removed
+
+    def _drop_legacy_sidecars(self, file_ids: list[str]) -> None:
+        # После миграции sidecar-файлы остаются на диске; удаляем их вместе с
+        # записью, чтобы при возврате на json-бэкенд файлы не «воскресали».
+        for file_id in file_ids:
+            try:
+                (self.path.parent / f"{file_id}.json").unlink()
+            except OSError:
+                pass
+
+    # ----------------------------- папки ----------------------------- #
+
+    def folders(self) -> list[Any]:
+        with self._lock:
+            rows = self._conn.execute(f"SELECT {', '.join(_FOLDER_COLUMNS)} FROM folders ORDER BY rowid").fetchall()
+        return [dict(row) for row in rows]
+
+    def put_folder(self, folder: dict) -> None:
+        with self._transaction():
+            self._conn.execute(
+                """
+                INSERT INTO folders (folder_id, name, parent_id, created_at, updated_at)
+                VALUES (:folder_id, :name, :parent_id, :created_at, :updated_at)
+                ON CONFLICT(folder_id) DO UPDATE SET
+                    name = excluded.name,
+                    parent_id = excluded.parent_id,
+                    updated_at = excluded.updated_at
+                """,
+                {column: folder.get(column) for column in _FOLDER_COLUMNS},
+            )
+        catalog_changes.emit("folders")
+
+    def delete_folder_tree(self, folder_id: str) -> tuple[list[str], list[dict]]:
+        with self._transaction():
+            rows = self._conn.execute(
+                """
+                WITH RECURSIVE subtree(folder_id) AS (
+                    SELECT ?
+                    UNION
+                    SELECT folders.folder_id FROM folders JOIN subtree ON folders.parent_id = subtree.folder_id
+                )
+                SELECT folder_id FROM subtree
+                """,
+                (folder_id,),
+            ).fetchall()
+            folder_ids = [row["folder_id"] for row in rows]
+            placeholders = self._placeholders(len(folder_ids))
+            file_rows = self._conn.execute(
+                f"SELECT meta, size_bytes FROM files WHERE folder_id IN ({placeholders})",
+                folder_ids,
+            ).fetchall()
+            removed = [self._row_to_record(row) for row in file_rows]
+            self._conn.execute(f"DELETE FROM files WHERE folder_id IN ({placeholders})", folder_ids)
+            self._conn.execute(f"DELETE FROM folders WHERE folder_id IN ({placeholders})", folder_ids)
+        self._drop_legacy_sidecars([record["file_id"] for record in removed])
+        if removed:
+            catalog_changes.emit("remove", removed)
+        catalog_changes.emit("folders")
+        return folder_ids, removed
+
+    # ---------------------------- миграция ---------------------------- #
+
+    def is_empty(self) -> bool:
+        with self._lock:
+            files = self._conn.execute("SELECT 1 FROM files LIMIT 1").fetchone()
+            folders = self._conn.execute("SELECT 1 FROM folders LIMIT 1").fetchone()
+        return files is None and folders is None
+
+    def import_from_sidecars(self, index: FileMetaIndex) -> tuple[int, int]:
+        """Одноразово переносит sidecar-файлы и `_folders.json` в базу. Исходники не трогаются."""
+        records = index.snapshot()
+        folders = [item for item in index.folders() if isinstance(item, dict) and item.get("folder_id")]
+        with self._transaction():
+            for record, sort_key in records:
+                self._upsert_row(record, record["size_bytes"], sort_key)
+            for folder in folders:
+                self._conn.execute(
+                    """
+                    INSERT OR REPLACE INTO folders (folder_id, name, parent_id, created_at, updated_at)
+                    VALUES (:folder_id, :name, :parent_id, :created_at, :updated_at)
+                    """,
+                    {column: folder.get(column) for column in _FOLDER_COLUMNS},
+                )
+        return len(records), len(folders)
+
+
+class _SqliteTransaction:
+    def __init__(self, conn: sqlite3.Connection, lock: RLock) -> None:
+        self._conn = conn
+        self._lock = lock
+
+    def __enter__(self) -> sqlite3.Connection:
+        self._lock.acquire()
+        self._conn.execute("BEGIN IMMEDIATE")
+        return self._conn
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        try:
+            self._conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        finally:
+            self._lock.release()
+
+
+_catalog: JsonCatalog | SqliteCatalog | None = None
+_catalog_lock = RLock()
+
+
+def configured_backend() -> str:
+    value = str(os.environ.get(CATALOG_BACKEND_ENV, "json")).strip().lower()
+    return "sqlite" if value == "sqlite" else "json"
+
+
+def get_catalog() -> JsonCatalog | SqliteCatalog:
+    """Возвращает каталог выбранного бэкенда (FILEVAULT_CATALOG_BACKEND=json|sqlite)."""
+    global _catalog
+    if _catalog is not None:
+        return _catalog
+
+    with _catalog_lock:
+        if _catalog is None:
+            if configured_backend() == "sqlite":
+                catalog = SqliteCatalog(SQLITE_CATALOG_PATH)
+                if catalog.is_empty():
+                    files_count, folders_count = catalog.import_from_sidecars(file_index)
+                    if files_count or folders_count:
+                        log("FILEVAULT", f"Sidecar-метаданные перенесены в SQLite: файлов={files_count}, папок={folders_count}")
+                _catalog = catalog
+            else:
+                _catalog = JsonCatalog(file_index)
+        return _catalog
+
+
+def _main(argv: list[str]) -> int:
+    if argv[:1] != ["migrate"]:
+        print("usage: python -m services.filevault.catalog migrate [sqlite_path]")
+        return 2
+    target = Path(argv[1]) if len(argv) > 1 else SQLITE_CATALOG_PATH
+    catalog = SqliteCatalog(target)
+    files_count, folders_count = catalog.import_from_sidecars(FileMetaIndex(FILEVAULT_ROOT))
+    print(f"migrated files={files_count} folders={folders_count} -> {target}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(_main(sys.argv[1:]))
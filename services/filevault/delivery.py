@@ -0,0 +1,215 @@
+from __future__ import annotations
+
+import os
+from datetime import datetime
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+from typing import AsyncIterator, Mapping
+from uuid import uuid4
+
+import anyio
+from fastapi import Request
+from fastapi.responses import FileResponse, Response, StreamingResponse
+
+READ_CHUNK_SIZE = 256 * 1024
+MAX_RANGES = 16
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def http_date(value: datetime | float | None) -> str | None:
+    if value is None:
+        return None
+    timestamp = value.timestamp() if isinstance(value, datetime) else float(value)
+    return formatdate(timestamp, usegmt=True)
+
+
+def _parse_http_date(value: str | None) -> float | None:
+    if not value:
+        return None
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+def parse_range_header(header: str | None, size: int) -> list[tuple[int, int]] | None:
+    """
+    Разбирает `Range: bytes=...` в список включительных диапазонов.
+    None — заголовка нет или он синтаксически неверен (отдаём файл целиком),
+    RangeNotSatisfiable — ни один диапазон не попадает в файл (416).
+    """
+    if not header:
+        return None
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or not spec.strip():
+        return None
+
+    ranges: list[tuple[int, int]] = []
+    for raw_part in spec.split(","):
+        part = raw_part.strip()
+        if not part:
+            continue
+        start_text, dash, end_text = part.partition("-")
+        if not dash:
+            return None
+        try:
+            if start_text == "":
+                suffix = int(end_text)
+                if suffix <= 0:
+                    continue
+                start, end = max(size - suffix, 0), size - 1
+            else:
+                start = int(start_text)
+                end = int(end_text) if end_text else size - 1
+                if end_text and start > end:
+                    return None
+                end = min(end, size - 1)
+        except ValueError:
+            return None
+        if start < 0:
+            return None
+        if start < size:
+            ranges.append((start, end))
+
+    if not ranges:
+        raise RangeNotSatisfiable()
+    if len(ranges) > MAX_RANGES:
+        return None
+    return _coalesce(ranges)
+
+
+def _coalesce(ranges: list[tuple[int, int]]) -> list[tuple[int, int]]:
+    # Пересекающиеся и смежные диапазоны сливаем, чтобы не читать одни байты дважды.
+    ordered = sorted(ranges)
+    merged = [ordered[0]]
+    for start, end in ordered[1:]:
+        last_start, last_end = merged[-1]
+        if start <= last_end + 1:
+            merged[-1] = (last_start, max(last_end, end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    if header.strip() == "*":
+        return True
+    candidates = [item.strip() for item in header.split(",")]
+    # If-None-Match использует слабое сравнение: W/"x" совпадает с "x".
+    return any(candidate.removeprefix("W/") == etag for candidate in candidates)
+
+
+def is_not_modified(request: Request, etag: str, last_modified: float | None) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return _etag_matches(if_none_match, etag)
+    since = _parse_http_date(request.headers.get("if-modified-since"))
+    return since is not None and last_modified is not None and int(last_modified) <= int(since)
+
+
+def _if_range_allows(request: Request, etag: str, last_modified: float | None) -> bool:
+    value = request.headers.get("if-range")
+    if value is None:
+        return True
+    value = value.strip()
+    if value.startswith('"') or value.startswith("W/"):
+        # Для If-Range допустимо только сильное сравнение.
+        return value == etag
+    since = _parse_http_date(value)
+    return since is not None and last_modified is not None and int(last_modified) == int(since)
+
+
+async def _iter_file_range(path: Path, start: int, end: int) -> AsyncIterator[bytes]:
+    remaining = end - start + 1
+    async with await anyio.open_file(path, mode="rb") as handle:
+        await handle.seek(start)
+        while remaining > 0:
+            chunk = await handle.read(min(READ_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+async def _iter_multipart(path: Path, parts: list[tuple[bytes, int, int]], closing: bytes) -> AsyncIterator[bytes]:
+    for header, start, end in parts:
+        yield header
+        async for chunk in _iter_file_range(path, start, end):
+            yield chunk
+    yield closing
+
+
+def build_blob_response(
+    request: Request,
+    path: Path,
+    *,
+    media_type: str,
+    etag: str,
+    last_modified: float | None,
+    size: int,
+    headers: Mapping[str, str] | None = None,
+) -> Response:
+    """
+    Отдаёт неизменяемый blob с поддержкой ETag/Last-Modified (304),
+    одиночных и множественных диапазонов (206, multipart/byteranges) и
+    долгоживущим Cache-Control. Файл читается с диска только в нужных границах.
+    """
+    common = {
+        "etag": etag,
+        "accept-ranges": "bytes",
+        "cache-control": IMMUTABLE_CACHE_CONTROL,
+        **(headers or {}),
+    }
+    last_modified_header = http_date(last_modified)
+    if last_modified_header:
+        common["last-modified"] = last_modified_header
+
+    if is_not_modified(request, etag, last_modified):
+        return Response(status_code=304, headers={key: value for key, value in common.items() if key != "content-disposition"})
+
+    is_head = request.method.upper() == "HEAD"
+    ranges = None
+    if _if_range_allows(request, etag, last_modified):
+        try:
+            ranges = parse_range_header(request.headers.get("range"), size)
+        except RangeNotSatisfiable:
+            return Response(status_code=416, headers={**common, "content-range": f"bytes */{size}"})
+
+    if not ranges:
+        stat_result = os.stat(path)
+        return FileResponse(path, media_type=media_type, headers=common, stat_result=stat_result, method=request.method)
+
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        range_headers = {
+            **common,
+            "content-range": f"bytes {start}-{end}/{size}",
+            "content-length": str(end - start + 1),
+        }
+        if is_head:
+            return Response(status_code=206, headers=range_headers, media_type=media_type)
+        return StreamingResponse(_iter_file_range(path, start, end), status_code=206, media_type=media_type, headers=range_headers)
+
+    boundary = uuid4().hex
+    parts: list[tuple[bytes, int, int]] = []
+    content_length = 0
+    for start, end in ranges:
+        part_header = (
+            f"\r\n--{boundary}\r\n"
+            f"Content-Type: {media_type}\r\n"
+            f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n"
+        ).encode("latin-1")
+        parts.append((part_header, start, end))
+        content_length += len(part_header) + end - start + 1
+    closing = f"\r\n--{boundary}--\r\n".encode("latin-1")
+    content_length += len(closing)
+
+    multipart_headers = {**common, "content-length": str(content_length)}
+    multipart_type = f"multipart/byteranges; boundary={boundary}"
+    if is_head:
+        return Response(status_code=206, headers=multipart_headers, media_type=multipart_type)
+    return StreamingResponse(_iter_multipart(path, parts, closing), status_code=206, media_type=multipart_type, headers=multipart_headers)
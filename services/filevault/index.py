@@ -0,0 +1,352 @@
+from __future__ import annotations
+
+import json
+import os
+import re
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+from threading import RLock
+from typing import Any, Callable, Iterator
+
+from utils.logger import log
+
+from .listing import FileQuery, page_from_sorted, sort_value
+from .paths import FILEVAULT_ROOT, blob_path_for
+
+FOLDERS_META_NAME = "_folders.json"
+FILE_ID_RE = re.compile(r"^[a-f0-9]{32}$")
+
+
+def _recheck_interval() -> float:
+    try:
+        return max(0.0, float(os.environ.get("FILEVAULT_INDEX_RECHECK_SECONDS", "2")))
+    except ValueError:
+        return 2.0
+
+
+class FileMetaIndex:
+    """
+    Процессный индекс метаданных FileVault.
+
+    Строится один раз из sidecar-файлов `<file_id>.json`, дальше обновляется
+    точечно при загрузке/изменении/удалении. Внешние изменения каталога
+    (файлы, записанные мимо индекса) ловятся по mtime директории, который
+    проверяется не чаще одного раза в FILEVAULT_INDEX_RECHECK_SECONDS.
+
+    О пересборке с диска ("reset") и о внешней правке `_folders.json`
+    ("folders") индекс сообщает подписчикам — уже после снятия блокировки.
+    """
+
+    def __init__(self, root: Path) -> None:
+        self.root = root
+        self.folders_path = root / FOLDERS_META_NAME
+        self._lock = RLock()
+        self._records: dict[str, dict] = {}
+        self._sort_keys: dict[str, float] = {}
+        self._by_folder: dict[str | None, set[str]] = defaultdict(set)
+        self._folder_sizes: dict[str | None, int] = defaultdict(int)
+        self._total_size = 0
+        self._ordered: list[str] | None = None
+        self._sorted: dict[str, list[tuple[Any, str]]] = {}
+        self._folders: list[Any] | None = None
+        self._dir_signature: int | None = None
+        self._folders_signature: int | None = None
+        self._last_check = 0.0
+        self._built = False
+        self._ever_built = False
+        self._listeners: list[Callable[[str], None]] = []
+        self._pending: list[str] = []
+        self.recheck_seconds = _recheck_interval()
+
+    # ------------------------------------------------------------------ #
+    # Сигнатуры и пересборка
+    # ------------------------------------------------------------------ #
+
+    def _stat_signature(self, path: Path) -> int | None:
+        try:
+            return path.stat().st_mtime_ns
+        except OSError:
+            return None
+
+    def _sync_signatures(self) -> None:
+        self._dir_signature = self._stat_signature(self.root)
+        self._folders_signature = self._stat_signature(self.folders_path)
+        self._last_check = time.monotonic()
+
+    def _ensure_fresh(self) -> None:
+        if self._built and time.monotonic() - self._last_check < self.recheck_seconds:
+            return
+
+        dir_signature = self._stat_signature(self.root)
+        folders_signature = self._stat_signature(self.folders_path)
+        self._last_check = time.monotonic()
+
+        if not self._built or dir_signature != self._dir_signature:
+            self._rebuild()
+        elif folders_signature != self._folders_signature:
+            self._folders = None
+            self._folders_signature = folders_signature
+            self._queue_change("folders")
+
+    def _ensure_built(self) -> None:
+        if not self._built:
+            self._rebuild()
+
+    def _rebuild(self) -> None:
+        started = time.monotonic()
+        # Первая сборка — не изменение: производных структур до неё быть не могло.
+        if self._ever_built:
+            self._queue_change("reset")
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._records.clear()
+        self._sort_keys.clear()
+        self._by_folder.clear()
+        self._folder_sizes.clear()
+        self._total_size = 0
+        self._ordered = None
+        self._sorted.clear()
+        self._folders = None
+
+        for meta_path in self.root.glob("*.json"):
+            if meta_path.name.startswith("_"):
+                continue
+            try:
+                payload = json.loads(meta_path.read_text(encoding="utf-8"))
+                sort_key = meta_path.stat().st_mtime
+            except Exception:
+                continue
+            if not isinstance(payload, dict):
+                continue
+            file_id = payload.get("file_id")
+            if not file_id or not FILE_ID_RE.fullmatch(str(file_id)):
+                continue
+            blob_path = blob_path_for(payload, self.root)
+            try:
+                blob_size = blob_path.stat().st_size
+            except OSError:
+                continue
+            self._insert(payload, blob_size, sort_key)
+
+        self._built = True
+        self._ever_built = True
+        self._sync_signatures()
+        elapsed_ms = round((time.monotonic() - started) * 1000)
+        log("FILEVAULT", f"Индекс метаданных построен: файлов={len(self._records)}, {elapsed_ms} мс")
+
+    # ------------------------------------------------------------------ #
+    # Уведомления об изменениях с диска
+    # ------------------------------------------------------------------ #
+
+    def subscribe(self, listener: Callable[[str], None]) -> None:
+        if listener not in self._listeners:
+            self._listeners.append(listener)
+
+    def _queue_change(self, kind: str) -> None:
+        if kind not in self._pending:
+            self._pending.append(kind)
+
+    def _notify(self) -> None:
+        # Вызывается без блокировки индекса: подписчики берут свои блокировки
+        # и читают индекс, держать при этом нашу — путь к взаимной блокировке.
+        with self._lock:
+            pending, self._pending = self._pending, []
+        for kind in pending:
+            for listener in list(self._listeners):
+                try:
+                    listener(kind)
+                except Exception as error:
+                    log("FILEVAULT", f"Ошибка обработчика изменений индекса ({kind}): {error}")
+
+    @contextmanager
+    def _fresh(self) -> Iterator[None]:
+        """Блокировка индекса со сверкой с диском; о найденных изменениях сообщает после выхода."""
+        with self._lock:
+            self._ensure_fresh()
+            yield
+        if self._pending:
+            self._notify()
+
+    # ------------------------------------------------------------------ #
+    # Внутренние мутации (вызываются под блокировкой)
+    # ------------------------------------------------------------------ #
+
+    def _insert(self, meta: dict, size_bytes: int, sort_key: float) -> None:
+        record = dict(meta)
+        record["size_bytes"] = int(size_bytes)
+        file_id = record["file_id"]
+        folder_id = record.get("folder_id") or None
+
+        self._records[file_id] = record
+        self._sort_keys[file_id] = sort_key
+        self._by_folder[folder_id].add(file_id)
+        self._folder_sizes[folder_id] += record["size_bytes"]
+        self._total_size += record["size_bytes"]
+        self._ordered = None
+        self._sorted.clear()
+
+    def _discard(self, file_id: str) -> dict | None:
+        record = self._records.pop(file_id, None)
+        if record is None:
+            return None
+        self._sort_keys.pop(file_id, None)
+        folder_id = record.get("folder_id") or None
+        members = self._by_folder.get(folder_id)
+        if members is not None:
+            members.discard(file_id)
+            if not members:
+                self._by_folder.pop(folder_id, None)
+        self._folder_sizes[folder_id] -= record["size_bytes"]
+        if not self._folder_sizes[folder_id]:
+            self._folder_sizes.pop(folder_id, None)
+        self._total_size -= record["size_bytes"]
+        self._ordered = None
+        self._sorted.clear()
+        return record
+
+    # ------------------------------------------------------------------ #
+    # Публичный API
+    # ------------------------------------------------------------------ #
+
+    def refresh(self) -> None:
+        """Принудительно перечитывает sidecar-файлы с диска."""
+        with self._lock:
+            self._rebuild()
+        if self._pending:
+            self._notify()
+
+    def check(self) -> None:
+        """Сверяет индекс с диском (не чаще раза в recheck_seconds) и сообщает подписчикам об изменениях."""
+        with self._fresh():
+            pass
+
+    def invalidate(self) -> None:
+        """Помечает индекс устаревшим; пересборка произойдёт при следующем чтении."""
+        with self._lock:
+            self._built = False
+
+    def get(self, file_id: str) -> dict | None:
+        with self._fresh():
+            record = self._records.get(file_id)
+            return dict(record) if record is not None else None
+
+    def all_records(self) -> list[dict]:
+        """Все файлы, от новых к старым (как раньше сортировка по mtime sidecar)."""
+        with self._fresh():
+            if self._ordered is None:
+                self._ordered = sorted(self._records, key=lambda item: self._sort_keys[item], reverse=True)
+            return [dict(self._records[file_id]) for file_id in self._ordered]
+
+    def query(self, query: FileQuery) -> list[dict]:
+        """Страница файлов по FileQuery (не больше query.limit + 1 записей)."""
+        with self._fresh():
+            if query.folder_ids is not None:
+                members = [file_id for folder_id in query.folder_ids for file_id in self._by_folder.get(folder_id, ())]
+                if len(members) * 4 < len(self._records):
+                    # Небольшое поддерево дешевле отсортировать на месте, чем фильтровать весь порядок.
+                    keys = sorted((sort_value(self._records[file_id], query.sort), file_id) for file_id in members)
+                    return page_from_sorted(keys, self._records, query)
+            keys = self._sorted.get(query.sort)
+            if keys is None:
+                # Отсортированный порядок кэшируется по полю до следующего изменения индекса.
+                keys = sorted((sort_value(record, query.sort), file_id) for file_id, record in self._records.items())
+                self._sorted[query.sort] = keys
+            return page_from_sorted(keys, self._records, query)
+
+    def snapshot(self) -> list[tuple[dict, float]]:
+        """Пары (запись, ключ сортировки) — нужны миграции в SQLite-каталог."""
+        with self._fresh():
+            return [(dict(record), self._sort_keys[file_id]) for file_id, record in self._records.items()]
+
+    def folder_file_ids(self, folder_ids: set[str | None]) -> list[str]:
+        with self._fresh():
+            collected: list[str] = []
+            for folder_id in folder_ids:
+                collected.extend(self._by_folder.get(folder_id, ()))
+            return collected
+
+    def folder_records(self, folder_id: str | None) -> list[dict]:
+        with self._fresh():
+            members = self._by_folder.get(folder_id, set())
+            ordered = sorted(members, key=lambda item: self._sort_keys[item], reverse=True)
+            return [dict(self._records[file_id]) for file_id in ordered]
+
+    def folder_totals(self) -> dict[str | None, tuple[int, int]]:
+        """Прямое (без вложенных папок) количество файлов и размер по каждой папке."""
+        with self._fresh():
+            return {
+                folder_id: (len(members), self._folder_sizes.get(folder_id, 0))
+                for folder_id, members in self._by_folder.items()
+            }
+
+    def totals(self) -> tuple[int, int]:
+        with self._fresh():
+            return len(self._records), self._total_size
+
+    @contextmanager
+    def writing(self) -> Iterator[None]:
+        """
+        Собственная запись в каталог на диске (sidecar, `_folders.json`) под
+        блокировкой индекса; upsert/remove вызываются внутри.
+
+        Сигнатуры после записи переснимаются, только если до неё совпадали с
+        запомненными. Иначе рядом успел побывать внешний писатель, и его
+        правку нельзя принять за свою: индекс пересоберётся при ближайшем
+        чтении и сообщит подписчикам "reset".
+        """
+        with self._lock:
+            self._ensure_built()
+            dir_unchanged = self._stat_signature(self.root) == self._dir_signature
+            folders_unchanged = self._stat_signature(self.folders_path) == self._folders_signature
+            yield
+            if dir_unchanged:
+                self._dir_signature = self._stat_signature(self.root)
+            else:
+                self._built = False
+            if folders_unchanged:
+                self._folders_signature = self._stat_signature(self.folders_path)
+        if self._pending:
+            self._notify()
+
+    def upsert(self, meta: dict, size_bytes: int | None = None, keep_order: bool = False) -> dict:
+        """
+        Регистрирует записанный на диск sidecar (внутри writing()); сохраняет
+        размер blob-а в индексе. keep_order оставляет файл на прежнем месте
+        в списке (служебные дописывания мета).
+        """
+        with self._lock:
+            previous_sort_key = self._sort_keys.get(meta["file_id"])
+            previous = self._discard(meta["file_id"])
+            if size_bytes is None:
+                size_bytes = previous["size_bytes"] if previous else int(meta.get("size_bytes", 0) or 0)
+            sort_key = previous_sort_key if keep_order and previous_sort_key is not None else time.time()
+            self._insert(meta, size_bytes, sort_key)
+            return dict(self._records[meta["file_id"]])
+
+    def remove(self, file_id: str) -> dict | None:
+        """Снимает запись с индекса (внутри writing(), вместе с удалением sidecar-а)."""
+        with self._lock:
+            return self._discard(file_id)
+
+    def folders(self) -> list[Any]:
+        """Сырой список папок из `_folders.json` (кэшируется до изменения файла)."""
+        with self._fresh():
+            if self._folders is None:
+                try:
+                    payload = json.loads(self.folders_path.read_text(encoding="utf-8"))
+                except Exception:
+                    payload = []
+                self._folders = payload if isinstance(payload, list) else []
+                self._folders_signature = self._stat_signature(self.folders_path)
+            return [dict(item) if isinstance(item, dict) else item for item in self._folders]
+
+    def save_folders(self, folders: list[dict]) -> None:
+        with self.writing():
+            self.folders_path.write_text(json.dumps(folders, ensure_ascii=False, indent=2), encoding="utf-8")
+            self._folders = [dict(item) for item in folders]
+            # Список целиком наш — внешняя правка, если была, им перезаписана.
+            self._folders_signature = self._stat_signature(self.folders_path)
+
+
+file_index = FileMetaIndex(FILEVAULT_ROOT)
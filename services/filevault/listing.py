@@ -0,0 +1,149 @@
+from __future__ import annotations
+
+import base64
+import json
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Iterable
+
+SORT_FIELDS = ("uploaded_at", "name", "size")
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+class ListingQueryError(ValueError):
+    """Неверные параметры листинга (сортировка, курсор, фильтры) — ответ 400."""
+
+
+@dataclass(slots=True)
+class FileQuery:
+    """
+    Параметры выборки файлов: сортировка, курсор и фильтры.
+
+    folder_ids=None — все папки; иначе множество id (None в нём — корень).
+    content_types — точные типы или префиксы вида `image/`.
+    uploaded_from/uploaded_to — границы по uploaded_at в UTC ISO-форме (включительно).
+    limit=None — без пагинации (старое поведение «всё сразу»).
+    """
+
+    sort: str = "uploaded_at"
+    descending: bool = True
+    limit: int | None = None
+    after: tuple[Any, str] | None = None
+    folder_ids: set[str | None] | None = None
+    content_types: tuple[str, ...] = ()
+    uploaded_from: str | None = None
+    uploaded_to: str | None = None
+    exact_types: frozenset[str] = field(init=False, default=frozenset())
+    type_prefixes: tuple[str, ...] = field(init=False, default=())
+
+    def __post_init__(self) -> None:
+        if self.sort not in SORT_FIELDS:
+            raise ListingQueryError(f"Сортировка возможна только по: {', '.join(SORT_FIELDS)}")
+        self.exact_types = frozenset(item for item in self.content_types if not item.endswith("/"))
+        self.type_prefixes = tuple(item for item in self.content_types if item.endswith("/"))
+
+    @property
+    def fetch_limit(self) -> int | None:
+        # Берём на одну запись больше, чтобы узнать, есть ли следующая страница.
+        return None if self.limit is None else self.limit + 1
+
+
+def sort_value(record: dict, sort: str) -> Any:
+    if sort == "name":
+        return str(record.get("original_name") or record.get("file_id") or "").casefold()
+    if sort == "size":
+        return int(record.get("size_bytes", 0) or 0)
+    return str(record.get("uploaded_at") or "")
+
+
+def normalize_content_types(raw: str | None) -> tuple[str, ...]:
+    if not raw:
+        return ()
+    items: list[str] = []
+    for part in raw.split(","):
+        value = part.strip().lower()
+        if not value:
+            continue
+        if value.endswith("/*"):
+            value = value[:-1]
+        items.append(value)
+    return tuple(items)
+
+
+def normalize_timestamp(raw: str | None, *, end_of_day: bool = False) -> str | None:
+    """Приводит границу диапазона к UTC ISO-строке, сравнимой с uploaded_at."""
+    if not raw:
+        return None
+    text = raw.strip()
+    try:
+        value = datetime.fromisoformat(text.replace("Z", "+00:00"))
+    except ValueError:
+        raise ListingQueryError(f"Неверная дата: {raw}")
+    if len(text) == 10 and end_of_day:
+        # Голая дата в верхней границе означает «весь этот день».
+        value = value.replace(hour=23, minute=59, second=59, microsecond=999999)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc).isoformat()
+
+
+def encode_cursor(query: FileQuery, record: dict) -> str:
+    payload = [query.sort, int(query.descending), sort_value(record, query.sort), record["file_id"]]
+    raw = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(token: str, sort: str, descending: bool) -> tuple[Any, str]:
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        cursor_sort, cursor_desc, value, file_id = json.loads(raw.decode("utf-8"))
+    except Exception:
+        raise ListingQueryError("Неверный курсор")
+    if cursor_sort != sort or bool(cursor_desc) != descending:
+        raise ListingQueryError("Курсор выдан для другой сортировки")
+    if (sort == "size" and not isinstance(value, int)) or (sort != "size" and not isinstance(value, str)):
+        raise ListingQueryError("Неверный курсор")
+    return value, str(file_id)
+
+
+def matches(record: dict, query: FileQuery) -> bool:
+    if query.folder_ids is not None and (record.get("folder_id") or None) not in query.folder_ids:
+        return False
+    if query.content_types:
+        content_type = str(record.get("content_type") or "").split(";", 1)[0].strip().lower()
+        if content_type not in query.exact_types and not content_type.startswith(query.type_prefixes):
+            return False
+    if query.uploaded_from or query.uploaded_to:
+        uploaded_at = str(record.get("uploaded_at") or "")
+        if query.uploaded_from and uploaded_at < query.uploaded_from:
+            return False
+        if query.uploaded_to and uploaded_at > query.uploaded_to:
+            return False
+    return True
+
+
+def page_from_sorted(keys: list[tuple[Any, str]], records: dict[str, dict], query: FileQuery) -> list[dict]:
+    """
+    Выбирает страницу из заранее отсортированного по возрастанию списка (ключ, file_id).
+    Курсор находится бинарным поиском, дальше фильтры применяются только до
+    заполнения страницы — первая страница не зависит от размера хранилища.
+    """
+    if query.descending:
+        end = bisect_left(keys, query.after) if query.after is not None else len(keys)
+        candidates: Iterable[tuple[Any, str]] = (keys[position] for position in range(end - 1, -1, -1))
+    else:
+        start = bisect_right(keys, query.after) if query.after is not None else 0
+        candidates = (keys[position] for position in range(start, len(keys)))
+
+    limit = query.fetch_limit
+    page: list[dict] = []
+    for _, file_id in candidates:
+        record = records[file_id]
+        if not matches(record, query):
+            continue
+        page.append(dict(record))
+        if limit is not None and len(page) >= limit:
+            break
+    return page
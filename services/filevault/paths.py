@@ -0,0 +1,25 @@
+from __future__ import annotations
+
+import re
+from pathlib import Path
+
+FILEVAULT_ROOT = Path("data/filevault_uploads")
+BLOBS_ROOT = FILEVAULT_ROOT / "_blobs"
+SHA256_RE = re.compile(r"^[a-f0-9]{64}$")
+
+
+def legacy_blob_path(file_id: str, root: Path = FILEVAULT_ROOT) -> Path:
+    return root / f"{file_id}.bin"
+
+
+def cas_blob_path(sha256: str, blobs_root: Path = BLOBS_ROOT) -> Path:
+    # Двухуровневый шардинг по префиксу хеша, чтобы в одной директории не копились десятки тысяч файлов.
+    return blobs_root / sha256[:2] / sha256[2:4] / sha256
+
+
+def blob_path_for(meta: dict, root: Path = FILEVAULT_ROOT) -> Path:
+    """Где лежат байты файла: общий content-addressed blob или исторический `<file_id>.bin`."""
+    sha256 = str(meta.get("sha256") or "")
+    if meta.get("storage") == "cas" and SHA256_RE.fullmatch(sha256):
+        return cas_blob_path(sha256, root / BLOBS_ROOT.name)
+    return legacy_blob_path(meta["file_id"], root)
@@ -0,0 +1,271 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import re
+import time
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, AsyncIterator, Callable
+from uuid import uuid4
+
+from utils.logger import log
+
+from .paths import FILEVAULT_ROOT
+from .uploads import sha256_file
+
+SESSIONS_DIR = FILEVAULT_ROOT / "_sessions"
+UPLOAD_ID_RE = re.compile(r"^[a-f0-9]{32}$")
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+MIN_CHUNK_SIZE = 256 * 1024
+MAX_CHUNK_SIZE = 64 * 1024 * 1024
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return max(1, int(os.environ.get(name, default)))
+    except (TypeError, ValueError):
+        return default
+
+
+MAX_RESUMABLE_FILE_SIZE_BYTES = _env_int("FILEVAULT_MAX_RESUMABLE_BYTES", 2 * 1024 * 1024 * 1024)
+SESSION_TTL_SECONDS = _env_int("FILEVAULT_UPLOAD_SESSION_TTL_SECONDS", 24 * 60 * 60)
+GC_INTERVAL_SECONDS = 10 * 60
+
+
+class UploadSessionError(Exception):
+    """Ошибка протокола возобновляемой загрузки; status_code уходит клиенту как есть."""
+
+    def __init__(self, status_code: int, detail: str) -> None:
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+@dataclass(slots=True)
+class UploadSession:
+    upload_id: str
+    filename: str
+    content_type: str
+    folder_id: str | None
+    size_bytes: int
+    chunk_size: int
+    total_parts: int
+    created_at: float
+    updated_at: float
+    received: list[int] = field(default_factory=list)
+
+    def part_length(self, part_number: int) -> int:
+        if part_number == self.total_parts - 1:
+            return self.size_bytes - self.chunk_size * part_number
+        return self.chunk_size
+
+    def to_client(self) -> dict[str, Any]:
+        received = set(self.received)
+        return {
+            "upload_id": self.upload_id,
+            "filename": self.filename,
+            "content_type": self.content_type,
+            "folder_id": self.folder_id,
+            "size_bytes": self.size_bytes,
+            "chunk_size": self.chunk_size,
+            "total_parts": self.total_parts,
+            "received_parts": sorted(received),
+            "missing_parts": [part for part in range(self.total_parts) if part not in received],
+            "complete": len(received) == self.total_parts,
+        }
+
+
+def _pwrite_all(path: Path, offset: int, data: bytes) -> None:
+    fd = os.open(path, os.O_WRONLY)
+    try:
+        view = memoryview(data)
+        while view:
+            written = os.pwrite(fd, view, offset)
+            view = view[written:]
+            offset += written
+    finally:
+        os.close(fd)
+
+
+class UploadSessionStore:
+    """
+    Хранилище сессий возобновляемой загрузки.
+
+    Каждая сессия — это `<upload_id>.json` с состоянием и заранее выделенный
+    (разреженный) `<upload_id>.part`, в который части пишутся по смещению
+    `part_number * chunk_size`. Части можно слать в любом порядке и
+    параллельно: данные идут прямо на диск, в памяти держится не больше
+    одного сетевого чанка на запрос. Запись чанка, отметка о полученной
+    части, сборка и отмена сессии сериализованы её блокировкой.
+    """
+
+    def __init__(self, root: Path) -> None:
+        self.root = root
+        self._locks: dict[str, asyncio.Lock] = {}
+        self._last_gc = 0.0
+
+    def _state_path(self, upload_id: str) -> Path:
+        return self.root / f"{upload_id}.json"
+
+    def data_path(self, upload_id: str) -> Path:
+        return self.root / f"{upload_id}.part"
+
+    def _lock_for(self, upload_id: str) -> asyncio.Lock:
+        lock = self._locks.get(upload_id)
+        if lock is None:
+            lock = self._locks[upload_id] = asyncio.Lock()
+        return lock
+
+    def _save(self, session: UploadSession) -> None:
+        self._state_path(session.upload_id).write_text(json.dumps(asdict(session), ensure_ascii=False), encoding="utf-8")
+
+    def _load(self, upload_id: str) -> UploadSession:
+        if not UPLOAD_ID_RE.fullmatch(upload_id or ""):
+            raise UploadSessionError(400, "Неверный идентификатор загрузки")
+        try:
+            payload = json.loads(self._state_path(upload_id).read_text(encoding="utf-8"))
+            return UploadSession(**payload)
+        except FileNotFoundError:
+            raise UploadSessionError(404, "Сессия загрузки не найдена или истекла")
+        except (TypeError, ValueError):
+            raise UploadSessionError(500, "Повреждено состояние сессии загрузки")
+
+    def _create_files(self, session: UploadSession) -> None:
+        self.root.mkdir(parents=True, exist_ok=True)
+        with self.data_path(session.upload_id).open("wb") as handle:
+            handle.truncate(session.size_bytes)
+        self._save(session)
+
+    def _remove_files(self, upload_id: str) -> None:
+        self.data_path(upload_id).unlink(missing_ok=True)
+        self._state_path(upload_id).unlink(missing_ok=True)
+
+    async def create(
+        self,
+        *,
+        filename: str,
+        content_type: str,
+        folder_id: str | None,
+        size_bytes: int,
+        chunk_size: int | None = None,
+    ) -> UploadSession:
+        if size_bytes <= 0:
+            raise UploadSessionError(400, "Размер файла должен быть больше нуля")
+        if size_bytes > MAX_RESUMABLE_FILE_SIZE_BYTES:
+            raise UploadSessionError(413, f"Файл '{filename}' слишком большой")
+
+        chunk_size = min(max(int(chunk_size or DEFAULT_CHUNK_SIZE), MIN_CHUNK_SIZE), MAX_CHUNK_SIZE)
+        now = time.time()
+        session = UploadSession(
+            upload_id=uuid4().hex,
+            filename=filename,
+            content_type=content_type,
+            folder_id=folder_id,
+            size_bytes=size_bytes,
+            chunk_size=chunk_size,
+            total_parts=(size_bytes + chunk_size - 1) // chunk_size,
+            created_at=now,
+            updated_at=now,
+        )
+        await asyncio.to_thread(self._create_files, session)
+        await self.collect_garbage()
+        return session
+
+    async def get(self, upload_id: str) -> UploadSession:
+        return await asyncio.to_thread(self._load, upload_id)
+
+    async def write_part(self, upload_id: str, part_number: int, stream: AsyncIterator[bytes]) -> UploadSession:
+        session = await self.get(upload_id)
+        if not 0 <= part_number < session.total_parts:
+            raise UploadSessionError(400, f"Номер части должен быть в диапазоне 0..{session.total_parts - 1}")
+
+        expected = session.part_length(part_number)
+        offset = part_number * session.chunk_size
+        written = 0
+        data_path = self.data_path(upload_id)
+
+        async for chunk in stream:
+            if not chunk:
+                continue
+            if written + len(chunk) > expected:
+                raise UploadSessionError(400, f"Часть {part_number} длиннее ожидаемых {expected} байт")
+            # Запись идёт под блокировкой сессии, как и complete/abort: иначе файл,
+            # открытый до завершения, после os.replace оказался бы уже blob-ом
+            # хранилища, и байты легли бы прямо в него. Сетевое чтение — без блокировки.
+            async with self._lock_for(upload_id):
+                try:
+                    await asyncio.to_thread(_pwrite_all, data_path, offset + written, chunk)
+                except FileNotFoundError:
+                    raise UploadSessionError(404, "Сессия загрузки уже завершена или отменена")
+            written += len(chunk)
+
+        if written != expected:
+            raise UploadSessionError(400, f"Часть {part_number}: получено {written} байт из {expected}")
+
+        async with self._lock_for(upload_id):
+            session = await self.get(upload_id)
+            if part_number not in session.received:
+                session.received.append(part_number)
+            session.updated_at = time.time()
+            await asyncio.to_thread(self._save, session)
+        return session
+
+    async def complete(self, upload_id: str, ingest: Callable[[Path, str], Any]) -> tuple[UploadSession, str]:
+        """
+        Проверяет, что все части на месте, считает SHA-256 и отдаёт собранный
+        файл в ingest(path, sha256) — тот забирает его в постоянное хранилище.
+        """
+        async with self._lock_for(upload_id):
+            session = await self.get(upload_id)
+            if len(set(session.received)) != session.total_parts:
+                missing = session.to_client()["missing_parts"]
+                raise UploadSessionError(409, f"Не получены части: {missing[:20]}")
+
+            data_path = self.data_path(upload_id)
+            sha256 = await asyncio.to_thread(sha256_file, data_path)
+            await asyncio.to_thread(ingest, data_path, sha256)
+            await asyncio.to_thread(self._remove_files, upload_id)
+        self._locks.pop(upload_id, None)
+        return session, sha256
+
+    async def abort(self, upload_id: str) -> None:
+        session = await self.get(upload_id)
+        async with self._lock_for(session.upload_id):
+            await asyncio.to_thread(self._remove_files, session.upload_id)
+        self._locks.pop(upload_id, None)
+
+    def _collect_expired(self, now: float) -> list[str]:
+        expired: list[str] = []
+        if not self.root.exists():
+            return expired
+        for state_path in self.root.glob("*.json"):
+            try:
+                payload = json.loads(state_path.read_text(encoding="utf-8"))
+                updated_at = float(payload.get("updated_at", 0))
+            except Exception:
+                updated_at = state_path.stat().st_mtime
+            if now - updated_at > SESSION_TTL_SECONDS:
+                self._remove_files(state_path.stem)
+                expired.append(state_path.stem)
+        for data_path in self.root.glob("*.part"):
+            if not self._state_path(data_path.stem).exists():
+                data_path.unlink(missing_ok=True)
+        return expired
+
+    async def collect_garbage(self, force: bool = False) -> int:
+        """Удаляет брошенные сессии старше FILEVAULT_UPLOAD_SESSION_TTL_SECONDS (не чаще раза в 10 минут)."""
+        now = time.time()
+        if not force and now - self._last_gc < GC_INTERVAL_SECONDS:
+            return 0
+        self._last_gc = now
+        expired = await asyncio.to_thread(self._collect_expired, now)
+        for upload_id in expired:
+            self._locks.pop(upload_id, None)
+        if expired:
+            log("FILEVAULT", f"Удалено брошенных сессий загрузки: {len(expired)}")
+        return len(expired)
+
+
+upload_sessions = UploadSessionStore(SESSIONS_DIR)
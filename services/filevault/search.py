@@ -0,0 +1,339 @@
+from __future__ import annotations
+
+import json
+import math
+import re
+import time
+from bisect import bisect_left, insort
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from threading import Condition, RLock
+from typing import Any
+
+from utils.logger import log
+
+from .catalog import catalog_changes, get_catalog
+from .paths import FILEVAULT_ROOT, blob_path_for
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+MAX_CONTENT_BYTES = 256 * 1024
+MAX_QUERY_TOKENS = 8
+PREFIX_MATCH_FACTOR = 0.6
+FIELD_WEIGHTS = {"name": 3.0, "path": 1.5, "content": 1.0}
+TEXT_CONTENT_TYPES = ("text/", "application/json", "application/xml", "application/x-ndjson")
+TEXT_EXTENSIONS = (".txt", ".json", ".md", ".csv", ".log", ".xml", ".yaml", ".yml", ".ndjson")
+
+
+def tokenize(text: str) -> list[str]:
+    return TOKEN_RE.findall(text.casefold())
+
+
+def is_text_record(meta: dict) -> bool:
+    content_type = str(meta.get("content_type") or "").lower()
+    name = str(meta.get("original_name") or "").lower()
+    return content_type.startswith(TEXT_CONTENT_TYPES) or name.endswith(TEXT_EXTENSIONS)
+
+
+def _read_text(meta: dict) -> str:
+    try:
+        with blob_path_for(meta, FILEVAULT_ROOT).open("rb") as handle:
+            data = handle.read(MAX_CONTENT_BYTES)
+    except OSError:
+        return ""
+    text = data.decode("utf-8", errors="ignore")
+    if len(data) < MAX_CONTENT_BYTES and "json" in str(meta.get("content_type") or "").lower():
+        # json.dumps по умолчанию экранирует не-ASCII (\\uXXXX) — индексируем уже раскодированный текст.
+        try:
+            return json.dumps(json.loads(text), ensure_ascii=False)
+        except ValueError:
+            pass
+    return text
+
+
+@dataclass(slots=True)
+class _Document:
+    folder_id: str | None
+    sha256: str
+    terms: dict[str, dict[str, int]]
+
+
+class SearchIndex:
+    """
+    Инвертированный индекс FileVault: имя файла, путь папки и текст
+    (для text/* и JSON, не больше MAX_CONTENT_BYTES с начала файла).
+
+    Строится один раз (при старте или первом запросе — запросы во время
+    сборки дожидаются её), дальше обновляется
+    по событиям каталога: загрузка/переименование/перенос — переиндексация
+    одной записи, изменение папок — только путей затронутых файлов.
+    Содержимое перечитывается лишь при смене sha256.
+    """
+
+    def __init__(self) -> None:
+        self._lock = RLock()
+        # Сигнал об окончании сборки: параллельные вызовы build() ждут её, а не ищут по пустому индексу.
+        self._build_done = Condition(self._lock)
+        self._documents: dict[str, _Document] = {}
+        self._postings: dict[str, dict[str, dict[str, int]]] = defaultdict(dict)
+        self._terms: list[str] = []
+        self._folder_paths: dict[str | None, str] = {}
+        self._built = False
+        self._building = False
+        self._pending: list[tuple[str, list[dict]]] = []
+        # При полной сборке словарь сортируется один раз в конце, а не вставкой на каждый термин.
+        self._bulk = False
+
+    # ------------------------------------------------------------------ #
+    # Построение
+    # ------------------------------------------------------------------ #
+
+    def _compute_folder_paths(self) -> dict[str | None, str]:
+        folders = {
+            item["folder_id"]: item
+            for item in get_catalog().folders()
+            if isinstance(item, dict) and item.get("folder_id")
+        }
+        paths: dict[str | None, str] = {None: ""}
+
+        def resolve(folder_id: str, guard: int = 0) -> str:
+            if folder_id in paths:
+                return paths[folder_id]
+            folder = folders.get(folder_id)
+            if folder is None or guard > 256:
+                return ""
+            parent = resolve(folder.get("parent_id"), guard + 1) if folder.get("parent_id") else ""
+            paths[folder_id] = f"{parent} / {folder.get('name', '')}".strip(" /")
+            return paths[folder_id]
+
+        for folder_id in folders:
+            resolve(folder_id)
+        return paths
+
+    def _document_terms(self, meta: dict, previous: _Document | None) -> dict[str, dict[str, int]]:
+        terms: dict[str, dict[str, int]] = {}
+        name = str(meta.get("original_name") or "")
+        terms["name"] = dict(Counter(tokenize(name)))
+        terms["path"] = dict(Counter(tokenize(self._folder_paths.get(meta.get("folder_id") or None, ""))))
+        sha256 = str(meta.get("sha256") or "")
+        if previous is not None and sha256 and previous.sha256 == sha256:
+            terms["content"] = previous.terms.get("content", {})
+        elif is_text_record(meta):
+            terms["content"] = dict(Counter(tokenize(_read_text(meta))))
+        else:
+            terms["content"] = {}
+        return terms
+
+    def build(self) -> None:
+        """
+        Полная сборка; блокирующие чтения идут без удержания блокировки.
+        Если сборка уже идёт в другом потоке, вызов дожидается её окончания.
+        """
+        with self._lock:
+            while self._building:
+                self._build_done.wait()
+                if self._built:
+                    return
+            self._building = True
+            self._pending.clear()
+            previous_documents = dict(self._documents)
+
+        started = time.monotonic()
+        try:
+            folder_paths = self._compute_folder_paths()
+            records = get_catalog().all_records()
+            staged = SearchIndex()
+            staged._folder_paths = folder_paths
+            staged._bulk = True
+            for meta in records:
+                staged._index_document(meta, previous_documents.get(meta["file_id"]))
+            staged._terms.sort()
+        except Exception:
+            with self._lock:
+                self._building = False
+                self._build_done.notify_all()
+            raise
+
+        with self._lock:
+            self._documents = staged._documents
+            self._postings = staged._postings
+            self._terms = staged._terms
+            self._folder_paths = folder_paths
+            self._built = True
+            self._building = False
+            pending, self._pending = self._pending, []
+            for kind, changed in pending:
+                self._apply(kind, changed)
+            self._build_done.notify_all()
+
+        elapsed_ms = round((time.monotonic() - started) * 1000)
+        log("FILEVAULT", f"Поисковый индекс построен: документов={len(self._documents)}, терминов={len(self._terms)}, {elapsed_ms} мс")
+
+    def ensure_built(self) -> None:
+        get_catalog().check_external_changes()
+        if not self._built:
+            self.build()
+
+    # ------------------------------------------------------------------ #
+    # Инкрементальные изменения
+    # ------------------------------------------------------------------ #
+
+    def _add_postings(self, file_id: str, terms: dict[str, dict[str, int]]) -> None:
+        for field_name, counts in terms.items():
+            for term, count in counts.items():
+                postings = self._postings.get(term)
+                if postings is None:
+                    postings = self._postings[term] = {}
+                    if self._bulk:
+                        self._terms.append(term)
+                    else:
+                        insort(self._terms, term)
+                postings.setdefault(file_id, {})[field_name] = count
+
+    def _drop_postings(self, file_id: str, terms: dict[str, dict[str, int]]) -> None:
+        for field_name, counts in terms.items():
+            for term in counts:
+                postings = self._postings.get(term)
+                entry = postings.get(file_id) if postings is not None else None
+                if entry is None:
+                    continue
+                entry.pop(field_name, None)
+                if not entry:
+                    del postings[file_id]
+                if not postings:
+                    del self._postings[term]
+                    position = bisect_left(self._terms, term)
+                    if position < len(self._terms) and self._terms[position] == term:
+                        self._terms.pop(position)
+
+    def _index_document(self, meta: dict, previous: _Document | None = None) -> None:
+        file_id = meta["file_id"]
+        current = self._documents.pop(file_id, None)
+        if current is not None:
+            self._drop_postings(file_id, current.terms)
+        terms = self._document_terms(meta, previous or current)
+        self._documents[file_id] = _Document(
+            folder_id=meta.get("folder_id") or None,
+            sha256=str(meta.get("sha256") or ""),
+            terms=terms,
+        )
+        self._add_postings(file_id, terms)
+
+    def _remove_document(self, file_id: str) -> None:
+        current = self._documents.pop(file_id, None)
+        if current is not None:
+            self._drop_postings(file_id, current.terms)
+
+    def _reindex_paths(self) -> None:
+        folder_paths = self._compute_folder_paths()
+        changed = {
+            folder_id
+            for folder_id in set(folder_paths) | set(self._folder_paths)
+            if folder_paths.get(folder_id) != self._folder_paths.get(folder_id)
+        }
+        self._folder_paths = folder_paths
+        if not changed:
+            return
+        for file_id, document in list(self._documents.items()):
+            if document.folder_id not in changed:
+                continue
+            path_terms = dict(Counter(tokenize(folder_paths.get(document.folder_id, ""))))
+            self._drop_postings(file_id, {"path": document.terms.get("path", {})})
+            document.terms["path"] = path_terms
+            self._add_postings(file_id, {"path": path_terms})
+
+    def _apply(self, kind: str, records: list[dict]) -> None:
+        if kind == "put":
+            for meta in records:
+                self._index_document(meta)
+        elif kind == "remove":
+            for meta in records:
+                self._remove_document(meta["file_id"])
+        elif kind == "folders":
+            self._reindex_paths()
+        elif kind == "reset":
+            self._built = False
+
+    def apply_change(self, kind: str, records: list[dict]) -> None:
+        """Подписчик на catalog_changes."""
+        with self._lock:
+            if self._building:
+                self._pending.append((kind, [dict(item) for item in records]))
+            elif self._built:
+                self._apply(kind, records)
+
+    # ------------------------------------------------------------------ #
+    # Поиск
+    # ------------------------------------------------------------------ #
+
+    def _expand(self, token: str) -> list[tuple[str, float]]:
+        # Сам термин — полный вес, остальные термины с этим префиксом — с понижением.
+        matches: list[tuple[str, float]] = []
+        position = bisect_left(self._terms, token)
+        while position < len(self._terms) and self._terms[position].startswith(token):
+            term = self._terms[position]
+            matches.append((term, 1.0 if term == token else PREFIX_MATCH_FACTOR))
+            position += 1
+        return matches
+
+    def search(
+        self,
+        query: str,
+        *,
+        limit: int = 20,
+        folder_ids: set[str | None] | None = None,
+    ) -> list[dict[str, Any]]:
+        """
+        Возвращает [{file_id, score, matched}] по убыванию релевантности.
+        Каждое слово запроса должно совпасть (точно или по префиксу) хотя бы
+        в одном поле; вес поля умножается на (1 + log tf) и на idf термина.
+        """
+        tokens = list(dict.fromkeys(tokenize(query)))[:MAX_QUERY_TOKENS]
+        if not tokens:
+            return []
+        self.ensure_built()
+
+        with self._lock:
+            total = max(len(self._documents), 1)
+            scores: dict[str, float] | None = None
+            matched: dict[str, set[str]] = defaultdict(set)
+
+            for token in tokens:
+                token_scores: dict[str, float] = {}
+                for term, factor in self._expand(token):
+                    postings = self._postings.get(term, {})
+                    idf = math.log(1 + total / len(postings))
+                    for file_id, fields in postings.items():
+                        best = 0.0
+                        for field_name, count in fields.items():
+                            weight = FIELD_WEIGHTS[field_name] * (1 + math.log(count)) * idf * factor
+                            if weight > best:
+                                best = weight
+                            matched[file_id].add(field_name)
+                        if best > token_scores.get(file_id, 0.0):
+                            token_scores[file_id] = best
+                if scores is None:
+                    scores = token_scores
+                else:
+                    scores = {file_id: score + token_scores[file_id] for file_id, score in scores.items() if file_id in token_scores}
+                if not scores:
+                    return []
+
+            if folder_ids is not None:
+                scores = {
+                    file_id: score
+                    for file_id, score in scores.items()
+                    if self._documents[file_id].folder_id in folder_ids
+                }
+            ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:limit]
+            return [
+                {"file_id": file_id, "score": round(score, 4), "matched": sorted(matched[file_id])}
+                for file_id, score in ranked
+            ]
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {"documents": len(self._documents), "terms": len(self._terms)}
+
+
+search_index = SearchIndex()
+catalog_changes.subscribe(search_index.apply_change)
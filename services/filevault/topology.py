@@ -0,0 +1,252 @@
+from __future__ import annotations
+
+import re
+from datetime import datetime, timezone
+from threading import RLock
+from typing import Any, Callable
+
+from .catalog import catalog_changes, get_catalog
+
+FOLDER_ID_RE = re.compile(r"^fld_[a-f0-9]{32}$")
+ROOT_NAME = "Корень"
+ROOT_PATH_LABEL = "Корень хранилища"
+DEFAULT_FOLDER_NAME = "Папка"
+MAX_FOLDER_DEPTH = 256
+
+
+def sanitize_folder_name(name: str) -> str:
+    cleaned = re.sub(r"[\r\n\t\x00]", " ", str(name or "")).strip()
+    cleaned = re.sub(r"\s+", " ", cleaned)
+    return cleaned[:96]
+
+
+def normalize_folders(payload: list[Any]) -> list[dict]:
+    """Приводит сырой список папок из каталога к единому виду, отбрасывая мусор."""
+    now = datetime.now(timezone.utc).isoformat()
+    folders: list[dict] = []
+    for item in payload:
+        if not isinstance(item, dict):
+            continue
+        folder_id = str(item.get("folder_id", ""))
+        if not FOLDER_ID_RE.fullmatch(folder_id):
+            continue
+        parent_id = item.get("parent_id")
+        folders.append(
+            {
+                "folder_id": folder_id,
+                "name": sanitize_folder_name(item.get("name", "")) or DEFAULT_FOLDER_NAME,
+                "parent_id": parent_id if parent_id and FOLDER_ID_RE.fullmatch(str(parent_id)) else None,
+                "created_at": item.get("created_at") or now,
+                "updated_at": item.get("updated_at") or item.get("created_at") or now,
+            }
+        )
+    return folders
+
+
+class FolderTopology:
+    """
+    Неизменяемый снимок дерева папок: индекс, дети (отсортированы как в UI),
+    пути и глубины, посчитанные один раз за обход. Агрегаты по файлам
+    (количество и размер с учётом вложенных папок) считаются лениво и
+    сбрасываются отдельно — при изменении состава файлов структура не пересобирается.
+    """
+
+    def __init__(self, folders: list[dict], totals_loader: Callable[[], dict[str | None, tuple[int, int]]]) -> None:
+        self.folders = folders
+        self.index: dict[str, dict] = {folder["folder_id"]: folder for folder in folders}
+        self.children: dict[str | None, list[dict]] = {}
+        for folder in folders:
+            parent_id = folder["parent_id"] if folder["parent_id"] in self.index else None
+            self.children.setdefault(parent_id, []).append(folder)
+        for items in self.children.values():
+            items.sort(key=lambda item: (item["name"].casefold(), item["created_at"]))
+
+        self.paths: dict[str | None, tuple[str, ...]] = {None: (ROOT_PATH_LABEL,)}
+        self.labels: dict[str | None, str] = {None: ROOT_PATH_LABEL}
+        self.depth: dict[str, int] = {}
+        self.order: list[str] = []
+        self._walk(None, (ROOT_NAME,), 0)
+
+        self._descendants: dict[str, tuple[str, ...]] = {}
+        self._totals_loader = totals_loader
+        # Кэши агрегатов сбрасываются из обработчика событий каталога, который
+        # может работать под блокировкой каталога, поэтому здесь без своих блокировок:
+        # версия отсекает результат, посчитанный до сброса.
+        self._version = 0
+        self._aggregates: dict[str | None, tuple[int, int]] | None = None
+        self._tree: list[dict] | None = None
+
+    def _walk(self, parent_id: str | None, prefix: tuple[str, ...], depth: int) -> None:
+        # Итеративный обход в глубину: порядок совпадает с деревом в UI, циклы отсекаются.
+        stack = [(folder, prefix, depth) for folder in reversed(self.children.get(parent_id, []))]
+        while stack:
+            folder, chain, level = stack.pop()
+            folder_id = folder["folder_id"]
+            if folder_id in self.depth or level > MAX_FOLDER_DEPTH:
+                continue
+            path = (*chain, folder["name"])
+            self.paths[folder_id] = path
+            self.labels[folder_id] = " / ".join(path)
+            self.depth[folder_id] = level
+            self.order.append(folder_id)
+            for child in reversed(self.children.get(folder_id, [])):
+                stack.append((child, path, level + 1))
+
+    # ------------------------------------------------------------------ #
+
+    def path(self, folder_id: str | None) -> list[str]:
+        return list(self.paths.get(folder_id, (ROOT_NAME,)))
+
+    def label(self, folder_id: str | None) -> str:
+        return self.labels.get(folder_id, ROOT_NAME)
+
+    def name(self, folder_id: str | None) -> str:
+        if folder_id is None:
+            return ROOT_NAME
+        return self.index.get(folder_id, {}).get("name", DEFAULT_FOLDER_NAME)
+
+    def descendants(self, folder_id: str | None) -> tuple[str, ...]:
+        """Все вложенные папки (без самой папки) в порядке обхода дерева."""
+        if folder_id is None:
+            return tuple(self.order)
+        cached = self._descendants.get(folder_id)
+        if cached is None:
+            collected: list[str] = []
+            stack = [child["folder_id"] for child in reversed(self.children.get(folder_id, []))]
+            seen = {folder_id}
+            while stack:
+                current = stack.pop()
+                if current in seen:
+                    continue
+                seen.add(current)
+                collected.append(current)
+                stack.extend(child["folder_id"] for child in reversed(self.children.get(current, [])))
+            cached = self._descendants[folder_id] = tuple(collected)
+        return cached
+
+    def subtree(self, folder_id: str | None) -> set[str | None]:
+        return {folder_id, *self.descendants(folder_id)}
+
+    # ------------------------------------------------------------------ #
+
+    def reset_aggregates(self) -> None:
+        self._version += 1
+        self._aggregates = None
+        self._tree = None
+
+    def aggregates(self) -> dict[str | None, tuple[int, int]]:
+        """(количество, размер) файлов каждой папки вместе с вложенными; None — всё хранилище."""
+        cached = self._aggregates
+        if cached is not None:
+            return cached
+        version = self._version
+        direct = self._totals_loader()
+        aggregates: dict[str | None, tuple[int, int]] = {}
+        # Обратный порядок обхода: дети всегда посчитаны раньше родителя.
+        for folder_id in reversed(self.order):
+            count, size = direct.get(folder_id, (0, 0))
+            for child in self.children.get(folder_id, []):
+                child_count, child_size = aggregates.get(child["folder_id"], (0, 0))
+                count += child_count
+                size += child_size
+            aggregates[folder_id] = (count, size)
+        root_count, root_size = direct.get(None, (0, 0))
+        for child in self.children.get(None, []):
+            child_count, child_size = aggregates.get(child["folder_id"], (0, 0))
+            root_count += child_count
+            root_size += child_size
+        aggregates[None] = (root_count, root_size)
+        if version == self._version:
+            self._aggregates = aggregates
+        return aggregates
+
+    def node(self, folder_id: str) -> dict:
+        folder = self.index[folder_id]
+        count, size = self.aggregates().get(folder_id, (0, 0))
+        return {
+            "folder_id": folder_id,
+            "name": folder["name"],
+            "parent_id": folder.get("parent_id"),
+            "level": self.depth.get(folder_id, 0),
+            "path": self.label(folder_id),
+            "file_count": count,
+            "size_bytes": size,
+            "has_children": bool(self.children.get(folder_id)),
+            "created_at": folder.get("created_at"),
+            "updated_at": folder.get("updated_at"),
+        }
+
+    def root_node(self) -> dict:
+        count, size = self.aggregates().get(None, (0, 0))
+        return {
+            "folder_id": None,
+            "name": ROOT_NAME,
+            "parent_id": None,
+            "level": 0,
+            "path": ROOT_PATH_LABEL,
+            "file_count": count,
+            "size_bytes": size,
+            "has_children": bool(self.children.get(None)),
+            "created_at": None,
+            "updated_at": None,
+        }
+
+    def tree(self) -> list[dict]:
+        """Вложенное дерево для UI; кэшируется до изменения папок или файлов."""
+        cached = self._tree
+        if cached is not None:
+            return cached
+        version = self._version
+        nodes = {folder_id: {**self.node(folder_id), "children": []} for folder_id in self.order}
+        roots: list[dict] = []
+        for folder_id in self.order:
+            parent_id = self.index[folder_id]["parent_id"]
+            siblings = nodes[parent_id]["children"] if parent_id in nodes else roots
+            siblings.append(nodes[folder_id])
+        if version == self._version:
+            self._tree = roots
+        return roots
+
+
+class FolderTopologyCache:
+    """
+    Держит текущий FolderTopology: структура пересобирается при изменении
+    папок, агрегаты — при изменении состава файлов. Сборка идёт вне
+    блокировки, а поколение не даёт сохранить снимок, устаревший во время сборки.
+    """
+
+    def __init__(self) -> None:
+        self._lock = RLock()
+        self._current: FolderTopology | None = None
+        self._generation = 0
+
+    def get(self) -> FolderTopology:
+        # Внешняя правка каталога приходит сюда событием "reset"/"folders" прямо из проверки.
+        get_catalog().check_external_changes()
+        current = self._current
+        if current is not None:
+            return current
+        generation = self._generation
+        catalog = get_catalog()
+        topology = FolderTopology(normalize_folders(catalog.folders()), catalog.folder_totals)
+        with self._lock:
+            if self._generation == generation and self._current is None:
+                self._current = topology
+        return topology
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self._current = None
+
+    def apply_change(self, kind: str, records: list[dict]) -> None:
+        if kind in {"folders", "reset"}:
+            self.invalidate()
+            return
+        current = self._current
+        if current is not None:
+            current.reset_aggregates()
+
+
+folder_topology = FolderTopologyCache()
+catalog_changes.subscribe(folder_topology.apply_change)
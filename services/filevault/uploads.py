@@ -0,0 +1,82 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import os
+from pathlib import Path
+from typing import Any, BinaryIO
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+class UploadTooLargeError(Exception):
+    """Поток превысил допустимый размер; временный файл уже удалён."""
+
+
+def sha256_file(path: Path) -> str:
+    hasher = hashlib.sha256()
+    with path.open("rb") as handle:
+        while True:
+            chunk = handle.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def _write_chunk(handle: BinaryIO, hasher: Any, chunk: bytes) -> None:
+    hasher.update(chunk)
+    handle.write(chunk)
+
+
+def _close_durably(handle: BinaryIO) -> None:
+    handle.flush()
+    os.fsync(handle.fileno())
+    handle.close()
+
+
+def _discard(handle: BinaryIO, path: Path) -> None:
+    try:
+        handle.close()
+    finally:
+        path.unlink(missing_ok=True)
+
+
+async def stream_to_temp(
+    source: Any,
+    temp_path: Path,
+    max_bytes: int,
+    chunk_size: int = UPLOAD_CHUNK_SIZE,
+) -> tuple[Path | None, int, str]:
+    """
+    Потоково копирует загрузку (`UploadFile` или любой объект с async `read(n)`)
+    во временный файл temp_path (из `BlobStore.temp_path`) кусками по chunk_size
+    и считает SHA-256 на лету. Итоговое имя зависит от хеша, поэтому файл
+    забирает blob-хранилище.
+
+    Возвращает (путь, размер, sha256). Пустой поток ничего не создаёт и даёт (None, 0, "").
+    Все блокирующие операции с диском выполняются вне event loop.
+    """
+    handle: BinaryIO = await asyncio.to_thread(open, temp_path, "wb")
+    hasher = hashlib.sha256()
+    size = 0
+
+    try:
+        while True:
+            chunk = await source.read(chunk_size)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > max_bytes:
+                raise UploadTooLargeError(f"upload exceeds {max_bytes} bytes")
+            await asyncio.to_thread(_write_chunk, handle, hasher, chunk)
+    except BaseException:
+        await asyncio.to_thread(_discard, handle, temp_path)
+        raise
+
+    if size == 0:
+        await asyncio.to_thread(_discard, handle, temp_path)
+        return None, 0, ""
+
+    await asyncio.to_thread(_close_durably, handle)
+    return temp_path, size, hasher.hexdigest()
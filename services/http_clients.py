@@ -0,0 +1,315 @@
+from __future__ import annotations
+
+import asyncio
+import importlib.util
+import ipaddress
+import os
+import socket
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, AsyncIterable, AsyncIterator, Iterable, Iterator
+
+import httpcore
+import httpx
+
+from utils.logger import log
+
+# HTTP/2 включается, только если установлен h2 (pip install httpx[http2]); иначе — HTTP/1.1 keep-alive.
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+DNS_CACHE_TTL_SECONDS = 300.0
+_PROXY_ENV = ("HTTP_PROXY", "HTTPS_PROXY", "ALL_PROXY")
+
+
+@dataclass(slots=True, frozen=True)
+class HttpClientProfile:
+    """Настройки пула одного потребителя: свой лимит соединений на своего upstream."""
+
+    timeout: float = 15.0
+    max_connections: int = 20
+    max_keepalive_connections: int = 10
+    keepalive_expiry: float = 60.0
+    follow_redirects: bool = False
+    retries: int = 1
+
+
+PROFILES: dict[str, HttpClientProfile] = {
+    "default": HttpClientProfile(),
+    # Telegram Bot API: много коротких запросов в один хост, держим соединения подольше.
+    "telegram": HttpClientProfile(timeout=15.0, max_connections=20, max_keepalive_connections=10, keepalive_expiry=120.0),
+    "weather": HttpClientProfile(timeout=15.0, max_connections=4, max_keepalive_connections=2),
+    "internet_check": HttpClientProfile(timeout=10.0, max_connections=2, max_keepalive_connections=1, follow_redirects=True),
+    # Вызовы собственного сервера (агенты → /mytelegram).
+    "local": HttpClientProfile(timeout=15.0, max_connections=10, max_keepalive_connections=5, retries=0),
+}
+
+
+class CachingDNSBackend(httpcore.AsyncNetworkBackend):
+    """
+    Сетевой backend httpcore с кэшем DNS: новые соединения к тому же хосту
+    не ходят в getaddrinfo, пока не истёк TTL. При неудаче по всем адресам
+    запись сбрасывается, чтобы следующая попытка разрешила имя заново.
+    TLS (SNI и проверка сертификата) по-прежнему идёт по имени хоста.
+    """
+
+    def __init__(self, inner: httpcore.AsyncNetworkBackend | None = None, ttl: float = DNS_CACHE_TTL_SECONDS) -> None:
+        self._inner = inner or httpcore.AnyIOBackend()
+        self._ttl = ttl
+        self._cache: dict[tuple[str, int], tuple[float, list[str]]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def _resolve(self, host: str, port: int) -> list[str]:
+        try:
+            ipaddress.ip_address(host)
+            return [host]
+        except ValueError:
+            pass
+        key = (host, port)
+        cached = self._cache.get(key)
+        if cached is not None and cached[0] > time.monotonic():
+            self.hits += 1
+            return cached[1]
+        self.misses += 1
+        infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        addresses = list(dict.fromkeys(info[4][0] for info in infos))
+        self._cache[key] = (time.monotonic() + self._ttl, addresses)
+        return addresses
+
+    async def connect_tcp(
+        self,
+        host: str,
+        port: int,
+        timeout: float | None = None,
+        local_address: str | None = None,
+        socket_options: Iterable[Any] | None = None,
+    ) -> httpcore.AsyncNetworkStream:
+        try:
+            async with asyncio.timeout(timeout):
+                addresses = await self._resolve(host, port)
+        except TimeoutError as error:
+            raise httpcore.ConnectTimeout(f"DNS resolution timed out for {host}") from error
+        except OSError as error:
+            raise httpcore.ConnectError(str(error)) from error
+
+        last_error: Exception | None = None
+        for address in addresses:
+            try:
+                return await self._inner.connect_tcp(
+                    address, port, timeout=timeout, local_address=local_address, socket_options=socket_options
+                )
+            except (httpcore.ConnectError, httpcore.ConnectTimeout) as error:
+                last_error = error
+        self._cache.pop((host, port), None)
+        raise last_error or httpcore.ConnectError(f"No addresses for {host}")
+
+    async def connect_unix_socket(
+        self,
+        path: str,
+        timeout: float | None = None,
+        socket_options: Iterable[Any] | None = None,
+    ) -> httpcore.AsyncNetworkStream:
+        return await self._inner.connect_unix_socket(path, timeout=timeout, socket_options=socket_options)
+
+    async def sleep(self, seconds: float) -> None:
+        await self._inner.sleep(seconds)
+
+    def stats(self) -> dict[str, int]:
+        return {"entries": len(self._cache), "hits": self.hits, "misses": self.misses}
+
+
+# Исключения httpcore → httpx; наследники раньше базовых классов, как в самом httpx.
+_HTTPCORE_ERRORS: tuple[tuple[type[Exception], type[httpx.HTTPError]], ...] = (
+    (httpcore.ConnectTimeout, httpx.ConnectTimeout),
+    (httpcore.ReadTimeout, httpx.ReadTimeout),
+    (httpcore.WriteTimeout, httpx.WriteTimeout),
+    (httpcore.PoolTimeout, httpx.PoolTimeout),
+    (httpcore.TimeoutException, httpx.TimeoutException),
+    (httpcore.ConnectError, httpx.ConnectError),
+    (httpcore.ReadError, httpx.ReadError),
+    (httpcore.WriteError, httpx.WriteError),
+    (httpcore.NetworkError, httpx.NetworkError),
+    (httpcore.ProxyError, httpx.ProxyError),
+    (httpcore.UnsupportedProtocol, httpx.UnsupportedProtocol),
+    (httpcore.LocalProtocolError, httpx.LocalProtocolError),
+    (httpcore.RemoteProtocolError, httpx.RemoteProtocolError),
+    (httpcore.ProtocolError, httpx.ProtocolError),
+)
+
+
+@contextmanager
+def _httpx_errors() -> Iterator[None]:
+    try:
+        yield
+    except Exception as error:
+        for core_type, httpx_type in _HTTPCORE_ERRORS:
+            if isinstance(error, core_type):
+                raise httpx_type(str(error)) from error
+        raise
+
+
+class _PoolResponseStream(httpx.AsyncByteStream):
+    def __init__(self, stream: AsyncIterable[bytes]) -> None:
+        self._stream = stream
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        with _httpx_errors():
+            async for part in self._stream:
+                yield part
+
+    async def aclose(self) -> None:
+        if hasattr(self._stream, "aclose"):
+            with _httpx_errors():
+                await self._stream.aclose()
+
+
+class PoolTransport(httpx.AsyncBaseTransport):
+    """
+    Транспорт httpx поверх готового пула httpcore. httpx 0.27 не даёт
+    передать свой network_backend, поэтому пул с кэшем DNS собираем сами и
+    подключаем через публичный AsyncBaseTransport, не трогая внутренности
+    httpx.AsyncHTTPTransport.
+    """
+
+    def __init__(self, pool: httpcore.AsyncConnectionPool) -> None:
+        self.pool = pool
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        core_request = httpcore.Request(
+            method=request.method,
+            url=httpcore.URL(
+                scheme=request.url.raw_scheme,
+                host=request.url.raw_host,
+                port=request.url.port,
+                target=request.url.raw_path,
+            ),
+            headers=request.headers.raw,
+            content=request.stream,
+            extensions=request.extensions,
+        )
+        with _httpx_errors():
+            core_response = await self.pool.handle_async_request(core_request)
+        return httpx.Response(
+            status_code=core_response.status,
+            headers=core_response.headers,
+            stream=_PoolResponseStream(core_response.stream),
+            extensions=core_response.extensions,
+        )
+
+    async def aclose(self) -> None:
+        await self.pool.aclose()
+
+
+@dataclass(slots=True)
+class _ClientEntry:
+    client: httpx.AsyncClient
+    loop: asyncio.AbstractEventLoop
+    pool: httpcore.AsyncConnectionPool | None
+    created_at: str = field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
+    requests: int = 0
+    responses: int = 0
+
+
+def _env_proxies_configured() -> bool:
+    return any(os.environ.get(name) or os.environ.get(name.lower()) for name in _PROXY_ENV)
+
+
+class HttpClientRegistry:
+    """
+    Общие на всё приложение httpx.AsyncClient — по одному на профиль
+    (telegram, weather, ...). Соединения и TLS-сессии переиспользуются
+    между вызовами, DNS кэшируется, статистика пулов — в stats().
+
+    Клиент привязан к event loop: при смене цикла (тесты, перезапуск)
+    создаётся новый, а старый просто отпускается.
+    """
+
+    def __init__(self) -> None:
+        self._clients: dict[str, _ClientEntry] = {}
+        self._dns = CachingDNSBackend()
+        self._started = False
+
+    def start(self) -> None:
+        self._started = True
+        log("HTTP", f"Общие HTTP-клиенты готовы (HTTP/2: {'да' if HTTP2_AVAILABLE else 'нет, не установлен h2'})")
+
+    async def stop(self) -> None:
+        self._started = False
+        entries, self._clients = list(self._clients.values()), {}
+        loop = asyncio.get_running_loop()
+        for entry in entries:
+            if entry.loop is loop:
+                await entry.client.aclose()
+
+    def get(self, name: str = "default") -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        entry = self._clients.get(name)
+        if entry is None or entry.loop is not loop or entry.client.is_closed:
+            entry = self._clients[name] = self._create(name, loop)
+        return entry.client
+
+    def _create(self, name: str, loop: asyncio.AbstractEventLoop) -> _ClientEntry:
+        profile = PROFILES.get(name, PROFILES["default"])
+        limits = httpx.Limits(
+            max_connections=profile.max_connections,
+            max_keepalive_connections=profile.max_keepalive_connections,
+            keepalive_expiry=profile.keepalive_expiry,
+        )
+        transport = None
+        pool = None
+        # С прокси из окружения оставляем httpx собственный транспорт: он сам монтирует прокси.
+        if not _env_proxies_configured():
+            pool = httpcore.AsyncConnectionPool(
+                ssl_context=httpx.create_ssl_context(http2=HTTP2_AVAILABLE),
+                max_connections=limits.max_connections,
+                max_keepalive_connections=limits.max_keepalive_connections,
+                keepalive_expiry=limits.keepalive_expiry,
+                http1=True,
+                http2=HTTP2_AVAILABLE,
+                retries=profile.retries,
+                network_backend=self._dns,
+            )
+            transport = PoolTransport(pool)
+
+        entry: _ClientEntry
+
+        async def on_request(request: httpx.Request) -> None:
+            entry.requests += 1
+
+        async def on_response(response: httpx.Response) -> None:
+            entry.responses += 1
+
+        client = httpx.AsyncClient(
+            timeout=httpx.Timeout(profile.timeout),
+            limits=limits,
+            http2=HTTP2_AVAILABLE,
+            transport=transport,
+            follow_redirects=profile.follow_redirects,
+            event_hooks={"request": [on_request], "response": [on_response]},
+        )
+        entry = _ClientEntry(client=client, loop=loop, pool=pool)
+        return entry
+
+    def stats(self) -> dict[str, Any]:
+        clients: dict[str, Any] = {}
+        for name, entry in self._clients.items():
+            connections = list(entry.pool.connections) if entry.pool is not None else []
+            clients[name] = {
+                "requests": entry.requests,
+                "responses": entry.responses,
+                "connections": len(connections),
+                "idle": sum(1 for connection in connections if connection.is_idle()),
+                "http2": sum(1 for connection in connections if "HTTP/2" in connection.info()),
+                "closed": entry.client.is_closed,
+                "created_at": entry.created_at,
+            }
+        return {
+            "started": self._started,
+            "http2_available": HTTP2_AVAILABLE,
+            "dns_cache": self._dns.stats(),
+            "clients": clients,
+        }
+
+
+http_clients = HttpClientRegistry()
@@ -8,6 +8,7 @@ from typing import Any
 import httpx
 
 from config.config_manager import load_advanced_config
+from services.http_clients import http_clients
 from services.stats_manager import init_stat, reset_stats, update_stat
 from utils.logger import log
 
@@ -31,9 +32,9 @@ async def request_runtime_reload() -> None:
 async def check_internet_connection(timeout_seconds: int = 10) -> bool:
     """Проверяет базовое подключение к интернету, обращаясь к google.com."""
     try:
-        async with httpx.AsyncClient(timeout=float(timeout_seconds)) as client:
-            response = await client.get("https://www.google.com")
-            response.raise_for_status()
+        client = http_clients.get("internet_check")
+        response = await client.get("https://www.google.com", timeout=float(timeout_seconds))
+        response.raise_for_status()
         log("KEEP_ALIVE", "Проверка подключения к интернету пройдена успешно.")
         return True
     except httpx.RequestError as error:
@@ -0,0 +1,225 @@
+from __future__ import annotations
+
+import re
+from typing import Iterator
+
+# Токены разметки: ("text", s), ("atom", s) — неделимый кусок (HTML-сущность,
+# экранированный символ, ссылка), ("open", s, closer), ("close", s) и
+# ("toggle", s) — маркер MarkdownV2, который открывает или закрывает сущность.
+Token = tuple[str, ...]
+
+# Имя тега захватывается тем же выражением, чтобы не разбирать каждый тег повторно.
+_HTML_TOKEN_RE = re.compile(r"<(?P<slash>/?)\s*(?P<name>[\w-]+)[^<>]*>|<[^<>]*>|&#?\w+;")
+_MD_LINK_RE = re.compile(r"\[(?:\\.|[^\]\\])*\]\((?:\\.|[^)\\])*\)", re.DOTALL)
+_MD_TOGGLES = ("||", "__", "*", "_", "~")
+
+# Границы разреза в порядке предпочтения: абзац, строка, слово.
+_BOUNDARIES = ("\n\n", "\n", " ")
+
+
+def _html_tokens(text: str) -> Iterator[Token]:
+    position = 0
+    for match in _HTML_TOKEN_RE.finditer(text):
+        if match.start() > position:
+            yield ("text", text[position:match.start()])
+        token = match.group()
+        name = match.group("name")
+        if name is None or token.endswith("/>"):
+            yield ("atom", token)
+        elif match.group("slash"):
+            yield ("close", token)
+        else:
+            yield ("open", token, f"</{name}>")
+        position = match.end()
+    if position < len(text):
+        yield ("text", text[position:])
+
+
+def _markdown_tokens(text: str) -> Iterator[Token]:
+    """
+    Разбор MarkdownV2 за один проход. Внутри `code` и ```pre``` разметка
+    не действует — там значимы только экранирование и закрывающий маркер.
+    """
+    buffer: list[str] = []
+    in_pre = False
+    in_code = False
+    index = 0
+    length = len(text)
+
+    def flush() -> Iterator[Token]:
+        if buffer:
+            yield ("text", "".join(buffer))
+            buffer.clear()
+
+    while index < length:
+        char = text[index]
+        if char == "\\" and index + 1 < length:
+            yield from flush()
+            yield ("atom", text[index:index + 2])
+            index += 2
+            continue
+        if text.startswith("```", index) and not in_code:
+            yield from flush()
+            if in_pre:
+                yield ("close", "```")
+                index += 3
+            else:
+                line_end = text.find("\n", index + 3)
+                opener_end = length if line_end == -1 else line_end + 1
+                yield ("open", text[index:opener_end], "```")
+                index = opener_end
+            in_pre = not in_pre
+            continue
+        if in_pre:
+            buffer.append(char)
+            index += 1
+            continue
+        if char == "`":
+            yield from flush()
+            yield ("close", "`") if in_code else ("open", "`", "`")
+            in_code = not in_code
+            index += 1
+            continue
+        if in_code:
+            buffer.append(char)
+            index += 1
+            continue
+        if char == "[":
+            link = _MD_LINK_RE.match(text, index)
+            if link is not None:
+                yield from flush()
+                yield ("atom", link.group())
+                index = link.end()
+                continue
+        marker = next((item for item in _MD_TOGGLES if text.startswith(item, index)), None)
+        if marker is not None:
+            yield from flush()
+            yield ("toggle", marker)
+            index += len(marker)
+            continue
+        buffer.append(char)
+        index += 1
+    yield from flush()
+
+
+def _cut_position(text: str, available: int) -> int:
+    """Позиция разреза не дальше available: после абзаца, строки или пробела; 0 — подходящей границы нет."""
+    window = text[:available]
+    for boundary in _BOUNDARIES:
+        position = window.rfind(boundary)
+        if position > 0:
+            return position + len(boundary)
+    return 0
+
+
+class _Chunker:
+    def __init__(self, limit: int) -> None:
+        self.limit = limit
+        self.parts: list[str] = []
+        self.current: list[str] = []
+        self.size = 0
+        self.content = 0
+        self.stack: list[tuple[str, str]] = []
+        self.reserved = 0  # длина закрывающих маркеров открытых сущностей
+
+    def _available(self) -> int:
+        return self.limit - self.size - self.reserved
+
+    def _push(self, value: str, *, content: bool) -> None:
+        self.current.append(value)
+        self.size += len(value)
+        # Часть из одних пробелов Telegram не примет — такие куски содержимым не считаем.
+        if content and not value.isspace():
+            self.content += len(value)
+
+    def flush(self) -> None:
+        """Закрывает открытые сущности в текущей части и открывает их заново в следующей."""
+        if not self.content:
+            # Без видимого текста часть не отправить: набежавшие пробелы и пустые
+            # теги отбрасываем, оставляя только открытые сущности, — иначе они
+            # переносились бы дальше и раздували часть сверх лимита.
+            self.current = [opener for opener, _ in self.stack]
+            self.size = sum(len(opener) for opener in self.current)
+            return
+        self.current.extend(closer for _, closer in reversed(self.stack))
+        self.parts.append("".join(self.current))
+        self.current = [opener for opener, _ in self.stack]
+        self.size = sum(len(opener) for opener in self.current)
+        self.content = 0
+
+    def add_text(self, text: str) -> None:
+        while text:
+            available = self._available()
+            if len(text) <= available:
+                self._push(text, content=True)
+                return
+            position = _cut_position(text, available)
+            if position == 0 and self.content:
+                self.flush()
+                continue
+            if available < 1 and self.size > sum(len(opener) for opener, _ in self.stack):
+                # Места нет, а видимого текста в части ещё нет: сбрасываем пробелы и пустые теги.
+                self.flush()
+                continue
+            # Без подходящей границы (или если в части ещё пусто) режем по лимиту.
+            position = position or max(available, 1)
+            self._push(text[:position], content=True)
+            text = text[position:]
+            self.flush()
+
+    def add_atom(self, value: str, *, content: bool = True, closer: str = "") -> None:
+        if len(value) + len(closer) > self._available():
+            self.flush()
+        self._push(value, content=content)
+
+    def open(self, opener: str, closer: str) -> None:
+        self.add_atom(opener, content=False, closer=closer)
+        self.stack.append((opener, closer))
+        self.reserved += len(closer)
+
+    def close(self, closer: str) -> None:
+        for position in range(len(self.stack) - 1, -1, -1):
+            if self.stack[position][1].lower() == closer.lower():
+                self.reserved -= len(self.stack.pop(position)[1])
+                break
+        self._push(closer, content=False)
+
+    def finish(self) -> list[str]:
+        if self.content:
+            self.parts.append("".join(self.current))
+        return self.parts
+
+
+def split_message(text: str, parse_mode: str, limit: int) -> list[str]:
+    """
+    Делит текст на части не длиннее limit. Режет по абзацам, строкам и
+    словам; теги HTML и сущности MarkdownV2 не разрываются: открытые на
+    границе закрываются в конце части и открываются заново в следующей.
+    Текст разбирается один раз, каким бы длинным он ни был.
+    """
+    if len(text) <= limit:
+        return [text]
+
+    if parse_mode == "HTML":
+        tokens: Iterator[Token] = _html_tokens(text)
+    elif parse_mode == "MarkdownV2":
+        tokens = _markdown_tokens(text)
+    else:
+        tokens = iter((("text", text),))
+
+    chunker = _Chunker(limit)
+    for token in tokens:
+        kind = token[0]
+        if kind == "text":
+            chunker.add_text(token[1])
+        elif kind == "atom":
+            chunker.add_atom(token[1])
+        elif kind == "open":
+            chunker.open(token[1], token[2])
+        elif kind == "close":
+            chunker.close(token[1])
+        elif any(closer == token[1] for _, closer in chunker.stack):
+            chunker.close(token[1])
+        else:
+            chunker.open(token[1], token[1])
+    return chunker.finish()
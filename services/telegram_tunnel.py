@@ -2,27 +2,77 @@ from __future__ import annotations
 
 import asyncio
 import base64
+import hashlib
+import heapq
 import hmac
 import json
 import logging
 import os
-from dataclasses import dataclass
-from typing import Any, Literal
+import random
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Literal
+from uuid import uuid4
 
 import httpx
 from fastapi import HTTPException, Request, status
 
+from services.http_clients import http_clients
+from services.telegram_split import split_message
 from utils.logger import log
 
 TELEGRAM_API_BASE = "https://api.telegram.org"
 DEFAULT_TIMEOUT_SECONDS = 15.0
 MAX_SAFE_MESSAGE_LENGTH = 3900
+# Длинный текст делится на части по MAX_SAFE_MESSAGE_LENGTH; больше частей — 413.
+MAX_MESSAGE_PARTS = 20
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return max(0.01, float(os.environ.get(name, default)))
+    except (TypeError, ValueError):
+        return default
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return max(1, int(os.environ.get(name, default)))
+    except (TypeError, ValueError):
+        return default
+
+
+# Лимиты Bot API: около 1 сообщения в секунду в один чат (короткие всплески
+# допустимы) и около 30 в секунду на бота в целом.
+SEND_PER_CHAT_RATE = _env_float("TELEGRAM_SEND_PER_CHAT_RATE", 1.0)
+SEND_PER_CHAT_BURST = _env_int("TELEGRAM_SEND_PER_CHAT_BURST", 3)
+SEND_GLOBAL_RATE = _env_float("TELEGRAM_SEND_GLOBAL_RATE", 25.0)
+SEND_MAX_ATTEMPTS = _env_int("TELEGRAM_SEND_MAX_ATTEMPTS", 5)
+SEND_BACKOFF_BASE_SECONDS = 0.5
+SEND_BACKOFF_MAX_SECONDS = 30.0
+SEND_RECEIPTS_LIMIT = 1000
+# Правки одного сообщения (kind=replace) уходят не чаще раза в этот интервал.
+EDIT_MIN_INTERVAL_SECONDS = _env_float("TELEGRAM_EDIT_MIN_INTERVAL_SECONDS", 1.0)
+EDIT_SLOTS_LIMIT = 1000
+
+# Журнал отложенных удалений kind=temporary: переживает перезапуск сервиса.
+TELEGRAM_DATA_DIR = Path("data/telegram")
+DELETIONS_JOURNAL = TELEGRAM_DATA_DIR / "deletions.ndjson"
+DELETE_BATCH_SIZE = 100  # предел deleteMessages
+DELETE_RETRY_SECONDS = 60.0
+# Удаления, наступающие в пределах этого окна, уходят одной пачкой (чуть раньше срока).
+DELETE_BATCH_WINDOW_SECONDS = 0.5
+# Старше 48 часов Telegram сообщения бота в общем случае удалить уже не даёт.
+DELETE_GIVE_UP_SECONDS = 48 * 60 * 60
 
 ParseMode = Literal["HTML", "MarkdownV2", ""]
 MessageKind = Literal["single", "replace", "temporary"]
 
 
-@dataclass(slots=True)
+@dataclass(slots=True, frozen=True)
 class TelegramTunnelSettings:
     bot_token: str
     chat_id: str
@@ -65,7 +115,7 @@ def _float_or_default(value: Any, default: float, minimum: float | None = None,
     return result
 
 
-def load_tunnel_settings() -> TelegramTunnelSettings:
+def _read_tunnel_settings() -> TelegramTunnelSettings:
     """
     Загружает чувствительные параметры Telegram только из переменных окружения.
     Это не хранит токен и chat_id в репозитории и подходит для Render.
@@ -91,16 +141,36 @@ def load_tunnel_settings() -> TelegramTunnelSettings:
     )
 
 
+_settings_snapshot: TelegramTunnelSettings | None = None
+
+
+def load_tunnel_settings() -> TelegramTunnelSettings:
+    """Неизменяемый снимок настроек: окружение читается один раз, а не на каждый запрос."""
+    snapshot = _settings_snapshot
+    if snapshot is None:
+        snapshot = reload_tunnel_settings()
+    return snapshot
+
+
+def reload_tunnel_settings() -> TelegramTunnelSettings:
+    """Перечитывает переменные окружения — после смены токена, chat_id или секрета без перезапуска."""
+    global _settings_snapshot
+    _settings_snapshot = _read_tunnel_settings()
+    return _settings_snapshot
+
+
+# Специальные символы по правилам Telegram MarkdownV2; таблица замен строится один раз при импорте.
+# Обратная косая черта идёт первой, чтобы не экранировать уже добавленные. На 3 тыс.
+# символов кириллицы прежний посимвольный цикл занимал ~300 мкс, str.translate с
+# многосимвольными заменами ещё медленнее (~400 мкс), проход str.replace — 30–50 мкс.
+_MARKDOWN_V2_ESCAPES = tuple((char, f"\\{char}") for char in "\\_*[]()~`>#+-=|{}.!")
+
+
 def _escape_markdown_v2(text: str) -> str:
-    # Специальные символы по правилам Telegram MarkdownV2.
-    escape_chars = r"_*[]()~`>#+-=|{}.!\\"
-    result = []
-    for char in text:
-        if char in escape_chars:
-            result.append(f"\\{char}")
-        else:
-            result.append(char)
-    return "".join(result)
+    for char, escaped in _MARKDOWN_V2_ESCAPES:
+        if char in text:
+            text = text.replace(char, escaped)
+    return text
 
 
 def _normalize_format(raw_value: Any) -> tuple[ParseMode, str]:
@@ -153,6 +223,7 @@ def _normalize_payload(raw_payload: Any) -> dict[str, Any]:
     disable_web_page_preview = _boolish(raw_payload.get("disable_web_page_preview", True))
 
     message_id = raw_payload.get("message_id")
+    message_ids = raw_payload.get("message_ids")
     reply_to_message_id = raw_payload.get("reply_to_message_id")
     delete_after_seconds = _int_or_default(
         raw_payload.get("delete_after_seconds"),
@@ -160,6 +231,8 @@ def _normalize_payload(raw_payload: Any) -> dict[str, Any]:
         minimum=0,
         maximum=24 * 60 * 60,
     )
+    # wait=false — не ждать Telegram: ответ сразу с квитанцией, статус доставки по receipt_url.
+    wait = _boolish(raw_payload.get("wait", True))
 
     normalized: dict[str, Any] = {
         "text": text,
@@ -168,10 +241,22 @@ def _normalize_payload(raw_payload: Any) -> dict[str, Any]:
         "kind": kind,
         "disable_web_page_preview": disable_web_page_preview,
         "delete_after_seconds": delete_after_seconds,
+        "wait": wait,
     }
 
     if message_id not in (None, "", "null"):
         normalized["message_id"] = _int_or_default(message_id, 0, minimum=1)
+    # Сообщение из нескольких частей редактируется по списку id всех его частей.
+    if isinstance(message_ids, str):
+        message_ids = [item for item in message_ids.split(",") if item.strip()]
+    if isinstance(message_ids, list) and message_ids:
+        ids = [_int_or_default(item, 0, minimum=1) for item in message_ids]
+        if normalized.get("message_id") and normalized["message_id"] not in ids:
+            ids.insert(0, normalized["message_id"])
+        normalized["message_ids"] = ids
+        normalized.setdefault("message_id", ids[0])
+    elif normalized.get("message_id"):
+        normalized["message_ids"] = [normalized["message_id"]]
     if reply_to_message_id not in (None, "", "null"):
         normalized["reply_to_message_id"] = _int_or_default(reply_to_message_id, 0, minimum=1)
 
@@ -209,7 +294,9 @@ def _parse_query_payload(request: Request) -> dict[str, Any]:
             "disable_web_page_preview": params.get("disable_web_page_preview", "true"),
             "delete_after_seconds": params.get("delete_after_seconds", 0),
             "message_id": params.get("message_id"),
+            "message_ids": params.get("message_ids"),
             "reply_to_message_id": params.get("reply_to_message_id"),
+            "wait": params.get("wait", "true"),
         }
 
     raise HTTPException(
@@ -267,31 +354,58 @@ def _prepare_text(payload: dict[str, Any]) -> str:
     return text
 
 
-async def _telegram_api_call(method: str, payload: dict[str, Any], settings: TelegramTunnelSettings) -> dict[str, Any]:
+class TelegramApiError(HTTPException):
+    """
+    Ошибка Bot API. Для клиента туннеля это по-прежнему 502, а очередь
+    отправки по telegram_status и retry_after решает, стоит ли повторять.
+    """
+
+    def __init__(self, detail: str, *, telegram_status: int | None = None, retry_after: float | None = None) -> None:
+        super().__init__(status_code=status.HTTP_502_BAD_GATEWAY, detail=detail)
+        self.telegram_status = telegram_status
+        self.retry_after = retry_after
+
+    @property
+    def transient(self) -> bool:
+        return self.telegram_status is None or self.telegram_status == 429 or self.telegram_status >= 500
+
+    @property
+    def not_modified(self) -> bool:
+        """Правка совпала с текущим текстом сообщения — для туннеля это не ошибка."""
+        return self.telegram_status == 400 and "message is not modified" in str(self.detail).lower()
+
+
+def _require_configured(settings: TelegramTunnelSettings) -> None:
     if not settings.bot_token or not settings.chat_id:
         raise HTTPException(
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
             detail="На сервере не заданы TELEGRAM_BOT_TOKEN и/или TELEGRAM_CHAT_ID.",
         )
 
+
+async def _telegram_api_call(method: str, payload: dict[str, Any], settings: TelegramTunnelSettings) -> dict[str, Any]:
+    _require_configured(settings)
+
     url = f"{TELEGRAM_API_BASE}/bot{settings.bot_token}/{method}"
-    timeout = httpx.Timeout(settings.timeout_seconds)
-    async with httpx.AsyncClient(timeout=timeout) as client:
-        response = await client.post(url, json=payload)
+    client = http_clients.get("telegram")
+    response = await client.post(url, json=payload, timeout=httpx.Timeout(settings.timeout_seconds))
 
     try:
         data = response.json()
     except Exception as error:
-        raise HTTPException(
-            status_code=status.HTTP_502_BAD_GATEWAY,
-            detail=f"Telegram вернул не-JSON ответ: {error}",
+        raise TelegramApiError(
+            f"Telegram вернул не-JSON ответ: {error}",
+            telegram_status=response.status_code,
         ) from error
 
     if response.is_error or not data.get("ok", False):
         description = data.get("description") or response.text
-        raise HTTPException(
-            status_code=status.HTTP_502_BAD_GATEWAY,
-            detail=f"Telegram API error: {description}",
+        parameters = data.get("parameters") if isinstance(data.get("parameters"), dict) else {}
+        retry_after = parameters.get("retry_after")
+        raise TelegramApiError(
+            f"Telegram API error: {description}",
+            telegram_status=data.get("error_code") or response.status_code,
+            retry_after=float(retry_after) if isinstance(retry_after, (int, float)) else None,
         )
 
     return data
@@ -309,24 +423,658 @@ def _extract_message_id(result: Any) -> int | None:
     return None
 
 
-async def _delete_message_later(settings: TelegramTunnelSettings, message_id: int, delay_seconds: int) -> None:
-    if delay_seconds <= 0:
-        return
+class TokenBucket:
+    """Ведро токенов: rate токенов в секунду, не больше capacity про запас."""
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+
+    def block(self, seconds: float) -> None:
+        """Telegram попросил подождать (retry_after): до этого момента токенов не выдаём."""
+        now = time.monotonic()
+        self._blocked_until = max(self._blocked_until, now + seconds)
+        self._tokens = 0.0
+        self._updated = now
+
+    def blocked_for(self) -> float:
+        return max(self._blocked_until - time.monotonic(), 0.0)
+
+    async def acquire(self) -> None:
+        while True:
+            now = time.monotonic()
+            if now < self._blocked_until:
+                await asyncio.sleep(self._blocked_until - now)
+                continue
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
 
-    await asyncio.sleep(delay_seconds)
 
-    try:
-        await _telegram_api_call(
-            "deleteMessage",
-            {
-                "chat_id": settings.chat_id,
-                "message_id": message_id,
+@dataclass(slots=True)
+class _SendJob:
+    receipt_id: str
+    chat_id: str
+    method: str
+    payload: dict[str, Any]
+    settings: TelegramTunnelSettings
+    on_delivered: Callable[[dict[str, Any]], None] | None
+    future: asyncio.Future
+    receipt: dict[str, Any] = field(default_factory=dict)
+
+
+def _now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class TelegramSendQueue:
+    """
+    Очередь исходящих вызовов Bot API. У каждого чата своя FIFO-очередь и
+    свой обработчик, поэтому сообщения одного чата уходят строго по порядку;
+    скорость ограничивают ведро токенов чата и общее ведро бота.
+
+    На 429 очередь ждёт ровно retry_after из ответа Telegram и приостанавливает
+    весь чат; сетевые ошибки и 5xx повторяются с экспоненциальной задержкой
+    со случайным разбросом, ошибки запроса (400, 403) — сразу отдаются вызывающему.
+
+    Каждый вызов получает квитанцию: её можно дождаться (future) или
+    запросить позже по receipt_id. Хранятся последние SEND_RECEIPTS_LIMIT.
+    """
+
+    def __init__(self) -> None:
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._queues: dict[str, deque[_SendJob]] = {}
+        self._workers: dict[str, asyncio.Task] = {}
+        self._buckets: dict[str, TokenBucket] = {}
+        self._global_bucket = TokenBucket(SEND_GLOBAL_RATE, SEND_GLOBAL_RATE)
+        self._receipts: OrderedDict[str, dict[str, Any]] = OrderedDict()
+        self._stats = {"submitted": 0, "delivered": 0, "failed": 0, "not_modified": 0, "retries": 0, "rate_limited": 0}
+
+    def _bind_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Задачи и future прошлого цикла (тесты, перезапуск) здесь уже не выполнятся.
+            self._loop = loop
+            self._queues.clear()
+            self._workers.clear()
+
+    def prepare(
+        self,
+        settings: TelegramTunnelSettings,
+        method: str,
+        payload: dict[str, Any],
+        *,
+        on_delivered: Callable[[dict[str, Any]], None] | None = None,
+    ) -> _SendJob:
+        """Создаёт задание с квитанцией, не ставя его в очередь (его доставкой распорядится вызывающий)."""
+        self._bind_loop()
+        chat_id = str(payload.get("chat_id") or settings.chat_id)
+        receipt_id = uuid4().hex
+        job = _SendJob(
+            receipt_id=receipt_id,
+            chat_id=chat_id,
+            method=method,
+            payload=payload,
+            settings=settings,
+            on_delivered=on_delivered,
+            future=self._loop.create_future(),
+            receipt={
+                "receipt_id": receipt_id,
+                "status": "queued",
+                "method": method,
+                "chat_id": chat_id,
+                "message_id": None,
+                "attempts": 0,
+                "error": None,
+                "queued_at": _now_iso(),
+                "delivered_at": None,
             },
-            settings,
         )
-        log("TELEGRAM", f"Сообщение {message_id} удалено по таймеру.")
-    except Exception as error:
-        log("ERROR", f"Не удалось удалить временное сообщение {message_id}: {error}", level=logging.WARNING)
+        # Исключение забирает тот, кто ждёт; если никто не ждёт (wait=false), не шумим в лог.
+        job.future.add_done_callback(lambda future: future.cancelled() or future.exception())
+        self._remember(job.receipt)
+        return job
+
+    def submit(
+        self,
+        settings: TelegramTunnelSettings,
+        method: str,
+        payload: dict[str, Any],
+        *,
+        on_delivered: Callable[[dict[str, Any]], None] | None = None,
+    ) -> _SendJob:
+        job = self.prepare(settings, method, payload, on_delivered=on_delivered)
+        chat_id = job.chat_id
+        self._queues.setdefault(chat_id, deque()).append(job)
+        self._stats["submitted"] += 1
+        if chat_id not in self._workers:
+            self._workers[chat_id] = asyncio.create_task(self._run_chat(chat_id))
+        return job
+
+    def _remember(self, receipt: dict[str, Any]) -> None:
+        self._receipts[receipt["receipt_id"]] = receipt
+        while len(self._receipts) > SEND_RECEIPTS_LIMIT:
+            self._receipts.popitem(last=False)
+
+    def receipt(self, receipt_id: str) -> dict[str, Any] | None:
+        receipt = self._receipts.get(receipt_id)
+        return dict(receipt) if receipt is not None else None
+
+    def _bucket(self, chat_id: str) -> TokenBucket:
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._buckets[chat_id] = TokenBucket(SEND_PER_CHAT_RATE, SEND_PER_CHAT_BURST)
+        return bucket
+
+    async def _run_chat(self, chat_id: str) -> None:
+        queue = self._queues[chat_id]
+        try:
+            while queue:
+                job = queue[0]
+                await self._deliver(job)
+                queue.popleft()
+        finally:
+            # Очередь опустела — обработчик чата завершается, следующий submit запустит новый.
+            if self._workers.get(chat_id) is asyncio.current_task():
+                del self._workers[chat_id]
+                if not queue:
+                    self._queues.pop(chat_id, None)
+
+    async def _deliver(self, job: _SendJob) -> None:
+        bucket = self._bucket(job.chat_id)
+        receipt = job.receipt
+        while True:
+            await bucket.acquire()
+            await self._global_bucket.acquire()
+            receipt["attempts"] += 1
+            receipt["status"] = "sending"
+            try:
+                result = await _telegram_api_call(job.method, job.payload, job.settings)
+            except (TelegramApiError, httpx.TransportError) as error:
+                if isinstance(error, httpx.TransportError):
+                    error = TelegramApiError(f"Telegram недоступен: {error}")
+                if error.transient and receipt["attempts"] < SEND_MAX_ATTEMPTS:
+                    if error.retry_after is not None:
+                        delay = error.retry_after
+                        bucket.block(delay)
+                        self._stats["rate_limited"] += 1
+                    else:
+                        ceiling = min(SEND_BACKOFF_MAX_SECONDS, SEND_BACKOFF_BASE_SECONDS * 2 ** receipt["attempts"])
+                        delay = random.uniform(ceiling / 2, ceiling)
+                        bucket.block(delay)
+                    self._stats["retries"] += 1
+                    receipt["status"] = "retrying"
+                    receipt["error"] = error.detail
+                    log("TELEGRAM", f"{job.method} в чат {job.chat_id}: {error.detail}; повтор через {delay:.1f} с", level=logging.WARNING)
+                    continue
+                self._fail(job, error)
+                return
+            except Exception as error:
+                self._fail(job, error)
+                return
+
+            self._stats["delivered"] += 1
+            receipt["status"] = "delivered"
+            receipt["error"] = None
+            receipt["message_id"] = _extract_message_id(result) or job.payload.get("message_id")
+            receipt["delivered_at"] = _now_iso()
+            if job.on_delivered is not None:
+                try:
+                    job.on_delivered(result)
+                except Exception as error:
+                    log("ERROR", f"Ошибка обработки доставленного сообщения {receipt['message_id']}: {error}", level=logging.WARNING)
+            if not job.future.done():
+                job.future.set_result(result)
+            return
+
+    def _fail(self, job: _SendJob, error: Exception) -> None:
+        job.receipt["status"] = "failed"
+        job.receipt["error"] = getattr(error, "detail", None) or str(error)
+        # "message is not modified" — текст уже такой, как просили: это не сбой доставки.
+        if getattr(error, "not_modified", False):
+            self._stats["not_modified"] += 1
+        else:
+            self._stats["failed"] += 1
+            log("ERROR", f"Не удалось выполнить {job.method} в чат {job.chat_id}: {job.receipt['error']}", level=logging.WARNING)
+        if not job.future.done():
+            job.future.set_exception(error)
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """Даёт очередям дослать накопленное, затем отменяет обработчики."""
+        workers = list(self._workers.values())
+        if not workers:
+            return
+        _, pending = await asyncio.wait(workers, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    def stats(self) -> dict[str, Any]:
+        # chat_id в открытый health не отдаём — только агрегаты.
+        return {
+            **self._stats,
+            "pending": sum(len(queue) for queue in self._queues.values()),
+            "active_chats": len(self._workers),
+            "paused_seconds": round(max((bucket.blocked_for() for bucket in self._buckets.values()), default=0.0), 1),
+            "per_chat_rate": SEND_PER_CHAT_RATE,
+            "global_rate": SEND_GLOBAL_RATE,
+            "max_attempts": SEND_MAX_ATTEMPTS,
+        }
+
+
+telegram_sender = TelegramSendQueue()
+
+
+def _edit_digest(payload: dict[str, Any]) -> str:
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def _not_modified_result(payload: dict[str, Any]) -> dict[str, Any]:
+    return {"ok": True, "result": {"message_id": payload["message_id"]}, "not_modified": True}
+
+
+@dataclass(slots=True)
+class _EditSlot:
+    pending: dict[str, Any] | None = None
+    settings: TelegramTunnelSettings | None = None
+    waiters: list[_SendJob] = field(default_factory=list)
+    last_digest: str | None = None
+    last_flush: float = 0.0
+    task: asyncio.Task | None = None
+
+
+class TelegramEditCoalescer:
+    """
+    Склеивает частые правки одного сообщения (chat_id, message_id).
+
+    Первая правка уходит сразу, следующие в пределах EDIT_MIN_INTERVAL_SECONDS
+    копятся: в Telegram отправляется только последний текст, а его результат
+    получают все, кто ждал. Правка, совпадающая с уже показанным текстом,
+    не отправляется вовсе; ответ Telegram «message is not modified» тоже
+    считается успехом.
+    """
+
+    def __init__(self, min_interval: float = EDIT_MIN_INTERVAL_SECONDS) -> None:
+        self.min_interval = min_interval
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._slots: OrderedDict[tuple[str, int], _EditSlot] = OrderedDict()
+        self._stats = {"requested": 0, "sent": 0, "coalesced": 0, "skipped": 0, "failed": 0}
+
+    def submit(self, settings: TelegramTunnelSettings, payload: dict[str, Any]) -> _SendJob:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._slots.clear()
+
+        job = telegram_sender.prepare(settings, "editMessageText", payload)
+        key = (job.chat_id, int(payload["message_id"]))
+        slot = self._slots.get(key)
+        if slot is None:
+            slot = self._slots[key] = _EditSlot()
+        self._slots.move_to_end(key)
+        self._stats["requested"] += 1
+
+        if slot.task is None and _edit_digest(payload) == slot.last_digest:
+            self._stats["skipped"] += 1
+            self._settle(job, result=_not_modified_result(payload))
+            return job
+
+        if slot.pending is not None:
+            self._stats["coalesced"] += 1
+        slot.pending = payload
+        slot.settings = settings
+        slot.waiters.append(job)
+        if slot.task is None:
+            slot.task = asyncio.create_task(self._flush(slot))
+        self._trim()
+        return job
+
+    def _trim(self) -> None:
+        while len(self._slots) > EDIT_SLOTS_LIMIT:
+            key, slot = next(iter(self._slots.items()))
+            if slot.task is not None:
+                break
+            del self._slots[key]
+
+    async def _flush(self, slot: _EditSlot) -> None:
+        waiters: list[_SendJob] = []
+        try:
+            while slot.pending is not None:
+                delay = slot.last_flush + self.min_interval - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                payload, settings, waiters = slot.pending, slot.settings, slot.waiters
+                slot.pending, slot.settings, slot.waiters = None, None, []
+
+                digest = _edit_digest(payload)
+                if digest == slot.last_digest:
+                    self._stats["skipped"] += 1
+                    for job in waiters:
+                        self._settle(job, result=_not_modified_result(payload))
+                    continue
+
+                slot.last_flush = time.monotonic()
+                sent = telegram_sender.submit(settings, "editMessageText", payload)
+                try:
+                    result = await asyncio.shield(sent.future)
+                except TelegramApiError as error:
+                    if not error.not_modified:
+                        self._stats["failed"] += 1
+                        for job in waiters:
+                            self._settle(job, sent=sent, error=error)
+                        continue
+                    result = _not_modified_result(payload)
+                except Exception as error:
+                    self._stats["failed"] += 1
+                    for job in waiters:
+                        self._settle(job, sent=sent, error=error)
+                    continue
+                else:
+                    self._stats["sent"] += 1
+                slot.last_digest = digest
+                for job in waiters:
+                    self._settle(job, sent=sent, result=result)
+            waiters = []
+        except asyncio.CancelledError:
+            for job in (*waiters, *slot.waiters):
+                if not job.future.done():
+                    job.future.cancel()
+            raise
+        finally:
+            slot.task = None
+
+    @staticmethod
+    def _settle(
+        job: _SendJob,
+        *,
+        sent: _SendJob | None = None,
+        result: dict[str, Any] | None = None,
+        error: Exception | None = None,
+    ) -> None:
+        receipt = job.receipt
+        if sent is not None:
+            receipt["attempts"] = sent.receipt["attempts"]
+        if error is not None:
+            receipt["status"] = "failed"
+            receipt["error"] = getattr(error, "detail", None) or str(error)
+            if not job.future.done():
+                job.future.set_exception(error)
+            return
+        receipt["status"] = "delivered"
+        receipt["message_id"] = _extract_message_id(result) or job.payload.get("message_id")
+        receipt["delivered_at"] = _now_iso()
+        if result.get("not_modified"):
+            receipt["not_modified"] = True
+        if not job.future.done():
+            job.future.set_result(result)
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """Досылает отложенные правки до остановки очереди отправки."""
+        tasks = [slot.task for slot in self._slots.values() if slot.task is not None]
+        if not tasks:
+            return
+        _, pending = await asyncio.wait(tasks, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            **self._stats,
+            "pending": sum(1 for slot in self._slots.values() if slot.pending is not None),
+            "min_interval_seconds": self.min_interval,
+        }
+
+
+telegram_edits = TelegramEditCoalescer()
+
+
+@dataclass(slots=True)
+class _Deletion:
+    chat_id: str
+    message_id: int
+    due_at: float
+    created_at: float
+
+    @property
+    def key(self) -> tuple[str, int]:
+        return (self.chat_id, self.message_id)
+
+    def to_record(self) -> dict[str, Any]:
+        return {"op": "add", "chat_id": self.chat_id, "message_id": self.message_id, "due_at": self.due_at, "created_at": self.created_at}
+
+
+class TelegramDeletionScheduler:
+    """
+    Отложенное удаление временных сообщений.
+
+    Расписание хранится в append-only журнале (строки add/done) и при старте
+    восстанавливается из него, так что перезапуск не оставляет сообщения
+    висеть навсегда. Один диспетчер спит до ближайшего срока по куче, а
+    наступившие удаления отправляет пачками: deleteMessages до
+    DELETE_BATCH_SIZE сообщений одного чата за вызов, через общую очередь
+    отправки. Когда выполненных записей в журнале становится заметно больше,
+    чем ожидающих, журнал переписывается целиком.
+    """
+
+    def __init__(self, journal_path: Path = DELETIONS_JOURNAL) -> None:
+        self.journal_path = journal_path
+        self._pending: dict[tuple[str, int], _Deletion] = {}
+        self._heap: list[tuple[float, str, int]] = []
+        self._journal_records = 0
+        # Строки журнала от schedule(): пишет их диспетчер вне event loop.
+        self._unwritten: list[dict[str, Any]] = []
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._task: asyncio.Task | None = None
+        self._wakeup: asyncio.Event | None = None
+        self._stats = {"scheduled": 0, "deleted": 0, "failed": 0, "retried": 0, "batches": 0}
+
+    def start(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._task is not None and not self._task.done() and self._loop is loop:
+            return
+        self._loop = loop
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        await self._write_journal()
+
+    def schedule(self, chat_id: str, message_id: int, delay_seconds: float) -> None:
+        self.start()
+        now = time.time()
+        deletion = _Deletion(chat_id=str(chat_id), message_id=int(message_id), due_at=now + delay_seconds, created_at=now)
+        # Диск не трогаем: строку допишет диспетчер, которого будит этот же вызов.
+        self._unwritten.append(deletion.to_record())
+        self._add(deletion)
+        self._stats["scheduled"] += 1
+        self._wakeup.set()
+
+    # ------------------------------------------------------------------ #
+
+    def _add(self, deletion: _Deletion) -> None:
+        self._pending[deletion.key] = deletion
+        heapq.heappush(self._heap, (deletion.due_at, deletion.chat_id, deletion.message_id))
+
+    def _append(self, records: list[dict[str, Any]]) -> None:
+        try:
+            self.journal_path.parent.mkdir(parents=True, exist_ok=True)
+            with self.journal_path.open("a", encoding="utf-8") as handle:
+                handle.write("".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records))
+            self._journal_records += len(records)
+        except OSError as error:
+            log("ERROR", f"Не удалось записать журнал удалений Telegram: {error}", level=logging.WARNING)
+
+    async def _write_journal(self) -> None:
+        # Короткие строки без fsync: дописываются в кэш ОС и переживают перезапуск процесса.
+        records, self._unwritten = self._unwritten, []
+        if records:
+            await asyncio.to_thread(self._append, records)
+
+    def _load(self) -> list[_Deletion]:
+        pending: dict[tuple[str, int], _Deletion] = {}
+        try:
+            lines = self.journal_path.read_text(encoding="utf-8").splitlines()
+        except FileNotFoundError:
+            return []
+        for line in lines:
+            try:
+                record = json.loads(line)
+                key = (str(record["chat_id"]), int(record["message_id"]))
+                if record.get("op") == "done":
+                    pending.pop(key, None)
+                else:
+                    pending[key] = _Deletion(
+                        chat_id=key[0],
+                        message_id=key[1],
+                        due_at=float(record["due_at"]),
+                        created_at=float(record.get("created_at") or record["due_at"]),
+                    )
+            except (ValueError, KeyError, TypeError):
+                continue  # недописанная строка после аварийной остановки
+        return list(pending.values())
+
+    def _rewrite(self, deletions: list[_Deletion]) -> None:
+        self.journal_path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = self.journal_path.with_name(f".{self.journal_path.name}.{uuid4().hex}.tmp")
+        with temp_path.open("w", encoding="utf-8") as handle:
+            handle.write("".join(json.dumps(item.to_record(), ensure_ascii=False) + "\n" for item in deletions))
+            handle.flush()
+            os.fsync(handle.fileno())
+        os.replace(temp_path, self.journal_path)
+
+    async def _compact(self) -> None:
+        # Журнал пишет только диспетчер, поэтому строки, пришедшие, пока файл
+        # переписывается, остаются в _unwritten и попадут уже в новый файл.
+        snapshot = list(self._pending.values())
+        try:
+            await asyncio.to_thread(self._rewrite, snapshot)
+            self._journal_records = len(snapshot)
+        except OSError as error:
+            log("ERROR", f"Не удалось переписать журнал удалений Telegram: {error}", level=logging.WARNING)
+
+    async def _run(self) -> None:
+        restored = await asyncio.to_thread(self._load)
+        for deletion in restored:
+            if deletion.key not in self._pending:
+                self._add(deletion)
+        if restored:
+            log("TELEGRAM", f"Восстановлено отложенных удалений: {len(restored)}")
+        await self._compact()
+
+        while True:
+            self._wakeup.clear()
+            await self._write_journal()
+            due = self._pop_due()
+            if due:
+                await self._dispatch(due)
+                continue
+            timeout = min(self._heap[0][0] - time.time(), 300.0) if self._heap else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except TimeoutError:
+                pass
+
+    def _pop_due(self) -> list[_Deletion]:
+        horizon = time.time() + DELETE_BATCH_WINDOW_SECONDS
+        due: list[_Deletion] = []
+        while self._heap and self._heap[0][0] <= horizon:
+            due_at, chat_id, message_id = heapq.heappop(self._heap)
+            deletion = self._pending.get((chat_id, message_id))
+            # В куче могут остаться устаревшие записи (перенос срока) — берём только актуальную.
+            if deletion is not None and deletion.due_at == due_at:
+                due.append(deletion)
+        return due
+
+    async def _dispatch(self, due: list[_Deletion]) -> None:
+        settings = load_tunnel_settings()
+        by_chat: dict[str, list[_Deletion]] = {}
+        for deletion in due:
+            by_chat.setdefault(deletion.chat_id, []).append(deletion)
+
+        batches = [
+            items[start:start + DELETE_BATCH_SIZE]
+            for items in by_chat.values()
+            for start in range(0, len(items), DELETE_BATCH_SIZE)
+        ]
+        outcomes = await asyncio.gather(*(self._delete_batch(settings, batch) for batch in batches), return_exceptions=True)
+
+        done: list[_Deletion] = []
+        retry: list[_Deletion] = []
+        for batch, outcome in zip(batches, outcomes):
+            self._stats["batches"] += 1
+            if not isinstance(outcome, BaseException):
+                self._stats["deleted"] += len(batch)
+                done.extend(batch)
+                continue
+            expired = [item for item in batch if time.time() - item.created_at >= DELETE_GIVE_UP_SECONDS]
+            if (isinstance(outcome, TelegramApiError) and not outcome.transient) or len(expired) == len(batch):
+                # Сообщение уже удалено вручную или слишком старое — повтор не поможет.
+                self._stats["failed"] += len(batch)
+                done.extend(batch)
+                log("ERROR", f"Не удалось удалить временные сообщения {[item.message_id for item in batch]}: {getattr(outcome, 'detail', outcome)}", level=logging.WARNING)
+            else:
+                self._stats["retried"] += len(batch)
+                retry.extend(batch)
+
+        for deletion in retry:
+            deletion.due_at = time.time() + DELETE_RETRY_SECONDS
+            self._add(deletion)
+        for deletion in done:
+            self._pending.pop(deletion.key, None)
+        self._unwritten.extend(
+            [{"op": "done", "chat_id": item.chat_id, "message_id": item.message_id} for item in done]
+            + [item.to_record() for item in retry]
+        )
+        await self._write_journal()
+        if self._journal_records > 2 * len(self._pending) + 200:
+            await self._compact()
+
+    async def _delete_batch(self, settings: TelegramTunnelSettings, batch: list[_Deletion]) -> None:
+        chat_id = batch[0].chat_id
+        if len(batch) == 1:
+            job = telegram_sender.submit(settings, "deleteMessage", {"chat_id": chat_id, "message_id": batch[0].message_id})
+        else:
+            message_ids = sorted(item.message_id for item in batch)
+            job = telegram_sender.submit(settings, "deleteMessages", {"chat_id": chat_id, "message_ids": message_ids})
+        await job.future
+        log("TELEGRAM", f"Удалено по таймеру сообщений: {len(batch)} (чат {chat_id}).")
+
+    def stats(self) -> dict[str, Any]:
+        next_due = min((item.due_at for item in self._pending.values()), default=None)
+        return {
+            **self._stats,
+            "pending": len(self._pending),
+            "next_due_in_seconds": round(max(next_due - time.time(), 0.0), 1) if next_due is not None else None,
+            "running": self._task is not None and not self._task.done(),
+        }
+
+
+telegram_deletions = TelegramDeletionScheduler()
+
+
+def _delete_after_edits(chat_id: str, edit_jobs: list[_SendJob], message_ids: list[int]) -> None:
+    """Ставит лишние части на удаление, когда все правки оставшихся частей успешно доставлены."""
+    edits = asyncio.gather(*(job.future for job in edit_jobs), return_exceptions=True)
+
+    def on_edited(outcome: asyncio.Future) -> None:
+        if outcome.cancelled() or any(isinstance(item, BaseException) for item in outcome.result()):
+            log("TELEGRAM", f"Правка не доставлена — лишние части {message_ids} не удаляются", level=logging.WARNING)
+            return
+        for message_id in message_ids:
+            telegram_deletions.schedule(chat_id, message_id, 0)
+
+    edits.add_done_callback(on_edited)
 
 
 async def send_tunnel_message(request: Request, raw_payload: dict[str, Any]) -> dict[str, Any]:
@@ -334,17 +1082,19 @@ async def send_tunnel_message(request: Request, raw_payload: dict[str, Any]) ->
     _require_secret(request, settings)
 
     payload = _normalize_payload(raw_payload)
+    _require_configured(settings)
     text = _prepare_text(payload)
 
-    if len(text) > MAX_SAFE_MESSAGE_LENGTH:
+    # Длинный текст делится по безопасным границам, не разрывая теги и сущности разметки.
+    parts = split_message(text, payload["parse_mode"], MAX_SAFE_MESSAGE_LENGTH)
+    if len(parts) > MAX_MESSAGE_PARTS:
         raise HTTPException(
             status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
-            detail="Сообщение слишком длинное для безопасной отправки одним запросом.",
+            detail=f"Сообщение слишком длинное: больше {MAX_MESSAGE_PARTS} частей по {MAX_SAFE_MESSAGE_LENGTH} символов.",
         )
 
     base_payload: dict[str, Any] = {
         "chat_id": settings.chat_id,
-        "text": text,
         "disable_web_page_preview": payload["disable_web_page_preview"],
     }
 
@@ -352,35 +1102,41 @@ async def send_tunnel_message(request: Request, raw_payload: dict[str, Any]) ->
         base_payload["parse_mode"] = payload["parse_mode"]
 
     if payload["kind"] == "replace":
-        message_id = payload.get("message_id")
-        if not message_id:
+        message_ids = payload.get("message_ids") or []
+        if not message_ids:
             raise HTTPException(
                 status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
-                detail="Для kind=replace нужно передать message_id.",
+                detail="Для kind=replace нужно передать message_id (или message_ids для сообщения из нескольких частей).",
             )
-
-        telegram_result = await _telegram_api_call(
-            "editMessageText",
-            {
-                **base_payload,
-                "message_id": message_id,
-            },
-            settings,
-        )
-        message_id_result = _extract_message_id(telegram_result) or int(message_id)
         action = "edited"
     else:
-        if payload.get("reply_to_message_id"):
-            base_payload["reply_to_message_id"] = payload["reply_to_message_id"]
-
-        telegram_result = await _telegram_api_call("sendMessage", base_payload, settings)
-        message_id_result = _extract_message_id(telegram_result)
+        message_ids = []
         action = "sent"
 
-    if payload["kind"] == "temporary":
-        delay_seconds = payload["delete_after_seconds"] or settings.delete_after_seconds
-        if message_id_result and delay_seconds > 0:
-            asyncio.create_task(_delete_message_later(settings, message_id_result, delay_seconds))
+    delay_seconds = payload["delete_after_seconds"] or settings.delete_after_seconds
+
+    def on_delivered(telegram_result: dict[str, Any]) -> None:
+        # Вызывается очередью после доставки — и когда клиент ждёт, и при wait=false.
+        if payload["kind"] != "temporary" or delay_seconds <= 0:
+            return
+        delivered_id = _extract_message_id(telegram_result)
+        if delivered_id:
+            telegram_deletions.schedule(settings.chat_id, delivered_id, delay_seconds)
+
+    # Части уходят одна за другой через очередь чата, поэтому порядок сохраняется.
+    jobs: list[_SendJob] = []
+    for part, message_id in zip(parts, message_ids):
+        # Частые правки одного сообщения склеиваются: уходит только последний текст.
+        jobs.append(telegram_edits.submit(settings, {**base_payload, "text": part, "message_id": message_id}))
+    for index, part in enumerate(parts[len(message_ids):]):
+        api_payload = {**base_payload, "text": part}
+        if index == 0 and not message_ids and payload.get("reply_to_message_id"):
+            api_payload["reply_to_message_id"] = payload["reply_to_message_id"]
+        jobs.append(telegram_sender.submit(settings, "sendMessage", api_payload, on_delivered=on_delivered))
+    # Новый текст короче прежнего — лишние части старого сообщения удаляются,
+    # но только когда правки дошли: иначе в чате осталось бы обрезанное сообщение.
+    if len(message_ids) > len(parts):
+        _delete_after_edits(settings.chat_id, jobs, message_ids[len(parts):])
 
     result = {
         "ok": True,
@@ -388,15 +1144,59 @@ async def send_tunnel_message(request: Request, raw_payload: dict[str, Any]) ->
         "kind": payload["kind"],
         "format": payload["format"],
         "chat_id": settings.chat_id,
-        "message_id": message_id_result,
-        "delete_after_seconds": payload["delete_after_seconds"] or settings.delete_after_seconds,
+        "message_id": message_ids[0] if message_ids else None,
+        "message_ids": message_ids[:len(parts)],
+        "parts": len(parts),
+        "delete_after_seconds": delay_seconds,
+        "receipt_id": jobs[0].receipt_id,
+        "receipt_ids": [job.receipt_id for job in jobs],
+        "receipt_url": f"/mytelegram/receipts/{jobs[0].receipt_id}",
         "server": "render",
     }
 
-    log("TELEGRAM", f"Сообщение отправлено: action={action}, kind={payload['kind']}, message_id={message_id_result}")
+    if not payload["wait"]:
+        log("TELEGRAM", f"Сообщение поставлено в очередь: action={action}, kind={payload['kind']}, parts={len(parts)}, receipt={jobs[0].receipt_id}")
+        return {**result, "action": "queued", "queued_action": action}
+
+    # shield: если клиент отключится, сообщение всё равно уйдёт, а статус останется в квитанции.
+    outcomes = await asyncio.shield(asyncio.gather(*(job.future for job in jobs), return_exceptions=True))
+    for outcome in outcomes:
+        if isinstance(outcome, BaseException):
+            raise outcome
+
+    result["message_ids"] = [
+        _extract_message_id(telegram_result) or job.payload.get("message_id")
+        for job, telegram_result in zip(jobs, outcomes)
+    ]
+    result["message_id"] = result["message_ids"][0]
+    if len(parts) <= len(message_ids) and all(telegram_result.get("not_modified") for telegram_result in outcomes):
+        result["not_modified"] = True
+
+    log("TELEGRAM", f"Сообщение отправлено: action={action}, kind={payload['kind']}, parts={len(parts)}, message_id={result['message_id']}")
     return result
 
 
+async def get_delivery_receipt(request: Request, receipt_id: str) -> dict[str, Any]:
+    settings = load_tunnel_settings()
+    _require_secret(request, settings)
+
+    receipt = telegram_sender.receipt(receipt_id)
+    if receipt is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Квитанция не найдена или уже устарела.",
+        )
+    return {"ok": True, **receipt}
+
+
+async def reload_tunnel(request: Request) -> dict[str, Any]:
+    # Секрет проверяется по действующему снимку, до перечитывания окружения.
+    _require_secret(request, load_tunnel_settings())
+    reload_tunnel_settings()
+    log("TELEGRAM", "Настройки туннеля перечитаны из окружения.")
+    return await tunnel_status()
+
+
 async def tunnel_status() -> dict[str, Any]:
     settings = load_tunnel_settings()
     return {
@@ -406,4 +1206,9 @@ async def tunnel_status() -> dict[str, Any]:
         "timeout_seconds": settings.timeout_seconds,
         "delete_after_seconds": settings.delete_after_seconds,
         "max_message_length": MAX_SAFE_MESSAGE_LENGTH,
+        "max_message_parts": MAX_MESSAGE_PARTS,
+        "http_pool": http_clients.stats()["clients"].get("telegram"),
+        "send_queue": telegram_sender.stats(),
+        "edit_coalescer": telegram_edits.stats(),
+        "deletions": telegram_deletions.stats(),
     }
@@ -0,0 +1,47 @@
+from __future__ import annotations
+
+import asyncio
+
+import httpx
+
+
+def test_sync_requests_respect_per_agent_concurrency(workdir, monkeypatch):
+    from bot import app
+    from services.agents.jobs import agent_jobs
+    from services.agents.registry import agent_registry
+    from services.agents.writer import agent_writer
+
+    monkeypatch.setattr(agent_jobs, "per_agent", 2)
+    running = 0
+    peak = 0
+
+    class SlowCountingAgent:
+        name = "slow_counting_concurrency"
+
+        async def run(self, command):
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.05)
+            running -= 1
+            return {"ok": True, "text": command.query}
+
+    agent_registry.register(SlowCountingAgent())
+
+    async def scenario() -> list[httpx.Response]:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            responses = await asyncio.gather(*(
+                client.post(
+                    "/api/agents/inbox",
+                    json={"agent": "slow_counting_concurrency", "query": "ping", "request_id": f"slot-{index}"},
+                )
+                for index in range(6)
+            ))
+        await agent_writer.stop()
+        return list(responses)
+
+    responses = asyncio.run(scenario())
+
+    assert [response.status_code for response in responses] == [200] * 6
+    assert peak == 2
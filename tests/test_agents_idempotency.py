@@ -0,0 +1,37 @@
+from __future__ import annotations
+
+import asyncio
+
+import httpx
+
+
+def test_concurrent_duplicates_run_agent_once(workdir):
+    from bot import app
+    from services.agents.registry import agent_registry
+    from services.agents.writer import agent_writer
+
+    runs: list[str] = []
+
+    class SlowEchoAgent:
+        name = "slow_echo_duplicates"
+
+        async def run(self, command):
+            runs.append(command.request_id)
+            await asyncio.sleep(0.2)
+            return {"ok": True, "text": command.query}
+
+    agent_registry.register(SlowEchoAgent())
+    payload = {"agent": "slow_echo_duplicates", "query": "ping", "request_id": "dup-request-1"}
+
+    async def scenario() -> list[httpx.Response]:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            responses = await asyncio.gather(*(client.post("/api/agents/inbox", json=payload) for _ in range(5)))
+        await agent_writer.stop()
+        return list(responses)
+
+    responses = asyncio.run(scenario())
+
+    assert [response.status_code for response in responses] == [200] * 5
+    assert runs == ["dup-request-1"]
+    assert sum(1 for response in responses if response.json()["idempotent"]) == 4
@@ -0,0 +1,31 @@
+from __future__ import annotations
+
+import asyncio
+
+import httpx
+
+
+def test_deleting_a_duplicate_keeps_the_shared_blob(workdir):
+    from bot import app
+    from services.filevault.blobs import blob_store
+
+    async def scenario() -> tuple[int, int, bytes]:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            upload = await client.post(
+                "/api/filevault/upload",
+                files=[
+                    ("files", ("first.txt", b"same bytes", "text/plain")),
+                    ("files", ("second.txt", b"same bytes", "text/plain")),
+                ],
+            )
+            assert upload.status_code == 200
+            first, second = (item["file_id"] for item in upload.json()["files"])
+
+            # Как после перезапуска: счётчики ссылок ещё не построены.
+            blob_store.reset_refs()
+            deleted = await client.delete(f"/api/filevault/files/{first}")
+            opened = await client.get(f"/files/open/{second}")
+            return deleted.status_code, opened.status_code, opened.content
+
+    assert asyncio.run(scenario()) == (200, 200, b"same bytes")
@@ -0,0 +1,92 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+from uuid import uuid4
+
+import httpx
+
+
+def _write_external(root, file_id: str, name: str, body: bytes) -> None:
+    # Как внешний инструмент: blob рядом и sidecar через атомарную замену.
+    (root / f"{file_id}.bin").write_bytes(body)
+    meta = {
+        "file_id": file_id,
+        "original_name": name,
+        "storage_name": f"{file_id}.bin",
+        "content_type": "text/plain",
+        "size_bytes": len(body),
+        "uploaded_at": "2026-01-01T00:00:00+00:00",
+        "folder_id": None,
+    }
+    temp_path = root / f"{file_id}.json.tmp"
+    temp_path.write_text(json.dumps(meta, ensure_ascii=False), encoding="utf-8")
+    os.replace(temp_path, root / f"{file_id}.json")
+
+
+def test_search_follows_sidecar_changes_on_disk(workdir, monkeypatch):
+    from bot import app
+    from services.filevault.index import file_index
+    from services.filevault.paths import FILEVAULT_ROOT
+
+    monkeypatch.setattr(file_index, "recheck_seconds", 0.0)
+    root = workdir / FILEVAULT_ROOT
+
+    async def scenario() -> list[list[str]]:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+
+            async def names(query: str) -> list[str]:
+                response = await client.get("/api/filevault/search", params={"q": query})
+                assert response.status_code == 200
+                return sorted(item["original_name"] for item in response.json()["files"])
+
+            upload = await client.post(
+                "/api/filevault/upload",
+                files=[("files", ("own.txt", "квантовый отчёт".encode(), "text/plain"))],
+            )
+            assert upload.status_code == 200
+
+            seen = [await names("квантовый")]
+            file_id = uuid4().hex
+            _write_external(root, file_id, "external.txt", "квантовый журнал".encode())
+            seen.append(await names("квантовый"))
+            _write_external(root, file_id, "renamed.txt", "квантовый журнал".encode())
+            seen.append(await names("квантовый"))
+            (root / f"{file_id}.json").unlink()
+            seen.append(await names("квантовый"))
+            return seen
+
+    assert asyncio.run(scenario()) == [
+        ["own.txt"],
+        ["external.txt", "own.txt"],
+        ["own.txt", "renamed.txt"],
+        ["own.txt"],
+    ]
+
+
+def test_own_write_does_not_hide_external_change(workdir, monkeypatch):
+    from bot import app
+    from services.filevault.index import file_index
+    from services.filevault.paths import FILEVAULT_ROOT
+
+    # Плановая сверка с диском не наступит: внешнюю правку должна заметить сама запись через API.
+    monkeypatch.setattr(file_index, "recheck_seconds", 3600.0)
+    root = workdir / FILEVAULT_ROOT
+
+    async def scenario() -> list[str]:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+
+            async def upload(name: str) -> None:
+                response = await client.post("/api/filevault/upload", files=[("files", (name, b"data", "text/plain"))])
+                assert response.status_code == 200
+
+            await upload("first.txt")
+            _write_external(root, uuid4().hex, "external.txt", b"external")
+            await upload("second.txt")
+            response = await client.get("/api/filevault/files")
+            return sorted(item["original_name"] for item in response.json()["files"])
+
+    assert asyncio.run(scenario()) == ["external.txt", "first.txt", "second.txt"]
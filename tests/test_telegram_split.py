@@ -0,0 +1,59 @@
+from __future__ import annotations
+
+import random
+
+from services.telegram_split import split_message
+
+TEXT_FRAGMENTS = ("слово", "word", " ", "\n", "\n\n", " " * 300, "\n" * 300, "x" * 500)
+HTML_ATOMS = ("&amp;", "&lt;", "&#128512;", "<br/>")
+HTML_WRAPPERS = (
+    ("<b>", "</b>"), ("<i>", "</i>"), ("<pre>", "</pre>"), ("<code>", "</code>"),
+    ('<a href="https://example.com/path">', "</a>"),
+)
+MARKDOWN_ATOMS = ("\\.", "\\*", "[ссылка](https://example\\.com)")
+MARKDOWN_WRAPPERS = (("*", "*"), ("_", "_"), ("__", "__"), ("~", "~"), ("||", "||"), ("```python\n", "```"))
+
+
+def _random_text(rng: random.Random, atoms: tuple[str, ...], wrappers: tuple[tuple[str, str], ...], depth: int = 0) -> str:
+    """Случайный, но корректно вложенный текст: пробелы и переводы строк длинными сериями, теги до трёх уровней."""
+    pieces = []
+    for _ in range(rng.randint(1, 12 if depth else 60)):
+        roll = rng.random()
+        if wrappers and depth < 3 and roll < 0.15:
+            opener, closer = rng.choice(wrappers)
+            # Внутри ``` разметка не действует — вкладываем только текст.
+            inner_wrappers = () if opener.startswith("```") else wrappers
+            pieces.append(opener + _random_text(rng, atoms, inner_wrappers, depth + 1) + closer)
+        elif atoms and roll < 0.3:
+            pieces.append(rng.choice(atoms))
+        else:
+            pieces.append(rng.choice(TEXT_FRAGMENTS))
+    return "".join(pieces)
+
+
+def test_reported_whitespace_cases_stay_within_limit():
+    for text, parse_mode in (
+        ("<pre>a\n" + " " * 6000 + "b</pre>", "HTML"),
+        ("x" + "\n" * 8000 + "y", "HTML"),
+        ("x" + "\n" * 8000 + "y", ""),
+    ):
+        parts = split_message(text, parse_mode, 3900)
+        assert parts
+        assert all(len(part) <= 3900 for part in parts)
+
+
+def test_every_part_fits_the_limit():
+    rng = random.Random(24)
+    for parse_mode, atoms, wrappers in (
+        ("HTML", HTML_ATOMS, HTML_WRAPPERS),
+        ("MarkdownV2", MARKDOWN_ATOMS, MARKDOWN_WRAPPERS),
+        ("", (), ()),
+    ):
+        for _ in range(150):
+            text = _random_text(rng, atoms, wrappers)
+            limit = rng.randint(200, 4000)
+            parts = split_message(text, parse_mode, limit)
+            assert all(len(part) <= limit for part in parts), (parse_mode, limit, text)
+            if not parse_mode:
+                # Без разметки ничего не добавляется: теряться могут только пробелы на стыках частей.
+                assert "".join("".join(parts).split()) == "".join(text.split())